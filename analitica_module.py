@@ -0,0 +1,355 @@
+"""
+Exportación columnar del historial de solicitudes para análisis.
+
+exportar() copia a un directorio las filas de `solicitudes` con id mayor que la
+marca de agua de la exportación anterior, particionadas por día: cada exportación
+agrega una parte por día con un .npy por columna. Las columnas de texto con pocos
+valores (CATEGORICAS) se guardan como códigos int16 con su diccionario en
+estado.json y el resto del texto como unicode de ancho fijo, así que todas se
+pueden abrir con np.load(mmap_mode='r'). compactar() junta las partes de cada día.
+
+    analitica/
+        estado.json                              marca de agua, esquema y diccionarios
+        dia=2025-12-09/
+            parte-000000000001-000000000042/     ids de la primera y la última fila
+                id.npy  fecha.npy  decision.npy  score_final.npy ...
+
+ConsultaColumnar calcula tasas de decisión y distribuciones recorriendo las
+columnas de cada parte con NumPy (memoria mapeada), sin pasar por SQLite, y
+descarta por nombre los días fuera del rango pedido.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from db_module import RUTA_BASE, conectar
+
+# Directorio de la exportación: ANALITICA_DIR o analitica/ junto a la app
+RUTA_ANALITICA = os.environ.get('ANALITICA_DIR', os.path.join(RUTA_BASE, 'analitica'))
+
+# Columnas de texto que se guardan como códigos de diccionario (-1 = NULL)
+CATEGORICAS = {'genero', 'edad', 'region', 'credit_worthiness', 'decision'}
+
+# Filas leídas de SQLite por consulta durante la exportación
+BLOQUE_FILAS = 50_000
+
+ARCHIVO_ESTADO = 'estado.json'
+SIN_FECHA = 'sin_fecha'
+
+
+def _tipo_columna(nombre, declarado):
+    """Tipo de la columna en la exportación según su tipo declarado en SQLite"""
+    if nombre == 'id':
+        return 'int64'
+    if nombre == 'fecha':
+        return 'datetime64[s]'
+    if nombre in CATEGORICAS:
+        return 'categoria'
+    if declarado.upper() in ('INTEGER', 'REAL'):
+        return 'float64'  # NULL -> NaN
+    return 'texto'
+
+
+def _vacia(tipo, n):
+    """Columna de `n` valores nulos (partes exportadas antes de que existiera la columna)"""
+    if tipo == 'categoria':
+        return np.full(n, -1, dtype=np.int16)
+    if tipo == 'texto':
+        return np.full(n, '', dtype='<U1')
+    if tipo == 'datetime64[s]':
+        return np.full(n, np.datetime64('NaT'), dtype='datetime64[s]')
+    return np.full(n, np.nan)
+
+
+def _codificar(valores, diccionario):
+    """Códigos int16 de `valores`; los valores nuevos se agregan al final de `diccionario`"""
+    indices = {valor: i for i, valor in enumerate(diccionario)}
+    codigos = np.empty(len(valores), dtype=np.int16)
+    for k, valor in enumerate(valores):
+        if valor is None:
+            codigos[k] = -1
+            continue
+        codigo = indices.get(valor)
+        if codigo is None:
+            codigo = indices[valor] = len(diccionario)
+            diccionario.append(valor)
+        codigos[k] = codigo
+    return codigos
+
+
+def _arreglo(valores, tipo, diccionario):
+    if tipo == 'categoria':
+        return _codificar(valores, diccionario)
+    if tipo == 'texto':
+        return np.array(['' if v is None else str(v) for v in valores])
+    return np.array(valores, dtype=tipo)
+
+
+# ============ ESTADO Y PARTES ============
+
+def leer_estado(destino):
+    """Marca de agua (último id exportado), esquema {columna: tipo} y diccionarios"""
+    ruta = os.path.join(destino, ARCHIVO_ESTADO)
+    if not os.path.exists(ruta):
+        return {'ultimo_id': 0, 'esquema': {}, 'diccionarios': {}}
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def _guardar_estado(destino, estado):
+    ruta = os.path.join(destino, ARCHIVO_ESTADO)
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+        json.dump(estado, archivo, ensure_ascii=False, indent=1)
+    os.replace(ruta + '.tmp', ruta)
+
+
+def _nombre_parte(primero, ultimo):
+    return f'parte-{primero:012d}-{ultimo:012d}'
+
+
+def _rango_parte(nombre):
+    _, primero, ultimo = nombre.split('-')
+    return int(primero), int(ultimo)
+
+
+def _dias(destino):
+    if not os.path.isdir(destino):
+        return []
+    return sorted(nombre[len('dia='):] for nombre in os.listdir(destino) if nombre.startswith('dia='))
+
+
+def _partes_dia(destino, dia, cubiertas=False):
+    """
+    Partes vigentes del día. Una parte compactada cubre el rango de ids de las que
+    juntó; si alguna quedó (compactar() se cortó antes de borrarla) se ignora, o se
+    devuelve sola con cubiertas=True.
+    """
+    directorio = os.path.join(destino, f'dia={dia}')
+    nombres = [nombre for nombre in sorted(os.listdir(directorio)) if nombre.startswith('parte-')]
+    rangos = {nombre: _rango_parte(nombre) for nombre in nombres}
+    seleccion = [nombre for nombre in nombres
+                 if cubiertas == any(otro != nombre and rangos[otro][0] <= rangos[nombre][0]
+                                     and rangos[nombre][1] <= rangos[otro][1] for otro in nombres)]
+    return [os.path.join(directorio, nombre) for nombre in seleccion]
+
+
+def _escribir_parte(directorio_dia, nombre, columnas):
+    """Escribe la parte en un directorio oculto y la publica con un rename"""
+    os.makedirs(directorio_dia, exist_ok=True)
+    temporal = os.path.join(directorio_dia, f'.{nombre}')
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+    for columna, valores in columnas.items():
+        np.save(os.path.join(temporal, f'{columna}.npy'), valores)
+    os.rename(temporal, os.path.join(directorio_dia, nombre))
+
+
+def _descartar_partes_huerfanas(destino, ultimo_id):
+    """Borra partes de una exportación que no llegó a guardar su marca de agua"""
+    for dia in _dias(destino):
+        for parte in _partes_dia(destino, dia):
+            if _rango_parte(os.path.basename(parte))[0] > ultimo_id:
+                shutil.rmtree(parte)
+
+
+# ============ EXPORTACIÓN ============
+
+def _escribir_bloque(destino, filas, esquema, diccionarios):
+    """Escribe un bloque de filas (ordenadas por id) como una parte por día"""
+    valores = dict(zip(esquema, zip(*filas)))
+    columnas = {columna: _arreglo(valores[columna], tipo, diccionarios.setdefault(columna, []))
+                for columna, tipo in esquema.items()}
+    ids = columnas['id']
+    dias = np.datetime_as_string(columnas['fecha'], unit='D')
+    escritos = []
+    for dia in np.unique(dias).tolist():
+        mascara = dias == dia
+        dia = SIN_FECHA if dia == 'NaT' else dia
+        ids_dia = ids[mascara]
+        _escribir_parte(os.path.join(destino, f'dia={dia}'), _nombre_parte(int(ids_dia[0]), int(ids_dia[-1])),
+                        {columna: valores_columna[mascara] for columna, valores_columna in columnas.items()})
+        escritos.append(dia)
+    return escritos
+
+
+def exportar(destino=RUTA_ANALITICA, ruta_db=None, bloque=BLOQUE_FILAS, compactar_dias=True):
+    """
+    Exporta las solicitudes nuevas (id > marca de agua) y avanza la marca de agua.
+
+    La marca se guarda al final: si la exportación se corta, las partes que dejó
+    se descartan en la siguiente y esas filas se vuelven a exportar.
+
+    Args:
+        destino: Directorio de la exportación
+        ruta_db: Base a exportar (default la de db_module)
+        bloque: Filas por consulta a SQLite
+        compactar_dias: Juntar después las partes de los días exportados
+
+    Returns:
+        dict: Filas exportadas, días tocados y la nueva marca de agua
+    """
+    os.makedirs(destino, exist_ok=True)
+    estado = leer_estado(destino)
+    _descartar_partes_huerfanas(destino, estado['ultimo_id'])
+
+    conn = conectar(ruta_db)
+    conn.row_factory = None
+    try:
+        esquema = {fila[1]: _tipo_columna(fila[1], fila[2])
+                   for fila in conn.execute('PRAGMA table_info(solicitudes)')}
+        sql = f"SELECT {', '.join(esquema)} FROM solicitudes WHERE id > ? ORDER BY id LIMIT ?"
+        ultimo_id = estado['ultimo_id']
+        filas_exportadas = 0
+        dias = set()
+        while True:
+            filas = conn.execute(sql, (ultimo_id, bloque)).fetchall()
+            if not filas:
+                break
+            dias.update(_escribir_bloque(destino, filas, esquema, estado['diccionarios']))
+            ultimo_id = filas[-1][0]
+            filas_exportadas += len(filas)
+    finally:
+        conn.close()
+
+    estado['esquema'] = {**estado['esquema'], **esquema}
+    estado['ultimo_id'] = ultimo_id
+    _guardar_estado(destino, estado)
+
+    if compactar_dias and dias:
+        compactar(destino, dias)
+    return {'filas': filas_exportadas, 'dias': sorted(dias), 'ultimo_id': ultimo_id}
+
+
+def compactar(destino=RUTA_ANALITICA, dias=None):
+    """
+    Junta las partes de cada día (todos o los de `dias`) en una sola.
+
+    Returns:
+        int: Días compactados
+    """
+    esquema = leer_estado(destino)['esquema']
+    compactados = 0
+    for dia in (sorted(dias) if dias is not None else _dias(destino)):
+        for parte in _partes_dia(destino, dia, cubiertas=True):
+            shutil.rmtree(parte)
+        partes = _partes_dia(destino, dia)
+        if len(partes) < 2:
+            continue
+        columnas = {}
+        for columna, tipo in esquema.items():
+            piezas = []
+            for parte in partes:
+                ruta = os.path.join(parte, f'{columna}.npy')
+                if os.path.exists(ruta):
+                    piezas.append(np.load(ruta))
+                else:
+                    piezas.append(_vacia(tipo, len(np.load(os.path.join(parte, 'id.npy'), mmap_mode='r'))))
+            columnas[columna] = np.concatenate(piezas)
+        primero = _rango_parte(os.path.basename(partes[0]))[0]
+        ultimo = _rango_parte(os.path.basename(partes[-1]))[1]
+
+        # La parte nueva cubre a las anteriores, que dejan de leerse antes de borrarse
+        _escribir_parte(os.path.join(destino, f'dia={dia}'), _nombre_parte(primero, ultimo), columnas)
+        for parte in partes:
+            shutil.rmtree(parte)
+        compactados += 1
+    return compactados
+
+
+# ============ CONSULTAS ============
+
+class ConsultaColumnar:
+    """
+    Consultas sobre una exportación: cada método recorre las partes de los días en
+    [desde, hasta] (fechas 'YYYY-MM-DD', inclusive) con las columnas mapeadas en
+    memoria y acumula el resultado parte por parte.
+    """
+
+    def __init__(self, destino=RUTA_ANALITICA):
+        self.destino = destino
+        self.estado = leer_estado(destino)
+
+    def partes(self, desde=None, hasta=None):
+        """(día, ruta) de cada parte; con un rango se omiten las filas sin fecha"""
+        for dia in _dias(self.destino):
+            if desde is not None or hasta is not None:
+                if dia == SIN_FECHA or (desde and dia < desde) or (hasta and dia > hasta):
+                    continue
+            for parte in _partes_dia(self.destino, dia):
+                yield dia, parte
+
+    def columna(self, parte, nombre):
+        """Columna de una parte, mapeada en memoria (nulos si la parte es anterior a la columna)"""
+        ruta = os.path.join(parte, f'{nombre}.npy')
+        if os.path.exists(ruta):
+            return np.load(ruta, mmap_mode='r')
+        tipo = self.estado['esquema'][nombre]
+        return _vacia(tipo, len(np.load(os.path.join(parte, 'id.npy'), mmap_mode='r')))
+
+    def _codigo(self, columna, valor):
+        diccionario = self.estado['diccionarios'].get(columna, [])
+        return diccionario.index(valor) if valor in diccionario else -2  # -2: no aparece nunca
+
+    def tasas_decision(self, desde=None, hasta=None, por_dia=False):
+        """
+        Cantidad y tasa de cada decisión.
+
+        Returns:
+            dict: {'total', 'decisiones': {decision: {'cantidad', 'tasa'}}}; con
+            por_dia, un dict así por día
+        """
+        decisiones = self.estado['diccionarios'].get('decision', [])
+        conteos = {}
+        for dia, parte in self.partes(desde, hasta):
+            codigos = self.columna(parte, 'decision')
+            # Índice 0 = decisión nula (código -1)
+            conteo = np.bincount(codigos.astype(np.intp) + 1, minlength=len(decisiones) + 1)
+            clave = dia if por_dia else None
+            conteos[clave] = conteos.get(clave, 0) + conteo
+
+        def formatear(conteo):
+            total = int(conteo.sum())
+            return {'total': total, 'decisiones': {
+                decision: {'cantidad': int(c), 'tasa': round(int(c) / total, 4) if total else 0.0}
+                for decision, c in zip(decisiones, conteo[1:].tolist()) if c}}
+
+        if por_dia:
+            return {dia: formatear(conteo) for dia, conteo in sorted(conteos.items())}
+        return formatear(conteos.get(None, np.zeros(len(decisiones) + 1, dtype=np.int64)))
+
+    def distribucion(self, columna='score_final', bins=20, rango=None, desde=None, hasta=None,
+                     decision=None, percentiles=(5, 25, 50, 75, 95)):
+        """
+        Histograma, media y percentiles de una columna numérica (sin NaN).
+
+        Args:
+            rango: (mínimo, máximo) del histograma; default el de los datos
+            decision: Solo las filas con esta decisión
+
+        Returns:
+            dict: n, media, percentiles, bordes y conteos del histograma
+        """
+        codigo = self._codigo('decision', decision) if decision is not None else None
+        seleccion = []
+        for _, parte in self.partes(desde, hasta):
+            valores = self.columna(parte, columna)
+            mascara = ~np.isnan(valores)
+            if codigo is not None:
+                mascara &= self.columna(parte, 'decision') == codigo
+            seleccion.append(valores[mascara])
+        valores = np.concatenate(seleccion) if seleccion else np.empty(0)
+
+        resultado = {'columna': columna, 'n': int(len(valores))}
+        if not len(valores):
+            return resultado
+        conteos, bordes = np.histogram(valores, bins=bins, range=rango)
+        resultado.update(
+            media=round(float(valores.mean()), 4),
+            percentiles={f'p{p}': round(float(v), 4)
+                         for p, v in zip(percentiles, np.percentile(valores, percentiles))},
+            bordes=[round(float(b), 4) for b in bordes],
+            conteos=conteos.tolist(),
+        )
+        return resultado
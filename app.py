@@ -1,216 +1,275 @@
-from flask import Flask, render_template, request, jsonify
-import joblib
-import numpy as np
-from fuzzy_module import calcular_riesgo_difuso
-import sqlite3
-from datetime import datetime
+"""
+App Flask del sistema crediticio.
+
+crear_app() arma la app: migra la base, conecta Firebase, registra las rutas y
+precalienta el núcleo de decisión. `app` se crea en el primer acceso (así
+`gunicorn app:app` sigue funcionando); gunicorn.conf.py llama a crear_app() en el
+proceso maestro antes del fork para que los workers compartan el modelo.
+"""
+from flask import Blueprint, Flask, Response, g, render_template, request, jsonify, stream_with_context
+from decision_module import (modelo, scaler, mappings, tabla_riesgo, CAMPOS_REQUERIDOS, CAMPOS_MACRO,
+                             SolicitudInvalida, calcular_dti, calcular_ltv, calcular_score_cliente,
+                             contexto_decision, evaluar_solicitud, evaluar_lote, evaluador_sombra,
+                             explicador_riesgo, formatear_resultado, motor_reglas, registro_macro,
+                             precalentar as precalentar_decision)
+import atexit
+import logging
+import os
+import threading
+import time
+import metrics_module as metricas
+from contraoferta_module import buscar_contraoferta
+from db_module import init_db, buscar_solicitudes, leer_resumen, cerrar_conexion
+from audit_module import EscritorDiferido, FirestoreLocal
+from idempotencia_module import ACTIVA as IDEMPOTENCIA_ACTIVA, CacheIdempotencia, ConflictoIdempotencia
+from macro_module import RiesgoNoCalculado
+from eventos_module import DifusorEventos
+from sombra_module import reporte_concordancia
+from datetime import date, datetime, timedelta
 #NUEVOS IMPORTS#
 import firebase_admin
 from firebase_admin import credentials, firestore
-from datetime import datetime
-
-app = Flask(__name__)
-
-# Cargar modelo y scaler
-modelo = joblib.load('models/Random_Forest_modelo_final.pkl')
-scaler = joblib.load('models/scaler_datos.pkl')
-
-# Mapeos para variables categóricas
-mappings = {
-    'Gender': {'Male': 1, 'Female': 0},
-    'Region': {'North': 0, 'South': 1, 'Central': 2, 'North-East': 3},
-    'credit_type': {'CIB': 0, 'EXP': 1, 'EQUI': 2},
-    'age': {'<25': 6, '25-34': 0, '35-44': 1, '45-54': 2, '55-64': 3, '65-74': 4, '>74': 5},
-    'credit_worthiness': {'Excellent': 4, 'Good': 3, 'Fair': 2, 'Poor': 1},
-    'loan_purpose': {'Personal': 0, 'Hipoteca': 1, 'Auto': 2, 'Comercial': 3, 'Educacion': 4}
-}
-
-# Crear base de datos SQLite
-def init_db():
-    conn = sqlite3.connect('historial.db')
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS solicitudes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        fecha TIMESTAMP,
-        nombre TEXT,
-        genero TEXT,
-        edad TEXT,
-        region TEXT,
-        income REAL,
-        monto REAL,
-        plazo INTEGER,
-        credit_worthiness TEXT,
-        property_value REAL,
-        dti REAL,
-        ltv REAL,
-        score_cliente REAL,
-        riesgo_difuso REAL,
-        probabilidad REAL,
-        score_final REAL,
-        decision TEXT,
-        motivo TEXT
-    )''')
-    conn.commit()
-    conn.close()
-
-init_db()
-
-def calcular_dti(loan_amount, income, term):
-    """
-    Calcula Debt-to-Income Ratio.
-    DTI = (Cuota Mensual / Ingreso Mensual) * 100
-    """
-    if income == 0:
-        return 100
+
+rutas = Blueprint('crediticio', __name__)
+logger = logging.getLogger(__name__)
+
+# Máximo de solicitudes aceptadas por /predict/batch
+MAX_SOLICITUDES_LOTE = int(os.environ.get('MAX_SOLICITUDES_LOTE', 10000))
+
+# Filas máximas por página de /historial
+MAX_HISTORIAL = 500
+
+# Ventanas de /estadisticas?ventana=... en días
+VENTANAS_ESTADISTICAS = {'24h': 1, '7d': 7, '30d': 30}
+
+# Streams de /eventos por proceso con un servidor WSGI (cada uno ocupa un hilo;
+# gunicorn.conf.py lo ajusta a la mitad de GUNICORN_HILOS)
+MAX_EVENTOS_WSGI = int(os.environ.get('EVENTOS_MAX_WSGI', 2))
+
+# Precalentamiento en crear_app(): 'sincrono' (antes de devolver la app), 'fondo'
+# (en un hilo; /ready responde 503 hasta que termine) o 'no'
+PRECALENTAR = os.environ.get('PRECALENTAR', 'fondo')
+
+# ====== FIREBASE ======
+# Credenciales de la cuenta de servicio: FIREBASE_CREDENCIALES=ruta del JSON.
+# FIRESTORE_LOCAL=ruta.ndjson usa un sustituto local en lugar de Firestore.
+# Sin ninguno de los dos la app funciona igual, solo sin copia remota.
+RUTA_CREDENCIALES_FIREBASE = os.environ.get('FIREBASE_CREDENCIALES', 'firebase_key.json')
+db = None
+
+def conectar_firebase():
+    """Cliente de Firestore (o FirestoreLocal) según el entorno; None si no hay credenciales"""
+    if os.environ.get('FIRESTORE_LOCAL'):
+        return FirestoreLocal(os.environ['FIRESTORE_LOCAL'])
+    if os.path.exists(RUTA_CREDENCIALES_FIREBASE):
+        try:
+            try:
+                firebase_admin.get_app()
+            except ValueError:
+                firebase_admin.initialize_app(credentials.Certificate(RUTA_CREDENCIALES_FIREBASE))
+            return firestore.client()
+        except Exception as e:
+            logger.warning('No se pudo conectar con Firebase: %s', e)
+    return None
+
+def _documento_firebase(entrada, resultado_modelo, riesgo_difuso):
+    return {
+        'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'entrada': entrada,
+        'resultado': resultado_modelo,
+        'riesgo_difuso': riesgo_difuso
+    }
+
+INSERT_SOLICITUD = '''INSERT INTO solicitudes 
+    (fecha, nombre, genero, edad, region, income, monto, plazo, credit_worthiness, 
+     property_value, dti, ltv, score_cliente, riesgo_difuso, probabilidad, 
+     score_final, decision, motivo, macro_version)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+# Nombres de los valores de INSERT_SOLICITUD, en el mismo orden
+COLUMNAS_SOLICITUD = ['fecha', 'nombre', 'genero', 'edad', 'region', 'income', 'monto', 'plazo',
+                      'credit_worthiness', 'property_value', 'dti', 'ltv', 'score_cliente', 'riesgo_difuso',
+                      'probabilidad', 'score_final', 'decision', 'motivo', 'macro_version']
+
+def formatear_estadisticas(resumen):
+    """Respuesta de /estadisticas (y de los eventos del tablero) a partir de leer_resumen"""
+    total = resumen['total']
+    aprobadas = resumen['aprobadas']
+    return {
+        'total': total,
+        'aprobadas': aprobadas,
+        'rechazadas': resumen['rechazadas'],
+        'revision': resumen['revision'],
+        'score_cliente_promedio': round(resumen['score_cliente_promedio'], 2),
+        'riesgo_promedio': round(resumen['riesgo_difuso_promedio'], 2),
+        'probabilidad_promedio': round(resumen['probabilidad_promedio'], 2),
+        'dti_promedio': round(resumen['dti_promedio'], 2),
+        'ltv_promedio': round(resumen['ltv_promedio'], 2),
+        'tasa_aprobacion': round((aprobadas / total * 100) if total > 0 else 0, 2)
+    }
+
+# ====== ESCRITOR DIFERIDO (SQLITE + FIREBASE FUERA DEL CAMINO DE LA SOLICITUD) ======
+# El cliente de Firestore se asigna en crear_app()
+auditoria = EscritorDiferido(INSERT_SOLICITUD)
+atexit.register(auditoria.detener)
+metricas.registro.medidor('crediticio_explicaciones_riesgo', 'Caché de explicaciones del riesgo difuso',
+                          explicador_riesgo.estadisticas, etiqueta='contador')
+metricas.registro.medidor('crediticio_auditoria', 'Contadores y cola del escritor diferido',
+                          auditoria.estadisticas, etiqueta='contador')
+
+# ====== CACHÉ IDEMPOTENTE (REINTENTOS Y ENVÍOS DUPLICADOS DE /predict) ======
+# Compartida entre workers por SQLite; IDEMPOTENCIA=0 la desactiva
+idempotencia = CacheIdempotencia() if IDEMPOTENCIA_ACTIVA else None
+if idempotencia is not None:
+    metricas.registro.medidor('crediticio_idempotencia', 'Aciertos, fallos y entradas de la caché idempotente',
+                              idempotencia.estadisticas, etiqueta='contador')
+
+# ====== EVENTOS DEL TABLERO (SERVER-SENT EVENTS EN /eventos) ======
+# Cada decisión registrada se publica a los streams abiertos de este proceso
+eventos = DifusorEventos(COLUMNAS_SOLICITUD, formatear_estadisticas)
+metricas.registro.medidor('crediticio_eventos', 'Streams del tablero y eventos publicados',
+                          eventos.estadisticas, etiqueta='contador')
+
+# ====== MODELOS RETADORES EN SOMBRA (MODELOS_RETADORES, VER sombra_module) ======
+if evaluador_sombra is not None:
+    atexit.register(evaluador_sombra.detener)
+    metricas.registro.medidor('crediticio_sombra', 'Evaluaciones en sombra de los modelos retadores',
+                              evaluador_sombra.estadisticas, etiqueta='contador')
+
+def _fila_solicitud(score_cliente, riesgo_difuso, score_final, probabilidad, decision, motivo, data):
+    """Valores de INSERT_SOLICITUD para una decisión"""
+    return (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 
+            data.get('nombre', 'Sin nombre'),
+            data.get('gender', 'Male'),
+            data.get('age', '35-44'),
+            data.get('region', 'Central'),
+            float(data.get('income', 0)),
+            float(data.get('loan_amount', 0)),
+            int(data.get('term', 360)),
+            data.get('credit_worthiness', 'Fair'),
+            float(data.get('property_value', 0)),
+            float(data.get('dti', 0)),
+            float(data.get('ltv', 0)),
+            float(score_cliente),
+            float(riesgo_difuso), 
+            float(probabilidad),
+            float(score_final),
+            str(decision),
+            str(motivo),
+            data.get('macro_version'))
+
+def _resultado_modelo(score_cliente, score_final, probabilidad, decision, motivo):
+    return {
+        "score_cliente": float(score_cliente),
+        "probabilidad": float(probabilidad),
+        "score_final": float(score_final),
+        "decision": str(decision),
+        "motivo": str(motivo)
+    }
+
+def _registro_auditoria(score_cliente, riesgo_difuso, score_final, probabilidad, decision, motivo, data):
+    """(fila de SQLite, documento de Firebase) de una decisión"""
+    documento = None
+    if db is not None:
+        documento = _documento_firebase(
+            entrada=data,
+            resultado_modelo=_resultado_modelo(score_cliente, score_final, probabilidad, decision, motivo),
+            riesgo_difuso=float(riesgo_difuso)
+        )
+    return (_fila_solicitud(score_cliente, riesgo_difuso, score_final, probabilidad, decision, motivo, data),
+            documento)
+
+def registrar_decision(score_cliente, riesgo_difuso, score_final, probabilidad, decision, motivo, data,
+                       cronometro=metricas.CRONOMETRO_NULO, extra=None):
+    """Encola la decisión para SQLite y Firebase y devuelve el resultado para el front (con `extra`)"""
     
-    # Cuota mensual aproximada (asumiendo tasa 8% anual)
-    tasa_mensual = 0.08 / 12
-    cuota_mensual = (loan_amount * tasa_mensual * (1 + tasa_mensual)**term) / ((1 + tasa_mensual)**term - 1)
+    # ====== GUARDAR EN SQLITE Y FIREBASE (DIFERIDO) ======
+    fila, documento = _registro_auditoria(score_cliente, riesgo_difuso, score_final,
+                                          probabilidad, decision, motivo, data)
+    auditoria.registrar(fila, documento)
+    metricas.contar_decision(decision, motivo)
+    eventos.publicar([fila])
+    cronometro.marca('persistencia')
     
-    dti = (cuota_mensual / income) * 100
-    return round(dti, 2)
+    # ====== RESPUESTA AL FRONT ======
+    resultado = formatear_resultado(score_cliente, riesgo_difuso, score_final, probabilidad,
+                                    decision, motivo, data)
+    if extra:
+        resultado.update(extra)
+    return resultado
 
-def calcular_ltv(loan_amount, property_value):
-    """
-    Calcula Loan-to-Value Ratio.
-    LTV = (Monto Préstamo / Valor Propiedad) * 100
-    """
-    if property_value == 0:
-        return 100
-    
-    ltv = (loan_amount / property_value) * 100
-    return round(ltv, 2)
+def generar_respuesta(*decision, **opciones):
+    """Respuesta JSON de registrar_decision"""
+    return jsonify(registrar_decision(*decision, **opciones))
 
-def calcular_score_cliente(data):
+def respuesta_repetida(resultado):
+    """Respuesta guardada en la caché idempotente, marcada como repetición"""
+    respuesta = jsonify(resultado)
+    respuesta.headers['Idempotent-Replayed'] = 'true'
+    return respuesta
+
+def guardar_decisiones(decisiones):
     """
-    Sistema de puntuación del perfil del cliente (0-100).
-    Mayor score = Menor riesgo
+    Encola un lote de decisiones para SQLite y Firebase.
+    Cada decisión es (score_cliente, riesgo_difuso, score_final, probabilidad, decision, motivo, data).
     """
-    score = 100  # Empezar con puntuación perfecta
-    
-    # ============ CREDIT WORTHINESS (35% del score) ============
-    worthiness = data.get('credit_worthiness', 'Fair')
-    if worthiness == 'Poor':
-        score -= 50  # Penalización severa
-    elif worthiness == 'Fair':
-        score -= 30
-    elif worthiness == 'Good':
-        score -= 15
-    elif worthiness == 'Excellent':
-        score -= 0
-    
-    # ============ DTI RATIO (30% del score) ============
-    dti = float(data.get('dti', 0))
-    if dti > 50:  # Más del 50% del ingreso va al préstamo
-        score -= 35
-    elif dti > 40:
-        score -= 25
-    elif dti > 30:
-        score -= 15
-    elif dti > 20:
-        score -= 8
-    
-    # ============ LTV RATIO (20% del score) ============
-    ltv = float(data.get('ltv', 0))
-    if ltv > 95:  # Casi sin enganche
-        score -= 30
-    elif ltv > 85:
-        score -= 20
-    elif ltv > 75:
-        score -= 12
-    elif ltv > 65:
-        score -= 5
-    
-    # ============ ESTRUCTURA DEL PRÉSTAMO (10% del score) ============
-    if data.get('neg_amortization', False):
-        score -= 20  # Deuda que crece = muy peligroso
-    
-    if data.get('interest_only', False):
-        score -= 15  # No paga capital
-    
-    if data.get('lump_sum_payment', False):
-        score -= 12  # Pago único al final = riesgo
-    
-    if data.get('business_or_commercial', False):
-        score -= 10  # Créditos comerciales más riesgosos
-    
-    # ============ HISTORIAL Y RESPALDO (5% del score) ============
-    if not data.get('approv_in_adv', False):
-        score -= 8  # Sin aprobación previa
-    
-    if not data.get('co_applicant', False):
-        score -= 5  # Sin co-solicitante = menos respaldo
-    
-    # Garantizar que esté entre 0-100
-    return max(0, min(100, score))
+    registros = [_registro_auditoria(*d) for d in decisiones]
+    auditoria.registrar_lote(registros)
+    for d in decisiones:
+        metricas.contar_decision(d[4], d[5])
+    eventos.publicar([fila for fila, _ in registros])
 
-def generar_respuesta(score_cliente, riesgo_difuso, score_final, probabilidad, decision, motivo, data):
-    """Genera respuesta, guarda en SQLite y en Firebase"""
-    
-    # ====== GUARDAR EN SQLITE ======
+
+@rutas.before_app_request
+def _iniciar_medicion():
+    g.inicio_solicitud = time.perf_counter()
+
+
+@rutas.after_app_request
+def _registrar_latencia(respuesta):
+    inicio = g.pop('inicio_solicitud', None)
+    if inicio is not None:
+        endpoint = (request.endpoint or 'desconocido').rpartition('.')[2]
+        metricas.solicitudes_http.observar(time.perf_counter() - inicio, endpoint, str(respuesta.status_code))
+    return respuesta
+
+
+# ====== PRECALENTAMIENTO Y READINESS ======
+estado_precalentamiento = {'listo': False, 'ms': None, 'error': None}
+
+def precalentar():
+    """Evalúa solicitudes sintéticas (sin guardarlas) y marca la app como lista"""
     try:
-        conn = sqlite3.connect('historial.db')
-        cursor = conn.cursor()
-        cursor.execute('''INSERT INTO solicitudes 
-            (fecha, nombre, genero, edad, region, income, monto, plazo, credit_worthiness, 
-             property_value, dti, ltv, score_cliente, riesgo_difuso, probabilidad, 
-             score_final, decision, motivo)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-            (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 
-             data.get('nombre', 'Sin nombre'),
-             data.get('gender', 'Male'),
-             data.get('age', '35-44'),
-             data.get('region', 'Central'),
-             float(data.get('income', 0)),
-             float(data.get('loan_amount', 0)),
-             int(data.get('term', 360)),
-             data.get('credit_worthiness', 'Fair'),
-             float(data.get('property_value', 0)),
-             float(data.get('dti', 0)),
-             float(data.get('ltv', 0)),
-             float(score_cliente),
-             float(riesgo_difuso), 
-             float(probabilidad),
-             float(score_final),
-             str(decision),
-             str(motivo)))
-        conn.commit()
-        conn.close()
+        estado_precalentamiento['ms'] = precalentar_decision()
+        estado_precalentamiento['listo'] = True
+        logger.info('Precalentamiento completo en %.1f ms', estado_precalentamiento['ms'])
     except Exception as e:
-        print(f"Error al guardar en BD: {e}")
-    
-    # ====== GUARDAR TAMBIÉN EN FIREBASE ======
-    # Aquí sí usamos la función que definiste arriba
-    guardar_evaluacion_en_firebase(
-        entrada=data,
-        resultado_modelo={
-            "score_cliente": float(score_cliente),
-            "probabilidad": float(probabilidad),
-            "score_final": float(score_final),
-            "decision": str(decision),
-            "motivo": str(motivo)
-        },
-        riesgo_difuso=float(riesgo_difuso)
-    )
-    
-    # ====== RESPUESTA AL FRONT ======
-    return jsonify({
-        'score_cliente': round(float(score_cliente), 2),
-        'riesgo_difuso': round(float(riesgo_difuso), 2),
-        'probabilidad': round(float(probabilidad), 2),
-        'score_final': round(float(score_final), 2),
-        'dti': round(float(data.get('dti', 0)), 2),
-        'ltv': round(float(data.get('ltv', 0)), 2),
-        'decision': str(decision),
-        'motivo': str(motivo)
-    })
-
-
-@app.route('/')
+        estado_precalentamiento['error'] = str(e)
+        logger.exception('Error en el precalentamiento')
+    finally:
+        # La conexión abierta en este hilo no debe heredarse en un fork
+        cerrar_conexion()
+
+
+@rutas.route('/ready')
+def ready():
+    """200 cuando el precalentamiento terminó; 503 mientras tanto (o si falló)"""
+    if estado_precalentamiento['listo']:
+        return jsonify({'listo': True, 'precalentamiento_ms': estado_precalentamiento['ms']})
+    return jsonify({'listo': False, 'error': estado_precalentamiento['error']}), 503
+
+
+@rutas.route('/metrics')
+def metrics():
+    """Métricas de este proceso en formato de texto de Prometheus"""
+    return Response(metricas.registro.exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@rutas.route('/')
 def home():
     return render_template('index.html')
 
-@app.route('/predict', methods=['POST'])
+@rutas.route('/predict', methods=['POST'])
 def predict():
     try:
         data = request.json
@@ -219,219 +278,40 @@ def predict():
         if not data:
             return jsonify({'error': 'No se recibieron datos'}), 400
         
-        # Validar que todos los campos requeridos estén presentes
-        required_fields = ['loan_amount', 'income', 'term', 'inflacion', 'combustible', 
-                          'protestas', 'desempleo', 'covid', 'clima', 'credit_worthiness', 
-                          'gender', 'age', 'region', 'credit_type']
-        
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Campo requerido faltante: {field}'}), 400
-            if data[field] is None or data[field] == '':
-                return jsonify({'error': f'Campo {field} está vacío'}), 400
-        
-        # ============ PASO 1: CALCULAR MÉTRICAS FINANCIERAS ============
-        try:
-            loan_amount = float(data['loan_amount'])
-            income = float(data['income'])
-            term = int(data['term'])
-            property_value = float(data.get('property_value', loan_amount * 1.2))
-        except (ValueError, TypeError) as e:
-            return jsonify({'error': f'Valor numérico inválido: {str(e)}'}), 400
-        
-        dti = calcular_dti(loan_amount, income, term)
-        ltv = calcular_ltv(loan_amount, property_value)
-        
-        data['dti'] = dti
-        data['ltv'] = ltv
-        
-        # ============ PASO 2: CALCULAR SCORE DEL CLIENTE ============
-        score_cliente = calcular_score_cliente(data)
-        
-        # ============ PASO 3: CALCULAR RIESGO DIFUSO (MACROECONOMÍA) ============
-        try:
-            riesgo_externo = calcular_riesgo_difuso(
-                float(data['inflacion']), 
-                float(data['combustible']),
-                float(data['protestas']), 
-                float(data['desempleo']),
-                float(data['covid']), 
-                float(data['clima'])
-            )
-        except Exception as e:
-            print(f"Error en cálculo difuso: {e}")
-            riesgo_externo = 5.0  # Valor por defecto en caso de error
-        
-        # ============ PASO 4: BANDERAS ROJAS (RECHAZO AUTOMÁTICO) ============
-        
-        # BANDERAS CRÍTICAS DEL CLIENTE
-        if data.get('credit_worthiness') == 'Poor':
-            return generar_respuesta(score_cliente, riesgo_externo, 25.0, 95.0, 
-                                    "RECHAZADO", "Historial Crediticio Deficiente", data)
-        
-        if dti > 55:
-            return generar_respuesta(score_cliente, riesgo_externo, 30.0, 90.0,
-                                    "RECHAZADO", "DTI Crítico - Capacidad de Pago Insuficiente", data)
-        
-        if ltv > 98:
-            return generar_respuesta(score_cliente, riesgo_externo, 28.0, 88.0,
-                                    "RECHAZADO", "LTV Crítico - Colateral Insuficiente", data)
-        
-        if data.get('neg_amortization', False):
-            return generar_respuesta(score_cliente, riesgo_externo, 20.0, 92.0,
-                                    "RECHAZADO", "Amortización Negativa No Permitida", data)
-        
-        if income < (loan_amount / 180):  # No puede pagar ni en 15 años
-            return generar_respuesta(score_cliente, riesgo_externo, 22.0, 94.0,
-                                    "RECHAZADO", "Ingresos Insuficientes para el Monto Solicitado", data)
-        
-        # BANDERAS CRÍTICAS MACROECONÓMICAS
-        if float(data['inflacion']) > 50:
-            return generar_respuesta(score_cliente, riesgo_externo, 25.0, 85.0,
-                                    "RECHAZADO", "Crisis Inflacionaria - Entorno Económico Crítico", data)
-        
-        if float(data['desempleo']) > 15:
-            return generar_respuesta(score_cliente, riesgo_externo, 27.0, 83.0,
-                                    "RECHAZADO", "Desempleo Crítico - Recesión Severa", data)
-        
-        if float(data['covid']) > 7000:
-            return generar_respuesta(score_cliente, riesgo_externo, 26.0, 82.0,
-                                    "RECHAZADO", "Colapso Sanitario - Alerta Crítica", data)
-        
-        if float(data['protestas']) > 3500:
-            return generar_respuesta(score_cliente, riesgo_externo, 28.0, 80.0,
-                                    "RECHAZADO", "Inestabilidad Social Severa", data)
-        
-        if float(data['combustible']) > 6.0:
-            return generar_respuesta(score_cliente, riesgo_externo, 29.0, 81.0,
-                                    "RECHAZADO", "Crisis Energética Crítica", data)
-        
-        # Combinación letal: estanflación
-        if float(data['inflacion']) > 20 and float(data['desempleo']) > 10:
-            return generar_respuesta(score_cliente, riesgo_externo, 22.0, 88.0,
-                                    "RECHAZADO", "Estanflación Severa Detectada", data)
-        
-        # ============ PASO 5: RECHAZO POR SCORE BAJO ============
-        if score_cliente < 35:
-            return generar_respuesta(score_cliente, riesgo_externo, 30.0, 85.0,
-                                    "RECHAZADO", "Perfil Crediticio Crítico", data)
-        
-        # ============ PASO 6: CONSTRUIR FEATURES PARA RANDOM FOREST ============
+        # Tiempos por etapa (PASO 1 a 10 y persistencia) en una muestra de solicitudes
+        cronometro = metricas.cronometro()
+        # ?explicar=1 agrega reglas difusas activadas y ajustes aplicados al riesgo
+        explicar = request.args.get('explicar', '').lower() in ('1', 'true', 'si')
+        
+        # Reintento o envío duplicado: la respuesta original, sin evaluar ni guardar otra vez
+        clave = None
+        if idempotencia is not None and isinstance(data, dict):
+            clave, huella = idempotencia.claves(data, request.headers.get('Idempotency-Key'),
+                                                variante=[explicar], contexto=contexto_decision(data))
+            try:
+                repetida = idempotencia.reservar(clave, huella)
+            except ConflictoIdempotencia as e:
+                return jsonify({'error': str(e)}), e.estado
+            if repetida is not None:
+                return respuesta_repetida(repetida)
+        
+        completada = False
         try:
-            gender_encoded = mappings['Gender'][data['gender']]
-            age_encoded = mappings['age'][data['age']]
-            region_encoded = mappings['Region'][data['region']]
-            credit_type_encoded = mappings['credit_type'][data['credit_type']]
-        except KeyError as e:
-            return jsonify({'error': f'Valor inválido en campo categórico: {str(e)}'}), 400
-        
-        features = [
-            gender_encoded,
-            age_encoded,
-            region_encoded,
-            credit_type_encoded,
-            float(data['income']),
-            float(data['loan_amount']),
-            int(data['term']),
-            float(data['inflacion']),
-            float(data['combustible']),
-            float(data['protestas']),
-            float(data['covid']),
-            float(data['desempleo']),
-            float(data['clima'])
-        ]
-        
-        # One-hot encoding
-        gender_onehot = [0, 0, 0]
-        gender_onehot[gender_encoded] = 1
-        features.extend(gender_onehot)
-        
-        age_onehot = [0] * 7
-        age_onehot[age_encoded] = 1
-        features.extend(age_onehot)
-        
-        region_onehot = [0, 0, 0, 0]
-        region_onehot[region_encoded] = 1
-        features.extend(region_onehot)
-        
-        credit_onehot = [0, 0, 0]
-        credit_onehot[credit_type_encoded] = 1
-        features.extend(credit_onehot)
-        
-        # Ajustar a 32 features
-        features = features[:32]
-        while len(features) < 32:
-            features.append(0)
-        
-        # ============ PASO 7: PREDICCIÓN RANDOM FOREST ============
-        features_array = np.array(features).reshape(1, -1)
-        features_scaled = scaler.transform(features_array)
-        prob_base = float(modelo.predict_proba(features_scaled)[0][1])
-        
-        # ============ PASO 8: AJUSTES Y PENALIZACIONES ============
-        
-        # Penalización por riesgo macroeconómico
-        if riesgo_externo > 8.0:
-            prob_base += 0.40
-        elif riesgo_externo > 6.5:
-            prob_base += 0.25
-        elif riesgo_externo > 5.0:
-            prob_base += 0.15
-        elif riesgo_externo > 3.5:
-            prob_base += 0.08
-        
-        # Penalización por DTI alto
-        if dti > 45:
-            prob_base += 0.20
-        elif dti > 35:
-            prob_base += 0.12
-        
-        # Penalización por LTV alto
-        if ltv > 90:
-            prob_base += 0.15
-        elif ltv > 80:
-            prob_base += 0.08
-        
-        # Penalización por estructura riesgosa
-        if data.get('interest_only', False):
-            prob_base += 0.12
-        if data.get('lump_sum_payment', False):
-            prob_base += 0.10
-        if data.get('business_or_commercial', False):
-            prob_base += 0.08
-        
-        prob = min(100.0, prob_base * 100)
-        
-        # ============ PASO 9: SCORE FINAL COMBINADO ============
-        # 40% Perfil Cliente + 30% Entorno + 30% Modelo ML
-        score_final = (
-            (score_cliente * 0.40) +
-            ((10 - riesgo_externo) * 10 * 0.30) +
-            ((100 - prob) * 0.30)
-        )
-        
-        # ============ PASO 10: DECISIÓN FINAL ============
-        decision = "APROBADO"
-        motivo = "Perfil de Riesgo Aceptable"
-        
-        if score_final < 45:
-            decision = "RECHAZADO"
-            motivo = f"Score Final Bajo ({score_final:.1f}/100)"
-        elif score_final < 60:
-            decision = "REVISIÓN MANUAL"
-            motivo = f"Score Límite ({score_final:.1f}/100) - Requiere Análisis Adicional"
-        elif prob > 45:
-            decision = "RECHAZADO"
-            motivo = f"Alta Probabilidad de Incumplimiento ({prob:.1f}%)"
-        elif score_cliente < 50:
-            decision = "REVISIÓN MANUAL"
-            motivo = "Perfil de Cliente Requiere Evaluación Detallada"
-        else:
-            decision = "APROBADO"
-            motivo = f"Perfil de Riesgo Aceptable - Score: {score_final:.1f}/100"
-        
-        return generar_respuesta(score_cliente, riesgo_externo, score_final, prob, 
-                                decision, motivo, data)
+            detalle = {}
+            try:
+                resultado = evaluar_solicitud(data, detalle, cronometro=cronometro, explicar=explicar)
+            except SolicitudInvalida as e:
+                return jsonify({'error': str(e)}), 400
+            
+            extra = {'explicacion_riesgo': detalle['riesgo_difuso']} if explicar else None
+            respuesta = registrar_decision(*resultado, data, cronometro=cronometro, extra=extra)
+            if clave is not None:
+                idempotencia.completar(clave, respuesta)
+                completada = True
+            return jsonify(respuesta)
+        finally:
+            if clave is not None and not completada:
+                idempotencia.liberar([clave])
         
     except KeyError as e:
         return jsonify({'error': f'Campo faltante: {str(e)}'}), 400
@@ -440,87 +320,236 @@ def predict():
     except Exception as e:
         return jsonify({'error': f'Error interno: {str(e)}'}), 500
 
-@app.route('/historial')
-def historial():
+def procesar_lote(solicitudes):
+    """
+    Evalúa un lote con evaluar_lote, guarda las decisiones en bloque y arma las
+    respuestas en el orden de entrada.
+    """
+    resultados = []
+    decisiones = []
+    for i, item in enumerate(evaluar_lote(solicitudes)):
+        if isinstance(item, SolicitudInvalida):
+            resultados.append({'indice': i, 'error': str(item)})
+            continue
+        decisiones.append(item)
+        resultado = formatear_resultado(*item)
+        resultado['indice'] = i
+        resultados.append(resultado)
+    
+    guardar_decisiones(decisiones)
+    return resultados
+
+@rutas.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """Evalúa muchas solicitudes en una sola petición: {"solicitudes": [...]}"""
     try:
-        conn = sqlite3.connect('historial.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM solicitudes ORDER BY fecha DESC LIMIT 50')
-        rows = cursor.fetchall()
-        conn.close()
+        body = request.json
+        solicitudes = body.get('solicitudes') if isinstance(body, dict) else body
         
-        historial_list = []
-        for row in rows:
-            historial_list.append({
-                'id': row[0],
-                'fecha': row[1],
-                'nombre': row[2],
-                'monto': row[7],
-                'credit_worthiness': row[9],
-                'dti': row[11],
-                'ltv': row[12],
-                'score_cliente': row[13],
-                'riesgo_difuso': row[14],
-                'probabilidad': row[15],
-                'score_final': row[16],
-                'decision': row[17]
-            })
+        if not isinstance(solicitudes, list) or not solicitudes:
+            return jsonify({'error': 'Se esperaba una lista de solicitudes'}), 400
+        if len(solicitudes) > MAX_SOLICITUDES_LOTE:
+            return jsonify({'error': f'Máximo {MAX_SOLICITUDES_LOTE} solicitudes por lote'}), 413
         
-        return jsonify({'historial': historial_list})
+        resultados = procesar_lote(solicitudes)
+        errores = sum(1 for r in resultados if 'error' in r)
+        return jsonify({
+            'total': len(resultados),
+            'errores': errores,
+            'resultados': resultados
+        })
+    except Exception as e:
+        return jsonify({'error': f'Error interno: {str(e)}'}), 500
+
+@rutas.route('/predict/contraoferta', methods=['POST'])
+def predict_contraoferta():
+    """
+    Mayor monto que saldría APROBADO para la solicitud del body (la misma de
+    /predict), por plazo. No se guarda en el historial.
+
+    Query params opcionales: plazos (lista separada por comas, en meses), paso y
+    monto_minimo (ver contraoferta_module).
+    """
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No se recibieron datos'}), 400
+        parametros = {}
+        if request.args.get('plazos'):
+            parametros['plazos'] = [int(p) for p in request.args['plazos'].split(',')]
+        for campo in ('paso', 'monto_minimo'):
+            if request.args.get(campo) is not None:
+                parametros[campo] = float(request.args[campo])
+        try:
+            return jsonify(buscar_contraoferta(data, **parametros))
+        except SolicitudInvalida as e:
+            return jsonify({'error': str(e)}), 400
+    except ValueError as e:
+        return jsonify({'error': f'Valor inválido: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Error interno: {str(e)}'}), 500
+
+def _parametros_historial(args):
+    """Convierte los query params de /historial en argumentos de buscar_solicitudes"""
+    parametros = {
+        'limite': int(args.get('limite', 50)),
+        'decision': args.get('decision'),
+        'credit_worthiness': args.get('credit_worthiness'),
+        'desde': args.get('desde'),
+        'hasta': args.get('hasta'),
+    }
+    if not 1 <= parametros['limite'] <= MAX_HISTORIAL:
+        raise ValueError(f'limite debe estar entre 1 y {MAX_HISTORIAL}')
+    # Una fecha sin hora en `hasta` incluye todo ese día
+    if parametros['hasta'] is not None and len(parametros['hasta']) == 10:
+        parametros['hasta'] += ' 23:59:59'
+    for campo in ('score_min', 'score_max'):
+        if args.get(campo) is not None:
+            parametros[campo] = float(args[campo])
+    if args.get('antes'):
+        fecha, _, id_solicitud = args['antes'].rpartition(',')
+        if not fecha:
+            raise ValueError('antes debe tener el formato <fecha>,<id>')
+        parametros['antes'] = (fecha, int(id_solicitud))
+    return parametros
+
+
+@rutas.route('/historial')
+def historial():
+    """
+    Historial más reciente primero, de a `limite` filas (default 50).
+
+    Filtros: decision, credit_worthiness, desde/hasta (fecha), score_min/score_max
+    (score_final). Para la página siguiente se pasa ?antes=<siguiente> de la respuesta.
+    """
+    try:
+        parametros = _parametros_historial(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Parámetro inválido: {e}'}), 400
+    try:
+        rows = buscar_solicitudes(**parametros)
+        historial_list = [dict(row) for row in rows]
+
+        siguiente = None
+        if len(rows) == parametros['limite']:
+            siguiente = f"{rows[-1]['fecha']},{rows[-1]['id']}"
+        return jsonify({'historial': historial_list, 'siguiente': siguiente})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/estadisticas')
+
+@rutas.route('/estadisticas')
 def estadisticas():
+    """
+    Totales y promedios del historial, leídos de los resúmenes que mantienen los
+    triggers de db_module (sin recorrer solicitudes).
+
+    ?ventana=24h|7d|30d limita a los últimos días usando resumen_diario. La
+    granularidad es diaria: la ventana incluye el día actual completo y los N días
+    anteriores, así que siempre cubre al menos el periodo pedido.
+    """
+    ventana = request.args.get('ventana')
+    if ventana is not None and ventana not in VENTANAS_ESTADISTICAS:
+        return jsonify({'error': f'ventana debe ser una de {list(VENTANAS_ESTADISTICAS)}'}), 400
+    try:
+        desde = None
+        if ventana:
+            desde = (date.today() - timedelta(days=VENTANAS_ESTADISTICAS[ventana])).isoformat()
+        respuesta = formatear_estadisticas(leer_resumen(desde))
+        if ventana:
+            respuesta['ventana'] = ventana
+            respuesta['desde'] = desde
+        return jsonify(respuesta)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@rutas.route('/eventos')
+def eventos_tablero():
+    """
+    Server-sent events del tablero: 'estadisticas' al conectar, 'decisiones' con
+    cada decisión registrada (filas del historial y estadísticas actualizadas) y
+    'resincronizar' si el cliente se atrasó. Ver eventos_module.
+
+    Cada stream ocupa un hilo del servidor WSGI: con los workers con hilos de
+    gunicorn.conf.py se admiten MAX_EVENTOS_WSGI streams por proceso; con un
+    worker de un solo hilo (GUNICORN_HILOS=1) se responde 503 y el tablero vuelve
+    a consultar /historial y /estadisticas. El modo ASGI atiende /eventos en el event loop, sin ese
+    límite.
+    """
+    if not request.environ.get('wsgi.multithread'):
+        return jsonify({'error': 'Eventos no disponibles con un worker de un solo hilo'}), 503
+    suscripcion = eventos.suscribir(request.headers.get('Last-Event-ID'), MAX_EVENTOS_WSGI)
+    if suscripcion is None:
+        return jsonify({'error': 'Demasiados clientes conectados'}), 503
+    return Response(stream_with_context(eventos.iterar(suscripcion)), content_type='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@rutas.route('/sombra')
+def sombra():
+    """
+    Concordancia de cada modelo retador con el campeón: matriz de decisiones,
+    fracción de decisiones iguales y diferencia de probabilidades. ?desde=YYYY-MM-DD
+    y ?modelo=nombre filtran; 'proceso' son los contadores de este worker.
+    """
+    desde = request.args.get('desde')
+    if desde:
+        try:
+            datetime.fromisoformat(desde)
+        except ValueError:
+            return jsonify({'error': 'desde debe ser una fecha YYYY-MM-DD'}), 400
     try:
-        conn = sqlite3.connect('historial.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM solicitudes')
-        total = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM solicitudes WHERE decision = "APROBADO"')
-        aprobadas = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM solicitudes WHERE decision = "RECHAZADO"')
-        rechazadas = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM solicitudes WHERE decision = "REVISIÓN MANUAL"')
-        revision = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT AVG(score_cliente) FROM solicitudes')
-        score_prom = cursor.fetchone()[0] or 0
-        
-        cursor.execute('SELECT AVG(riesgo_difuso) FROM solicitudes')
-        riesgo_prom = cursor.fetchone()[0] or 0
-        
-        cursor.execute('SELECT AVG(probabilidad) FROM solicitudes')
-        prob_prom = cursor.fetchone()[0] or 0
-        
-        cursor.execute('SELECT AVG(dti) FROM solicitudes')
-        dti_prom = cursor.fetchone()[0] or 0
-        
-        cursor.execute('SELECT AVG(ltv) FROM solicitudes')
-        ltv_prom = cursor.fetchone()[0] or 0
-        
-        conn.close()
-        
         return jsonify({
-            'total': total,
-            'aprobadas': aprobadas,
-            'rechazadas': rechazadas,
-            'revision': revision,
-            'score_cliente_promedio': round(score_prom, 2),
-            'riesgo_promedio': round(riesgo_prom, 2),
-            'probabilidad_promedio': round(prob_prom, 2),
-            'dti_promedio': round(dti_prom, 2),
-            'ltv_promedio': round(ltv_prom, 2),
-            'tasa_aprobacion': round((aprobadas / total * 100) if total > 0 else 0, 2)
+            'retadores': sorted(evaluador_sombra.motores) if evaluador_sombra is not None else [],
+            'modelos': reporte_concordancia(desde, request.args.get('modelo')),
+            'proceso': evaluador_sombra.estadisticas() if evaluador_sombra is not None else None,
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    
-@app.route('/test')
+
+
+@rutas.route('/macro', methods=['GET'])
+def macro_vigente():
+    """Snapshot macroeconómico vigente (el que usan las solicitudes sin variables macro)"""
+    snapshot = registro_macro.vigente()
+    if snapshot is None:
+        return jsonify({'error': 'No hay snapshot macro'}), 404
+    return jsonify(snapshot.como_dict(motor_reglas.actual()))
+
+
+@rutas.route('/macro/<int:version>', methods=['GET'])
+def macro_por_version(version):
+    snapshot = registro_macro.obtener(version)
+    if snapshot is None:
+        return jsonify({'error': f'Snapshot macro inexistente: {version}'}), 404
+    return jsonify(snapshot.como_dict(motor_reglas.actual()))
+
+
+@rutas.route('/macro', methods=['POST'])
+def crear_macro():
+    """
+    Crea un snapshot con las variables macro del cuerpo ({"inflacion": ..., "clima": ...})
+    y lo deja vigente. Calcula su riesgo externo una sola vez.
+    """
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'No se recibieron datos'}), 400
+    try:
+        snapshot = registro_macro.crear(data)
+    except KeyError as e:
+        return jsonify({'error': f'Campo requerido faltante: {e.args[0]}'}), 400
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Valor inválido: {str(e)}'}), 400
+    except RiesgoNoCalculado as e:
+        # No se guarda el snapshot: el 5.0 por defecto quedaría fijo para todas las solicitudes
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        return jsonify({'error': f'Error interno: {str(e)}'}), 500
+    return jsonify(snapshot.como_dict(motor_reglas.actual())), 201
+
+
+@rutas.route('/test')
 def test():
     try:
         db.collection("pruebas").document("test1").set({"estado": "ok"})
@@ -529,5 +558,44 @@ def test():
         return f"Error -> {e}"
 
 
+def crear_app(precalentar_modo=None):
+    """
+    Crea la app: aplica las migraciones, conecta Firebase, registra las rutas y
+    precalienta según `precalentar_modo` ('sincrono', 'fondo' o 'no'; default
+    PRECALENTAR). Con gunicorn --preload se llama una vez en el maestro.
+    """
+    global db
+    modo = precalentar_modo or PRECALENTAR
+    if modo not in ('sincrono', 'fondo', 'no'):
+        raise ValueError(f'Modo de precalentamiento inválido: {modo}')
+
+    init_db()
+    db = conectar_firebase()
+    auditoria.firestore = db
+
+    nueva = Flask(__name__)
+    nueva.register_blueprint(rutas)
+
+    if modo == 'sincrono':
+        precalentar()
+    elif modo == 'fondo':
+        threading.Thread(target=precalentar, name='precalentamiento', daemon=True).start()
+    else:
+        estado_precalentamiento['listo'] = True
+    return nueva
+
+
+_lock_app = threading.Lock()
+
+def __getattr__(nombre):
+    # `app` se crea en el primer acceso (from app import app, gunicorn app:app)
+    if nombre == 'app':
+        with _lock_app:
+            if 'app' not in globals():
+                globals()['app'] = crear_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    crear_app().run(debug=True, port=5000)
@@ -0,0 +1,357 @@
+"""
+Modo de servicio ASGI con micro-lotes para /predict.
+
+Con workers síncronos cada /predict ocupa un hilo durante todo el cálculo y la
+E/S. Aquí /predict se atiende en el event loop: las solicitudes que llegan dentro
+de ASGI_ESPERA_MS se juntan (hasta ASGI_LOTE_MAX) y se evalúan con evaluar_lote
+en un pool de hilos, así que el Random Forest corre una sola vez por lote. Cada
+respuesta sale en cuanto su lote termina; el encolado de las decisiones para
+SQLite y Firebase se hace después, en el mismo hilo del pool. La caché
+idempotente de app.py se consulta y se actualiza una vez por lote.
+
+Las demás rutas se delegan a la app Flask de app.py (también en el pool), así
+que ambos modos comparten el núcleo de decisión y la base. /eventos (el stream
+del tablero) se atiende en el event loop, sin ocupar un hilo por cliente.
+
+Uso:
+    uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics_module as metricas
+from app import app as app_flask, auditoria, eventos, guardar_decisiones, idempotencia
+from decision_module import SolicitudInvalida, contexto_decision, evaluar_lote, formatear_resultado
+from idempotencia_module import CONFLICTO, EN_PROCESO, REPETIDA
+
+# Máximo de solicitudes por lote y espera máxima para completarlo
+LOTE_MAX = int(os.environ.get('ASGI_LOTE_MAX', 64))
+ESPERA_MS = float(os.environ.get('ASGI_ESPERA_MS', 2))
+# Hilos del pool que evalúa lotes y atiende las rutas de Flask
+HILOS = int(os.environ.get('ASGI_HILOS', max(2, os.cpu_count() or 1)))
+
+logger = logging.getLogger(__name__)
+
+
+class _Pedido:
+    """Una solicitud /predict esperando lote"""
+
+    __slots__ = ('data', 'futuro', 'clave_cliente', 'clave', 'huella', 'limite', 'pausa')
+
+    def __init__(self, data, futuro, clave_cliente=None):
+        self.data = data
+        self.futuro = futuro
+        self.clave_cliente = clave_cliente
+        self.clave = self.huella = self.limite = None
+        self.pausa = 0.005
+
+
+class AgrupadorSolicitudes:
+    """
+    Junta solicitudes concurrentes en lotes para evaluar_lote.
+
+    Un lote se despacha al llegar a `lote_max` solicitudes o cuando pasan
+    `espera_ms` desde la primera; se evalúa en `pool` y cada solicitud recibe
+    (estado HTTP, cuerpo JSON, repetida). Con `idempotencia` (CacheIdempotencia)
+    las solicitudes con respuesta guardada no se evalúan, y las que otra
+    solicitud está evaluando vuelven a la cola hasta que termine.
+    """
+
+    def __init__(self, pool, lote_max=LOTE_MAX, espera_ms=ESPERA_MS, idempotencia=None):
+        self.pool = pool
+        self.lote_max = lote_max
+        self.espera = espera_ms / 1000
+        self.idempotencia = idempotencia
+        self._pendientes = []
+        self._temporizador = None
+        self.contadores = {'solicitudes': 0, 'lotes': 0, 'max_lote': 0, 'repetidas': 0}
+
+    async def evaluar(self, data, clave_cliente=None):
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._encolar(loop, _Pedido(data, futuro, clave_cliente))
+        return await futuro
+
+    def _encolar(self, loop, pedido):
+        self._pendientes.append(pedido)
+        if len(self._pendientes) >= self.lote_max:
+            self._despachar(loop)
+        elif self._temporizador is None:
+            self._temporizador = loop.call_later(self.espera, self._despachar, loop)
+
+    def _despachar(self, loop):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        lote, self._pendientes = self._pendientes, []
+        if not lote:
+            return
+        self.contadores['solicitudes'] += len(lote)
+        self.contadores['lotes'] += 1
+        self.contadores['max_lote'] = max(self.contadores['max_lote'], len(lote))
+        loop.run_in_executor(self.pool, self._procesar, loop, lote)
+
+    def _reencolar(self, loop, pedidos):
+        """Vuelve a encolar, con espera creciente, pedidos cuya clave está en proceso"""
+        for pedido in pedidos:
+            if not pedido.futuro.done():
+                loop.call_later(pedido.pausa, self._encolar, loop, pedido)
+                pedido.pausa = min(pedido.pausa * 2, 0.1)
+
+    @staticmethod
+    def _resolver(respuestas):
+        for pedido, resultado in respuestas:
+            if pedido.futuro.done():  # El cliente se desconectó
+                continue
+            if isinstance(resultado, BaseException):
+                pedido.futuro.set_exception(resultado)
+            else:
+                pedido.futuro.set_result(resultado)
+
+    def _reservar(self, lote):
+        """
+        Reserva las claves del lote en la caché idempotente.
+
+        Returns:
+            tuple: (pedidos a evaluar, respuestas ya resueltas, pedidos en proceso)
+        """
+        if self.idempotencia is None:
+            return lote, [], []
+        ahora = time.monotonic()
+        for pedido in lote:
+            if pedido.clave is None:
+                pedido.clave, pedido.huella = self.idempotencia.claves(
+                    pedido.data, pedido.clave_cliente, variante=[False], contexto=contexto_decision(pedido.data))
+                pedido.limite = ahora + self.idempotencia.espera
+        evaluar, resueltas, en_proceso = [], [], []
+        estados = self.idempotencia.reservar_lote([(pedido.clave, pedido.huella) for pedido in lote])
+        for pedido, (estado, respuesta) in zip(lote, estados):
+            if estado == REPETIDA:
+                resueltas.append((pedido, (200, respuesta, True)))
+            elif estado == CONFLICTO:
+                resueltas.append((pedido, (422, {'error': 'Idempotency-Key ya usada con otra solicitud'}, False)))
+            elif estado == EN_PROCESO and ahora >= pedido.limite:
+                resueltas.append((pedido, (409, {'error': 'Hay una solicitud idéntica en proceso; reintente'},
+                                           False)))
+            elif estado == EN_PROCESO:
+                en_proceso.append(pedido)
+            else:
+                evaluar.append(pedido)
+        self.contadores['repetidas'] += sum(1 for _, r in resueltas if r[2])
+        return evaluar, resueltas, en_proceso
+
+    def _procesar(self, loop, lote):
+        """Corre en el pool: evalúa el lote, responde y después encola las decisiones"""
+        evaluar = []  # Reservados en la caché (se liberan si la evaluación falla)
+        try:
+            evaluar, respuestas, en_proceso = self._reservar(lote)
+            resultados = evaluar_lote([pedido.data for pedido in evaluar]) if evaluar else []
+        except Exception as e:
+            logger.exception('Error al evaluar un lote de %d solicitudes', len(lote))
+            if self.idempotencia is not None and evaluar:
+                self.idempotencia.liberar([pedido.clave for pedido in evaluar])
+            loop.call_soon_threadsafe(self._resolver, [(pedido, e) for pedido in lote])
+            return
+
+        completadas, invalidas, decisiones = [], [], []
+        for pedido, resultado in zip(evaluar, resultados):
+            if isinstance(resultado, SolicitudInvalida):
+                respuestas.append((pedido, (400, {'error': str(resultado)}, False)))
+                invalidas.append(pedido.clave)
+                continue
+            respuesta = formatear_resultado(*resultado)
+            respuestas.append((pedido, (200, respuesta, False)))
+            completadas.append((pedido.clave, respuesta))
+            decisiones.append(resultado)
+        if self.idempotencia is not None:
+            try:
+                self.idempotencia.completar_lote(completadas)
+                self.idempotencia.liberar(invalidas)
+            except Exception:
+                logger.exception('Error al guardar %d respuestas en la caché idempotente', len(completadas))
+        loop.call_soon_threadsafe(self._resolver, respuestas)
+        if en_proceso:
+            loop.call_soon_threadsafe(self._reencolar, loop, en_proceso)
+
+        # ====== GUARDAR EN SQLITE Y FIREBASE (DIFERIDO) ======
+        if decisiones:
+            try:
+                guardar_decisiones(decisiones)
+            except Exception:
+                logger.exception('Error al encolar %d decisiones', len(decisiones))
+
+    def estadisticas(self):
+        return dict(self.contadores, pendientes=len(self._pendientes))
+
+
+# ============ HTTP ============
+
+async def _leer_cuerpo(receive):
+    partes = []
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'http.disconnect':
+            return None
+        partes.append(mensaje.get('body', b''))
+        if not mensaje.get('more_body', False):
+            return b''.join(partes)
+
+
+async def _responder(send, estado, cuerpo, encabezados):
+    await send({'type': 'http.response.start', 'status': estado, 'headers': encabezados})
+    await send({'type': 'http.response.body', 'body': cuerpo})
+
+
+async def _responder_json(send, estado, datos, encabezados=()):
+    cuerpo = app_flask.json.dumps(datos).encode('utf-8') + b'\n'
+    await _responder(send, estado, cuerpo, [(b'content-type', b'application/json'),
+                                            (b'content-length', str(len(cuerpo)).encode()), *encabezados])
+
+
+def _encabezado(scope, nombre):
+    """Valor del encabezado `nombre` (bytes en minúsculas) de la solicitud, o None"""
+    for clave, valor in scope.get('headers', []):
+        if clave.lower() == nombre:
+            return valor.decode('latin-1')
+    return None
+
+
+def _environ_wsgi(scope, cuerpo):
+    """Entorno WSGI (PEP 3333) equivalente a una solicitud HTTP de ASGI"""
+    servidor = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(servidor[0]),
+        'SERVER_PORT': str(servidor[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(cuerpo),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for nombre, valor in scope.get('headers', []):
+        nombre = nombre.decode('latin-1').upper().replace('-', '_')
+        valor = valor.decode('latin-1')
+        if nombre in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[nombre] = valor
+        else:
+            clave = f'HTTP_{nombre}'
+            environ[clave] = f'{environ[clave]},{valor}' if clave in environ else valor
+    return environ
+
+
+def _llamar_flask(environ):
+    estado = {}
+
+    def start_response(status, headers, exc_info=None):
+        estado['status'] = int(status.split(' ', 1)[0])
+        estado['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    resultado = app_flask(environ, start_response)
+    try:
+        cuerpo = b''.join(resultado)
+    finally:
+        if hasattr(resultado, 'close'):
+            resultado.close()
+    return estado['status'], cuerpo, estado['headers']
+
+
+class AppAsgi:
+    """Aplicación ASGI: /predict con micro-lotes y el resto de las rutas vía Flask"""
+
+    def __init__(self, lote_max=LOTE_MAX, espera_ms=ESPERA_MS, hilos=HILOS):
+        self.pool = ThreadPoolExecutor(hilos, thread_name_prefix='asgi')
+        self.agrupador = AgrupadorSolicitudes(self.pool, lote_max, espera_ms, idempotencia)
+        metricas.registro.medidor('crediticio_microlotes', 'Solicitudes, lotes y tamaño máximo de lote del modo ASGI',
+                                  self.agrupador.estadisticas, etiqueta='contador')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._ciclo_de_vida(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        inicio = time.perf_counter()
+        cuerpo = await _leer_cuerpo(receive)
+        if cuerpo is None:
+            return
+        # /predict?explicar=... va por Flask: la explicación no se calcula por lotes
+        explicar = b'explicar' in scope.get('query_string', b'')
+        if scope['path'] == '/predict' and scope['method'] == 'POST' and not explicar:
+            estado = await self._predict(send, cuerpo, _encabezado(scope, b'idempotency-key'))
+            metricas.solicitudes_http.observar(time.perf_counter() - inicio, 'predict', str(estado))
+            return
+        if scope['path'] == '/eventos' and scope['method'] == 'GET':
+            await self._eventos(scope, receive, send)
+            return
+        loop = asyncio.get_running_loop()
+        estado, cuerpo, encabezados = await loop.run_in_executor(self.pool, _llamar_flask,
+                                                                 _environ_wsgi(scope, cuerpo))
+        await _responder(send, estado, cuerpo, encabezados)
+
+    async def _predict(self, send, cuerpo, clave_cliente=None):
+        try:
+            data = json.loads(cuerpo) if cuerpo else None
+        except ValueError:
+            data = None
+        if not data or not isinstance(data, dict):
+            await _responder_json(send, 400, {'error': 'No se recibieron datos'})
+            return 400
+        try:
+            estado, respuesta, repetida = await self.agrupador.evaluar(data, clave_cliente)
+        except Exception as e:
+            await _responder_json(send, 500, {'error': f'Error interno: {str(e)}'})
+            return 500
+        await _responder_json(send, estado, respuesta, [(b'idempotent-replayed', b'true')] if repetida else ())
+        return estado
+
+    async def _eventos(self, scope, receive, send):
+        """Server-sent events del tablero (ver eventos_module) hasta que el cliente se desconecte"""
+        suscripcion = eventos.suscribir(_encabezado(scope, b'last-event-id'))
+        if suscripcion is None:
+            await _responder_json(send, 503, {'error': 'Demasiados clientes conectados'})
+            return
+        desconexion = asyncio.ensure_future(receive())
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                    (b'x-accel-buffering', b'no')]})
+            while True:
+                siguiente = asyncio.ensure_future(eventos.siguiente_async(suscripcion))
+                await asyncio.wait({siguiente, desconexion}, return_when=asyncio.FIRST_COMPLETED)
+                if desconexion.done():
+                    siguiente.cancel()
+                    break
+                await send({'type': 'http.response.body', 'body': siguiente.result(), 'more_body': True})
+        finally:
+            desconexion.cancel()
+            eventos.cancelar(suscripcion)
+
+    async def _ciclo_de_vida(self, receive, send):
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensaje['type'] == 'lifespan.shutdown':
+                self.pool.shutdown(wait=True)
+                auditoria.detener()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AppAsgi()
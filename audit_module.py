@@ -0,0 +1,547 @@
+"""
+Registro diferido (write-behind) de decisiones en SQLite y Firestore.
+
+/predict deja cada decisión en una cola acotada y responde de inmediato; un hilo
+de fondo la vacía por lotes: un executemany por lote en `solicitudes` y un batch
+de Firestore por lote. Antes de encolarse, cada registro se anota en un archivo
+de derrame (NDJSON) por proceso que se trunca o borra al confirmarse su lote, así
+que si el proceso muere las decisiones pendientes se recuperan al siguiente
+arranque (entrega al menos una vez).
+
+Si SQLite guardó el lote pero Firestore lo rechazó, los documentos pasan a un
+archivo de derrame aparte (remoto_<pid>_<n>.ndjson) antes de confirmar el lote, y
+el hilo los reintenta cada REINTENTO_REMOTO_S; solo se borran de ese archivo
+cuando Firestore los acepta. Con AUDITORIA_MODO=sincrono no hay archivos de
+derrame y un error de Firestore solo se registra, como antes.
+"""
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from db_module import RUTA_BASE, ejecutar_escritura
+from metrics_module import escrituras_auditoria
+
+logger = logging.getLogger(__name__)
+
+# Configuración por variables de entorno
+INTERVALO_MS = int(os.environ.get('AUDITORIA_INTERVALO_MS', 200))  # Espera máxima para completar un lote
+TAMANO_LOTE = int(os.environ.get('AUDITORIA_LOTE', 500))  # Registros por lote
+CAPACIDAD_COLA = int(os.environ.get('AUDITORIA_COLA_MAX', 10000))
+# Cola llena: 'sincrono' escribe en el hilo de la solicitud, 'bloquear' espera lugar,
+# 'descartar' deja el registro solo en el archivo de derrame (se recupera al reiniciar)
+POLITICA = os.environ.get('AUDITORIA_POLITICA', 'sincrono')
+# 'diferido' (cola + hilo) o 'sincrono' (escritura inmediata, comportamiento anterior)
+MODO = os.environ.get('AUDITORIA_MODO', 'diferido')
+RUTA_DERRAME = os.environ.get('AUDITORIA_DERRAME', os.path.join(RUTA_BASE, 'auditoria_pendiente'))
+# Espera entre reintentos de los documentos que Firestore rechazó (segundos)
+REINTENTO_REMOTO_S = float(os.environ.get('AUDITORIA_REINTENTO_S', 30))
+
+# Registros por archivo de derrame antes de rotar a uno nuevo
+REGISTROS_POR_SEGMENTO = 5000
+
+
+class FirestoreLocal:
+    """
+    Sustituto local de firestore.Client para desarrollo y pruebas.
+
+    Implementa lo que usa la app (collection().add/document().set, batch().set/commit)
+    y guarda cada documento como una línea NDJSON en `ruta`. Mientras `fallas` sea
+    mayor que 0, cada escritura lo descuenta y lanza ConnectionError sin guardar nada
+    (para probar los reintentos).
+    """
+
+    def __init__(self, ruta, fallas=0):
+        self.ruta = ruta
+        self.fallas = fallas
+        self.escrituras = 0
+        self.commits = 0
+        self._lock = threading.Lock()
+
+    def collection(self, nombre):
+        return _ColeccionLocal(self, nombre)
+
+    def batch(self):
+        return _LoteLocal(self)
+
+    def _escribir(self, documentos):
+        with self._lock:
+            if self.fallas > 0:
+                self.fallas -= 1
+                raise ConnectionError('FirestoreLocal: falla simulada')
+            with open(self.ruta, 'a', encoding='utf-8') as archivo:
+                for documento in documentos:
+                    archivo.write(json.dumps(documento, ensure_ascii=False, default=str) + '\n')
+            self.escrituras += len(documentos)
+            self.commits += 1
+
+    def documentos(self):
+        """Lee todos los documentos guardados"""
+        if not os.path.exists(self.ruta):
+            return []
+        with open(self.ruta, encoding='utf-8') as archivo:
+            return [json.loads(linea) for linea in archivo if linea.strip()]
+
+
+class _ColeccionLocal:
+    def __init__(self, cliente, nombre):
+        self.cliente = cliente
+        self.nombre = nombre
+
+    def document(self, id_documento=None):
+        return _DocumentoLocal(self.cliente, self.nombre, id_documento or uuid.uuid4().hex)
+
+    def add(self, datos):
+        documento = self.document()
+        documento.set(datos)
+        return None, documento
+
+
+class _DocumentoLocal:
+    def __init__(self, cliente, coleccion, id_documento):
+        self.cliente = cliente
+        self.coleccion = coleccion
+        self.id = id_documento
+
+    def set(self, datos):
+        self.cliente._escribir([{'coleccion': self.coleccion, 'id': self.id, 'datos': datos}])
+
+
+class _LoteLocal:
+    def __init__(self, cliente):
+        self.cliente = cliente
+        self._pendientes = []
+
+    def set(self, documento, datos):
+        self._pendientes.append({'coleccion': documento.coleccion, 'id': documento.id, 'datos': datos})
+
+    def commit(self):
+        self.cliente._escribir(self._pendientes)
+        self._pendientes = []
+
+
+class ArchivoDerrame:
+    """
+    Bitácora en disco de registros aceptados y aún no confirmados.
+
+    Cada proceso escribe en sus propios segmentos (<prefijo>_<pid>_<n>.ndjson). Un
+    segmento se borra cuando todos sus registros fueron confirmados; el segmento
+    actual se trunca en ese caso.
+    """
+
+    def __init__(self, directorio, prefijo='pendiente'):
+        self.directorio = directorio
+        self.prefijo = prefijo
+        os.makedirs(directorio, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._numero = 0
+        self._archivo = None
+        self._lineas = 0
+        self._pendientes = {}
+
+    def _ruta(self, numero):
+        return os.path.join(self.directorio, f'{self.prefijo}_{self._pid}_{numero}.ndjson')
+
+    def _abrir(self):
+        self._archivo = open(self._ruta(self._numero), 'a', encoding='utf-8')
+        self._lineas = 0
+        self._pendientes.setdefault(self._numero, 0)
+
+    def anotar(self, registros):
+        """Anota registros y devuelve el número de segmento donde quedaron"""
+        with self._lock:
+            if self._archivo is None:
+                self._abrir()
+            elif self._lineas >= REGISTROS_POR_SEGMENTO:
+                self._archivo.close()
+                self._numero += 1
+                self._abrir()
+            for registro in registros:
+                self._archivo.write(json.dumps(registro, ensure_ascii=False, default=str) + '\n')
+            self._archivo.flush()
+            self._lineas += len(registros)
+            self._pendientes[self._numero] += len(registros)
+            return self._numero
+
+    def confirmar(self, segmentos):
+        """Descuenta registros confirmados ({segmento: cantidad}) y limpia segmentos vacíos"""
+        with self._lock:
+            for numero, cantidad in segmentos.items():
+                self._pendientes[numero] -= cantidad
+            for numero in [n for n, p in self._pendientes.items() if p <= 0]:
+                if numero == self._numero:
+                    if self._archivo is not None:
+                        self._archivo.truncate(0)
+                        self._archivo.seek(0)
+                        self._lineas = 0
+                    continue
+                del self._pendientes[numero]
+                try:
+                    os.remove(self._ruta(numero))
+                except FileNotFoundError:
+                    pass
+
+    def cerrar(self):
+        """Cierra el segmento actual y lo borra si no quedan registros sin confirmar"""
+        with self._lock:
+            if self._archivo is not None:
+                self._archivo.close()
+                self._archivo = None
+                if self._pendientes.get(self._numero, 0) <= 0:
+                    os.remove(self._ruta(self._numero))
+
+    @staticmethod
+    def _proceso_vivo(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def reclamar_huerfanos(self):
+        """
+        Toma los segmentos de procesos que ya no existen (renombrándolos para que
+        otro worker no los procese también).
+
+        Returns:
+            tuple: (rutas reclamadas, registros que contienen)
+        """
+        reclamados = []
+        registros = []
+        for ruta in sorted(glob.glob(os.path.join(self.directorio, f'{self.prefijo}_*.ndjson'))):
+            try:
+                pid = int(os.path.basename(ruta).split('_')[1])
+            except (IndexError, ValueError):
+                continue
+            if pid == os.getpid() or self._proceso_vivo(pid):
+                continue
+            reclamado = os.path.join(self.directorio, f'recuperando_{os.getpid()}_{os.path.basename(ruta)}')
+            try:
+                os.rename(ruta, reclamado)
+            except FileNotFoundError:
+                continue  # Otro worker lo reclamó primero
+            reclamados.append(reclamado)
+            with open(reclamado, encoding='utf-8') as archivo:
+                for linea in archivo:
+                    try:
+                        registros.append(json.loads(linea))
+                    except json.JSONDecodeError:
+                        pass  # Última línea incompleta de un proceso interrumpido
+        return reclamados, registros
+
+    def devolver(self, reclamados):
+        """Devuelve segmentos reclamados que no se pudieron procesar (se reintentan al próximo arranque)"""
+        prefijo = f'recuperando_{os.getpid()}_'
+        for ruta in reclamados:
+            nombre = os.path.basename(ruta)
+            if nombre.startswith(prefijo):
+                os.rename(ruta, os.path.join(self.directorio, nombre[len(prefijo):]))
+
+
+class _Vaciar:
+    """Marca en la cola: el hilo escribe lo acumulado y avisa por `evento`"""
+
+    def __init__(self):
+        self.evento = threading.Event()
+
+
+_FIN = object()
+
+
+class EscritorDiferido:
+    """
+    Cola acotada de decisiones con un hilo que las escribe por lotes.
+
+    Cada registro es {'fila': valores de INSERT, 'documento': documento de Firestore o None}.
+    El hilo se inicia en el primer registro de cada proceso, así que es seguro
+    crear el escritor antes de un fork.
+    """
+
+    def __init__(self, insert_sql, firestore=None, coleccion='evaluaciones', intervalo_ms=INTERVALO_MS,
+                 tamano_lote=TAMANO_LOTE, capacidad=CAPACIDAD_COLA, politica=POLITICA, modo=MODO,
+                 ruta_derrame=RUTA_DERRAME, reintento_remoto_s=REINTENTO_REMOTO_S):
+        self.insert_sql = insert_sql
+        self.firestore = firestore
+        self.coleccion = coleccion
+        self.intervalo = intervalo_ms / 1000
+        self.tamano_lote = tamano_lote
+        self.capacidad = capacidad
+        self.politica = politica
+        self.modo = modo
+        self.ruta_derrame = ruta_derrame
+        self.reintento_remoto = reintento_remoto_s
+        self._lock = threading.Lock()
+        self._pid = None
+        self._hilo = None
+        self._cola = None
+        self._derrame = None
+        self._derrame_remoto = None
+        # Documentos que Firestore rechazó: [(segmento en _derrame_remoto, documento)]
+        self._remotos = []
+        self._proximo_reintento = 0.0
+        # Contadores y documentos pendientes: los tocan los hilos de las solicitudes y el de escritura
+        self._lock_estado = threading.Lock()
+        self.contadores = {'encolados': 0, 'escritos': 0, 'lotes': 0, 'sincronos': 0,
+                           'derramados': 0, 'recuperados': 0, 'errores_bd': 0, 'errores_remotos': 0,
+                           'reintentos_remotos': 0, 'remotos_recuperados': 0}
+
+    def _contar(self, clave, cantidad=1):
+        with self._lock_estado:
+            self.contadores[clave] += cantidad
+
+    # ============ CICLO DE VIDA ============
+
+    def _asegurar_iniciado(self):
+        if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+                return
+            self._pid = os.getpid()
+            self._cola = queue.Queue(maxsize=self.capacidad)
+            self._derrame = ArchivoDerrame(self.ruta_derrame)
+            self._derrame_remoto = ArchivoDerrame(self.ruta_derrame, prefijo='remoto')
+            self._remotos = []
+            self._recuperar()
+            self._hilo = threading.Thread(target=self._ciclo, name='escritor-auditoria', daemon=True)
+            self._hilo.start()
+
+    def _recuperar(self):
+        """Reescribe decisiones que quedaron pendientes en procesos anteriores"""
+        # Documentos que Firestore rechazó en otro proceso: pasan al derrame remoto de
+        # este y el hilo los reintenta de inmediato
+        rutas, documentos = self._derrame_remoto.reclamar_huerfanos()
+        if documentos:
+            self._pendientes_remotos(documentos)
+            self._proximo_reintento = 0.0
+            logger.info('%d documentos pendientes de Firebase de procesos anteriores', len(documentos))
+        for ruta in rutas:
+            os.remove(ruta)
+
+        rutas, registros = self._derrame.reclamar_huerfanos()
+        # Filas anotadas por una versión anterior con menos columnas: las nuevas quedan en NULL
+        columnas = self.insert_sql.count('?')
+        for registro in registros:
+            if len(registro['fila']) < columnas:
+                registro['fila'] = list(registro['fila']) + [None] * (columnas - len(registro['fila']))
+        for inicio in range(0, len(registros), self.tamano_lote):
+            if not self._escribir(registros[inicio:inicio + self.tamano_lote]):
+                logger.error('No se pudieron recuperar %d decisiones pendientes; se conservan en %s',
+                             len(registros), self.ruta_derrame)
+                self._derrame.devolver(rutas)
+                return
+        for ruta in rutas:
+            os.remove(ruta)
+        if registros:
+            self._contar('recuperados', len(registros))
+            logger.info('Recuperadas %d decisiones pendientes de procesos anteriores', len(registros))
+
+    def detener(self, timeout=10):
+        """Escribe todo lo pendiente y detiene el hilo (se llama también al salir)"""
+        if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+            return
+        self._cola.put(_FIN)
+        self._hilo.join(timeout)
+        self._derrame.cerrar()
+        # Si Firestore sigue fallando, su segmento queda y lo toma el próximo arranque
+        self._derrame_remoto.cerrar()
+
+    def vaciar(self, timeout=10):
+        """Bloquea hasta que todo lo encolado hasta ahora esté escrito"""
+        if self.modo == 'sincrono' or self._hilo is None or self._pid != os.getpid():
+            return True
+        marca = _Vaciar()
+        self._cola.put(marca)
+        return marca.evento.wait(timeout)
+
+    # ============ REGISTRO ============
+
+    def registrar(self, fila, documento=None):
+        self.registrar_lote([(fila, documento)])
+
+    def registrar_lote(self, items):
+        """Registra varias decisiones [(fila, documento)] sin bloquear la solicitud"""
+        registros = [{'fila': list(fila), 'documento': documento} for fila, documento in items]
+        if not registros:
+            return
+        if self.modo == 'sincrono':
+            self._contar('sincronos', len(registros))
+            self._escribir(registros)
+            return
+
+        self._asegurar_iniciado()
+        segmento = self._derrame.anotar(registros)
+        for registro in registros:
+            registro['_segmento'] = segmento
+            try:
+                self._cola.put(registro, block=self.politica == 'bloquear')
+                self._contar('encolados')
+            except queue.Full:
+                if self.politica == 'descartar':
+                    # Queda en el archivo de derrame y se recupera al reiniciar
+                    self._contar('derramados')
+                else:
+                    self._contar('sincronos')
+                    if self._escribir([registro]):
+                        self._derrame.confirmar({segmento: 1})
+
+    # ============ HILO DE ESCRITURA ============
+
+    def _ciclo(self):
+        terminar = False
+        while not terminar:
+            try:
+                item = self._cola.get(timeout=self._espera_reintento())
+            except queue.Empty:
+                self._reintentar_remotos()
+                continue
+            if item is _FIN:
+                break
+            lote = []
+            marcas = []
+            if isinstance(item, _Vaciar):
+                marcas.append(item)
+            else:
+                lote.append(item)
+
+            limite = time.monotonic() + self.intervalo
+            while len(lote) < self.tamano_lote and not marcas:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if item is _FIN:
+                    terminar = True
+                    break
+                if isinstance(item, _Vaciar):
+                    marcas.append(item)
+                else:
+                    lote.append(item)
+
+            self._escribir_y_confirmar(lote)
+            self._reintentar_remotos()
+            for marca in marcas:
+                marca.evento.set()
+
+        # Drenaje final: lo que quede en la cola
+        restantes = []
+        while True:
+            try:
+                item = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _Vaciar):
+                item.evento.set()
+            elif item is not _FIN:
+                restantes.append(item)
+        for inicio in range(0, len(restantes), self.tamano_lote):
+            self._escribir_y_confirmar(restantes[inicio:inicio + self.tamano_lote])
+        self._reintentar_remotos(forzar=True)
+
+    def _escribir_y_confirmar(self, lote):
+        if not lote:
+            return
+        if self._escribir(lote):
+            segmentos = {}
+            for registro in lote:
+                segmentos[registro['_segmento']] = segmentos.get(registro['_segmento'], 0) + 1
+            self._derrame.confirmar(segmentos)
+
+    def _escribir(self, registros):
+        """
+        Escribe un lote en SQLite (una transacción) y en Firestore (un batch).
+        Devuelve False si SQLite falló: los registros siguen en el archivo de derrame.
+        Si solo falló Firestore, los documentos quedan en el derrame remoto (antes de
+        que se confirme el lote) para reintentarlos.
+        """
+        inicio = time.perf_counter()
+        try:
+            ejecutar_escritura(self.insert_sql, [r['fila'] for r in registros], muchos=True)
+            escrituras_auditoria.observar(time.perf_counter() - inicio, 'sqlite')
+        except Exception:
+            self._contar('errores_bd')
+            logger.exception('Error al guardar %d decisiones en BD', len(registros))
+            return False
+
+        documentos = [r['documento'] for r in registros if r.get('documento') is not None]
+        if self.firestore is not None and documentos and not self._escribir_remoto(documentos):
+            self._pendientes_remotos(documentos)
+
+        self._contar('escritos', len(registros))
+        self._contar('lotes')
+        return True
+
+    def _escribir_remoto(self, documentos):
+        """Escribe documentos en Firestore; devuelve False (y registra el error) si falla"""
+        comienzo = time.perf_counter()
+        try:
+            coleccion = self.firestore.collection(self.coleccion)
+            # Firestore admite hasta 500 escrituras por batch
+            for inicio in range(0, len(documentos), 500):
+                lote = self.firestore.batch()
+                for documento in documentos[inicio:inicio + 500]:
+                    lote.set(coleccion.document(), documento)
+                lote.commit()
+            escrituras_auditoria.observar(time.perf_counter() - comienzo, 'firestore')
+            return True
+        except Exception:
+            self._contar('errores_remotos')
+            logger.exception('Error al guardar %d decisiones en Firebase', len(documentos))
+            return False
+
+    # ============ REINTENTOS DE FIRESTORE ============
+
+    def _pendientes_remotos(self, documentos):
+        """Anota en el derrame remoto documentos que Firestore no aceptó"""
+        if self._derrame_remoto is None:
+            return  # Modo sincrono: sin archivos de derrame
+        segmento = self._derrame_remoto.anotar(documentos)
+        with self._lock_estado:
+            if not self._remotos:
+                self._proximo_reintento = time.monotonic() + self.reintento_remoto
+            self._remotos.extend((segmento, documento) for documento in documentos)
+
+    def _espera_reintento(self):
+        """Segundos hasta el próximo reintento (None = no hay nada que reintentar)"""
+        if not self._remotos or self.firestore is None:
+            return None
+        return max(0.0, self._proximo_reintento - time.monotonic())
+
+    def _reintentar_remotos(self, forzar=False):
+        """Reintenta los documentos pendientes de a tamano_lote; corta en el primer error"""
+        with self._lock_estado:
+            if (not self._remotos or self.firestore is None
+                    or (not forzar and time.monotonic() < self._proximo_reintento)):
+                return
+            pendientes, self._remotos = self._remotos, []
+
+        for inicio in range(0, len(pendientes), self.tamano_lote):
+            tramo = pendientes[inicio:inicio + self.tamano_lote]
+            self._contar('reintentos_remotos')
+            if not self._escribir_remoto([documento for _, documento in tramo]):
+                with self._lock_estado:
+                    self._remotos = pendientes[inicio:] + self._remotos
+                    self._proximo_reintento = time.monotonic() + self.reintento_remoto
+                return
+            segmentos = {}
+            for segmento, _ in tramo:
+                segmentos[segmento] = segmentos.get(segmento, 0) + 1
+            self._derrame_remoto.confirmar(segmentos)
+            self._contar('remotos_recuperados', len(tramo))
+
+    def estadisticas(self):
+        with self._lock_estado:
+            contadores = dict(self.contadores, pendientes_remotos=len(self._remotos))
+        return dict(contadores,
+                    en_cola=self._cola.qsize() if self._cola is not None else 0,
+                    modo=self.modo, politica=self.politica)
@@ -0,0 +1,160 @@
+"""
+Prueba de carga de /predict: app Flask síncrona vs. modo ASGI con micro-lotes.
+
+El modo 'sync' reproduce un worker de gunicorn con hilos: `--concurrencia` hilos
+envían /predict por el cliente de prueba de Flask. El modo 'asgi' abre la misma
+cantidad de clientes concurrentes contra asgi_app con httpx.ASGITransport (mismo
+proceso, sin red). Cada modo corre en su propio proceso contra una base temporal
+y reporta solicitudes por segundo, p50/p95/p99 y, en ASGI, el tamaño de los lotes.
+
+Con --macro snapshot las solicitudes no traen variables macro y usan un snapshot
+(ver macro_module); con --macro solicitud cada una trae las suyas.
+
+Uso:
+    python benchmarks/carga_asgi.py --concurrencia 32 --solicitudes 2000 --lote-max 64 --espera-ms 2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+from benchmarks.generador import RANGOS_MACRO, generar_solicitudes  # noqa: E402
+
+
+def percentiles(tiempos):
+    ordenados = sorted(tiempos)
+
+    def p(q):
+        return round(ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))] * 1000, 2)
+
+    return {'p50_ms': p(0.50), 'p95_ms': p(0.95), 'p99_ms': p(0.99), 'max_ms': round(ordenados[-1] * 1000, 2)}
+
+
+def _solicitudes(n, macro, semilla):
+    solicitudes = generar_solicitudes(n, semilla=semilla, fraccion_crisis=0)
+    if macro == 'snapshot':
+        for solicitud in solicitudes:
+            for campo in RANGOS_MACRO:
+                del solicitud[campo]
+    return solicitudes
+
+
+def _modo_sync(solicitudes, concurrencia):
+    import app
+    tiempos = []
+    siguiente = iter(range(len(solicitudes)))
+    lock = threading.Lock()
+
+    def hilo():
+        cliente = app.app.test_client()
+        while True:
+            with lock:
+                i = next(siguiente, None)
+            if i is None:
+                return
+            inicio = time.perf_counter()
+            respuesta = cliente.post('/predict', json=solicitudes[i])
+            tiempos.append(time.perf_counter() - inicio)
+            assert respuesta.status_code == 200, respuesta.get_data(as_text=True)
+
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=hilo) for _ in range(concurrencia)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    duracion = time.perf_counter() - inicio
+    app.auditoria.vaciar(timeout=60)
+    return tiempos, duracion, {}
+
+
+def _modo_asgi(solicitudes, concurrencia):
+    import asyncio
+    import httpx
+    import asgi_app
+    tiempos = []
+
+    async def principal():
+        transporte = httpx.ASGITransport(app=asgi_app.app)
+        async with httpx.AsyncClient(transport=transporte, base_url='http://carga') as cliente:
+            pendientes = iter(solicitudes)
+
+            async def cliente_virtual():
+                for solicitud in pendientes:
+                    inicio = time.perf_counter()
+                    respuesta = await cliente.post('/predict', json=solicitud)
+                    tiempos.append(time.perf_counter() - inicio)
+                    assert respuesta.status_code == 200, respuesta.text
+
+            inicio = time.perf_counter()
+            await asyncio.gather(*(cliente_virtual() for _ in range(concurrencia)))
+            return time.perf_counter() - inicio
+
+    duracion = asyncio.run(principal())
+    asgi_app.auditoria.vaciar(timeout=60)
+    return tiempos, duracion, asgi_app.app.agrupador.estadisticas()
+
+
+def _worker(argumentos):
+    modo, directorio, n, concurrencia, macro, lote_max, espera_ms = argumentos
+    os.environ['HISTORIAL_DB'] = os.path.join(directorio, f'{modo}.db')
+    os.environ['AUDITORIA_DERRAME'] = os.path.join(directorio, f'auditoria_{modo}')
+    os.environ['FIREBASE_CREDENCIALES'] = os.path.join(directorio, 'sin_credenciales.json')
+    os.environ.pop('FIRESTORE_LOCAL', None)
+    os.environ['ASGI_LOTE_MAX'] = str(lote_max)
+    os.environ['ASGI_ESPERA_MS'] = str(espera_ms)
+    os.environ['MACRO_REVISION_S'] = '3600'
+    os.environ['PRECALENTAR'] = 'sincrono'
+    os.environ['IDEMPOTENCIA'] = '0'  # Se mide la evaluación, no la caché de respuestas
+    warnings.filterwarnings('ignore')
+    import app
+    cliente = app.app.test_client()  # Crea la app: migraciones y precalentamiento
+    if macro == 'snapshot':
+        app.registro_macro.crear({campo: (minimo + maximo) / 2 for campo, (minimo, maximo) in RANGOS_MACRO.items()})
+
+    solicitudes = _solicitudes(n, macro, semilla=7)
+    # Calentamiento: primeras compilaciones y snapshot macro
+    cliente.post('/predict', json=solicitudes[0])
+
+    ejecutar = _modo_sync if modo == 'sync' else _modo_asgi
+    tiempos, duracion, lotes = ejecutar(solicitudes, concurrencia)
+    resultado = {'solicitudes': len(tiempos), 'segundos': round(duracion, 3),
+                 'solicitudes_por_segundo': round(len(tiempos) / duracion, 1), **percentiles(tiempos)}
+    if lotes:
+        resultado['lotes'] = lotes['lotes']
+        resultado['tamano_medio_lote'] = round(lotes['solicitudes'] / max(lotes['lotes'], 1), 1)
+        resultado['max_lote'] = lotes['max_lote']
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--concurrencia', type=int, default=32, help='Clientes concurrentes')
+    parser.add_argument('--solicitudes', type=int, default=2000, help='Solicitudes totales por modo')
+    parser.add_argument('--macro', choices=['solicitud', 'snapshot'], default='solicitud')
+    parser.add_argument('--lote-max', type=int, default=64)
+    parser.add_argument('--espera-ms', type=float, default=2)
+    parser.add_argument('--modos', default='sync,asgi')
+    args = parser.parse_args(argv)
+
+    resultados = {}
+    with tempfile.TemporaryDirectory(prefix='carga_asgi_') as directorio:
+        contexto = multiprocessing.get_context('spawn')
+        for modo in args.modos.split(','):
+            with contexto.Pool(1) as pool:
+                resultados[modo] = pool.apply(_worker, ((modo, directorio, args.solicitudes, args.concurrencia,
+                                                         args.macro, args.lote_max, args.espera_ms),))
+    print(json.dumps({'parametros': vars(args), 'resultados': resultados}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+Prueba de carga de /predict concurrente: capa db_module vs. conexión por solicitud.
+
+Lanza varios procesos (como workers de gunicorn), cada uno con varios hilos que
+envían /predict por el cliente de prueba de Flask contra una base temporal, y
+reporta p50/p95/p99 de la solicitud completa y del paso de persistencia.
+
+El modo 'actual' usa el registro diferido de audit_module (la persistencia se mide
+por lote escrito en el hilo de fondo). El modo 'legacy' reproduce el guardado
+anterior: escritura síncrona en la solicitud, sqlite3.connect por solicitud,
+journal DELETE, synchronous FULL y commit individual.
+
+Uso:
+    python benchmarks/carga_predict.py --procesos 4 --hilos 4 --solicitudes 50
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+
+def solicitud_aleatoria(generador):
+    """Solicitud válida que llega hasta el Random Forest en la mayoría de los casos"""
+    monto = generador.choice([80000, 150000, 250000, 400000])
+    return {
+        'nombre': 'Carga',
+        'loan_amount': monto,
+        'income': generador.choice([6000, 9000, 15000, 25000]),
+        'term': generador.choice([180, 240, 360]),
+        'property_value': monto * generador.uniform(1.3, 2.0),
+        'inflacion': generador.choice([2.5, 3.5, 6.0, 8.0]),
+        'combustible': generador.choice([2.8, 3.2, 3.8]),
+        'protestas': generador.choice([200, 500, 900]),
+        'desempleo': generador.choice([3.5, 4.2, 5.5, 7.0]),
+        'covid': generador.choice([300, 800, 1500]),
+        'clima': generador.choice([15, 20, 25]),
+        'credit_worthiness': generador.choice(['Excellent', 'Good', 'Fair']),
+        'gender': generador.choice(['Male', 'Female']),
+        'age': generador.choice(['25-34', '35-44', '45-54']),
+        'region': generador.choice(['North', 'South', 'Central', 'North-East']),
+        'credit_type': generador.choice(['CIB', 'EXP', 'EQUI']),
+        'approv_in_adv': True,
+        'co_applicant': generador.random() < 0.5,
+    }
+
+
+def _escritura_legacy(ruta):
+    """Guardado anterior a db_module: una conexión y un commit por solicitud"""
+    def ejecutar_escritura(sql, parametros=(), muchos=False):
+        conn = sqlite3.connect(ruta)
+        cursor = conn.cursor()
+        if muchos:
+            cursor.executemany(sql, parametros)
+        else:
+            cursor.execute(sql, parametros)
+        conn.commit()
+        conn.close()
+    return ejecutar_escritura
+
+
+def _worker(argumentos):
+    modo, ruta, hilos, solicitudes, semilla = argumentos
+    os.environ['HISTORIAL_DB'] = ruta
+    os.environ['AUDITORIA_DERRAME'] = os.path.join(os.path.dirname(ruta), 'auditoria_pendiente')
+    os.environ['PRECALENTAR'] = 'sincrono'
+    os.environ['IDEMPOTENCIA'] = '0'  # Se mide la evaluación, no la caché de respuestas
+    if modo == 'legacy':
+        os.environ['AUDITORIA_MODO'] = 'sincrono'
+    warnings.filterwarnings('ignore')
+    import app
+    import audit_module
+
+    escritura = _escritura_legacy(ruta) if modo == 'legacy' else audit_module.ejecutar_escritura
+    tiempos_escritura = []
+
+    def escritura_medida(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return escritura(*args, **kwargs)
+        finally:
+            tiempos_escritura.append(time.perf_counter() - inicio)
+
+    audit_module.ejecutar_escritura = escritura_medida
+    tiempos = []
+
+    def hilo(indice):
+        generador = random.Random(semilla * 1000 + indice)
+        cliente = app.app.test_client()
+        for _ in range(solicitudes):
+            inicio = time.perf_counter()
+            respuesta = cliente.post('/predict', json=solicitud_aleatoria(generador))
+            tiempos.append(time.perf_counter() - inicio)
+            assert respuesta.status_code == 200, respuesta.get_data(as_text=True)
+
+    hilos_activos = [threading.Thread(target=hilo, args=(i,)) for i in range(hilos)]
+    for h in hilos_activos:
+        h.start()
+    for h in hilos_activos:
+        h.join()
+    app.auditoria.vaciar()
+    return tiempos, tiempos_escritura
+
+
+def percentiles(tiempos):
+    ordenados = sorted(tiempos)
+
+    def p(q):
+        return round(ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))] * 1000, 2)
+
+    return {'p50_ms': p(0.50), 'p95_ms': p(0.95), 'p99_ms': p(0.99), 'max_ms': round(ordenados[-1] * 1000, 2)}
+
+
+def ejecutar_modo(modo, procesos, hilos, solicitudes):
+    directorio = tempfile.mkdtemp(prefix=f'carga_{modo}_')
+    ruta = os.path.join(directorio, 'historial.db')
+
+    # Crear el esquema antes de lanzar los workers
+    os.environ['HISTORIAL_DB'] = ruta
+    import db_module
+    db_module.RUTA_DB = ruta
+    db_module.init_db()
+    if modo == 'legacy':
+        conn = sqlite3.connect(ruta)
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.close()
+
+    contexto = multiprocessing.get_context('spawn')
+    inicio = time.perf_counter()
+    with contexto.Pool(procesos) as pool:
+        resultados = pool.map(_worker, [(modo, ruta, hilos, solicitudes, p) for p in range(procesos)])
+    segundos = time.perf_counter() - inicio
+
+    tiempos = [t for r in resultados for t in r[0]]
+    escrituras = [t for r in resultados for t in r[1]]
+    return {
+        'solicitudes': len(tiempos),
+        'solicitudes_por_segundo': round(len(tiempos) / segundos, 1),
+        'predict': percentiles(tiempos),
+        'persistencia': percentiles(escrituras),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--procesos', type=int, default=4)
+    parser.add_argument('--hilos', type=int, default=4)
+    parser.add_argument('--solicitudes', type=int, default=50, help='Solicitudes por hilo')
+    parser.add_argument('--modo', choices=['actual', 'legacy', 'ambos'], default='ambos')
+    args = parser.parse_args(argv)
+
+    modos = ['legacy', 'actual'] if args.modo == 'ambos' else [args.modo]
+    resultados = {modo: ejecutar_modo(modo, args.procesos, args.hilos, args.solicitudes) for modo in modos}
+    print(json.dumps(resultados, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
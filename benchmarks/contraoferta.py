@@ -0,0 +1,104 @@
+"""
+Latencia de la búsqueda de contraofertas contra una búsqueda secuencial.
+
+'lotes' es buscar_contraoferta (rejillas por lote, riesgo difuso una vez);
+'secuencial' hace, por plazo, una bisección binaria sobre los mismos múltiplos de
+paso llamando a evaluar_solicitud con cada candidato (lo mismo que encadenar
+llamadas a /predict, sin HTTP). Se comprueba que ambas encuentren los mismos montos
+cuando las aprobaciones son monótonas en el monto.
+
+Uso:
+    python benchmarks/contraoferta.py --solicitudes 30 --secuenciales 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+from benchmarks.generador import generar_solicitudes  # noqa: E402
+
+
+def _percentiles(tiempos):
+    ms = np.array(tiempos) * 1000
+    return {'p50_ms': round(float(np.percentile(ms, 50)), 1),
+            'p99_ms': round(float(np.percentile(ms, 99)), 1),
+            'max_ms': round(float(ms.max()), 1)}
+
+
+def busqueda_secuencial(data, plazos, paso, monto_minimo, evaluar_solicitud):
+    """Mayor monto aprobado por plazo con una llamada a evaluar_solicitud por candidato"""
+    resultado = {}
+    llamadas = 0
+    for plazo in plazos:
+        bajo, alto = int(np.ceil(monto_minimo / paso)) - 1, int(float(data['loan_amount']) // paso) + 1
+        while alto - bajo > 1:
+            medio = (bajo + alto) // 2
+            decision = evaluar_solicitud(dict(data, loan_amount=medio * paso, term=plazo))[4]
+            llamadas += 1
+            if decision == 'APROBADO':
+                bajo = medio
+            else:
+                alto = medio
+        resultado[plazo] = float(bajo * paso) if bajo * paso >= monto_minimo else None
+    return resultado, llamadas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--solicitudes', type=int, default=30)
+    parser.add_argument('--secuenciales', type=int, default=5,
+                        help='Solicitudes que además se buscan en forma secuencial (lenta)')
+    parser.add_argument('--semilla', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    directorio = tempfile.mkdtemp(prefix='contraoferta_')
+    os.environ['HISTORIAL_DB'] = os.path.join(directorio, 'historial.db')
+    warnings.filterwarnings('ignore')
+    import db_module
+    import decision_module
+    from contraoferta_module import MONTO_MINIMO, PASO_MONTO, buscar_contraoferta
+    db_module.init_db()
+    decision_module.precalentar()
+
+    solicitudes = generar_solicitudes(args.solicitudes, semilla=args.semilla)
+    tiempos, evaluaciones, lotes, resultados = [], [], [], []
+    for data in solicitudes:
+        inicio = time.perf_counter()
+        resultado = buscar_contraoferta(data)
+        tiempos.append(time.perf_counter() - inicio)
+        evaluaciones.append(resultado['evaluaciones'])
+        lotes.append(resultado['lotes'])
+        resultados.append(resultado)
+
+    tiempos_sec, llamadas, coincidencias = [], [], 0
+    for data, resultado in list(zip(solicitudes, resultados))[:args.secuenciales]:
+        plazos = [p['term'] for p in resultado['por_plazo']]
+        inicio = time.perf_counter()
+        montos, n = busqueda_secuencial(data, plazos, PASO_MONTO, MONTO_MINIMO, decision_module.evaluar_solicitud)
+        tiempos_sec.append(time.perf_counter() - inicio)
+        llamadas.append(n)
+        coincidencias += all(montos[p['term']] == (p['oferta']['loan_amount'] if p['oferta'] else None)
+                             for p in resultado['por_plazo'])
+
+    salida = {
+        'parametros': vars(args),
+        'lotes': dict(_percentiles(tiempos), evaluaciones_promedio=round(float(np.mean(evaluaciones)), 1),
+                      lotes_promedio=round(float(np.mean(lotes)), 1)),
+    }
+    if tiempos_sec:
+        salida['secuencial'] = dict(_percentiles(tiempos_sec), llamadas_promedio=round(float(np.mean(llamadas)), 1),
+                                    mismos_montos=f'{coincidencias}/{len(tiempos_sec)}')
+    print(json.dumps(salida, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
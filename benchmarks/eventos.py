@@ -0,0 +1,132 @@
+"""
+Costo de publicar decisiones a los streams del tablero y demora de entrega.
+
+Conecta N clientes asíncronos (como los streams de /eventos en el modo ASGI) en
+un event loop aparte y publica decisiones desde el hilo principal, como lo hace
+registrar_decision. Reporta el tiempo de publicar (lo que se suma a cada
+/predict), la demora hasta que cada cliente recibe el evento y, como referencia,
+lo que cuesta una consulta de /historial + /estadisticas del tablero anterior.
+
+Uso:
+    python benchmarks/eventos.py --clientes 0 10 100 1000 --decisiones 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+import numpy as np
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+
+def _percentiles(tiempos):
+    if not len(tiempos):
+        return {}
+    ms = np.array(tiempos) * 1000
+    return {'p50_ms': round(float(np.percentile(ms, 50)), 3),
+            'p99_ms': round(float(np.percentile(ms, 99)), 3),
+            'max_ms': round(float(ms.max()), 3)}
+
+
+def _fila(i):
+    """Valores de INSERT_SOLICITUD de una decisión sintética"""
+    decision = ('APROBADO', 'RECHAZADO', 'REVISIÓN MANUAL')[i % 3]
+    return ('2026-01-01 00:00:00', f'Carga {i}', 'Male', '35-44', 'North', 9000.0, 150000.0, 360, 'Good',
+            250000.0, 30.0, 60.0, 70.0, 4.5, 25.0, 68.0, decision, 'motivo', None)
+
+
+def medir(difusor, clientes, decisiones, pausa):
+    """Publica `decisiones` con `clientes` conectados; devuelve tiempos de publicación y de entrega"""
+    loop = asyncio.new_event_loop()
+    listos = threading.Event()
+    entregas = []
+    publicados = []  # Inicio de cada publicación, en orden
+    suscripciones = []
+
+    async def cliente(suscripcion):
+        recibidos = 0
+        while recibidos < decisiones:
+            trozo = await difusor.siguiente_async(suscripcion)
+            ahora = time.perf_counter()
+            for _ in range(trozo.count(b'event: decisiones')):
+                entregas.append(ahora - publicados[recibidos])
+                recibidos += 1
+
+    async def principal():
+        tareas = []
+        for _ in range(clientes):
+            suscripcion = difusor.suscribir()
+            suscripciones.append(suscripcion)
+            difusor.pendientes(suscripcion)  # Evento inicial
+            tareas.append(asyncio.ensure_future(cliente(suscripcion)))
+        listos.set()
+        await asyncio.gather(*tareas)
+
+    hilo = threading.Thread(target=loop.run_until_complete, args=(principal(),))
+    hilo.start()
+    listos.wait()
+    tiempos = []
+    for i in range(decisiones):
+        inicio = time.perf_counter()
+        publicados.append(inicio)
+        difusor.publicar([_fila(i)])
+        tiempos.append(time.perf_counter() - inicio)
+        time.sleep(pausa)
+    hilo.join(timeout=60)
+    for suscripcion in suscripciones:
+        difusor.cancelar(suscripcion)
+    loop.close()
+    return tiempos, entregas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--clientes', type=int, nargs='+', default=[0, 10, 100, 1000])
+    parser.add_argument('--decisiones', type=int, default=200)
+    parser.add_argument('--pausa-ms', type=float, default=2, help='Pausa entre decisiones publicadas')
+    parser.add_argument('--filas', type=int, default=20000, help='Filas previas en el historial')
+    args = parser.parse_args(argv)
+
+    directorio = tempfile.mkdtemp(prefix='eventos_')
+    os.environ['HISTORIAL_DB'] = os.path.join(directorio, 'historial.db')
+    warnings.filterwarnings('ignore')
+    import db_module
+    from app import COLUMNAS_SOLICITUD, INSERT_SOLICITUD, formatear_estadisticas
+    from eventos_module import DifusorEventos
+    db_module.init_db()
+    db_module.ejecutar_escritura(INSERT_SOLICITUD, [_fila(i) for i in range(args.filas)], muchos=True)
+
+    salida = {'parametros': vars(args)}
+    for clientes in args.clientes:
+        # Capacidad holgada: se mide la entrega, no los desbordes
+        difusor = DifusorEventos(COLUMNAS_SOLICITUD, formatear_estadisticas, capacidad=args.decisiones + 1,
+                                 max_clientes=max(clientes, 1), latido_s=60)
+        tiempos, entregas = medir(difusor, clientes, args.decisiones, args.pausa_ms / 1000)
+        salida[f'clientes_{clientes}'] = {
+            'publicar': _percentiles(tiempos),
+            'entrega': _percentiles(entregas),
+            'entregas': len(entregas),
+            'desbordes': difusor.contadores['desbordes'],
+        }
+
+    # Referencia: una consulta del tablero anterior (por cliente y por cambio de pestaña)
+    tiempos = []
+    for _ in range(50):
+        inicio = time.perf_counter()
+        db_module.buscar_solicitudes(limite=50)
+        db_module.leer_resumen()
+        tiempos.append(time.perf_counter() - inicio)
+    salida['polling_historial_y_estadisticas'] = _percentiles(tiempos)
+    print(json.dumps(salida, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
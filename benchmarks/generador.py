@@ -0,0 +1,103 @@
+"""
+Generador de solicitudes sintéticas para benchmarks y pruebas de carga.
+
+Las categóricas salen de los dominios de `mappings` (decision_module) y las
+variables macro de rangos habituales, con una fracción de solicitudes en
+escenario de crisis tomadas de todo el universo del sistema difuso. Con la misma
+semilla genera siempre las mismas solicitudes.
+
+Uso:
+    python benchmarks/generador.py 1000 --semilla 3 > solicitudes.ndjson
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+from fuzzy_module import VARIABLES  # noqa: E402
+
+# Dominios de las categóricas (claves de mappings en decision_module)
+DOMINIOS = {
+    'gender': ['Male', 'Female'],
+    'age': ['<25', '25-34', '35-44', '45-54', '55-64', '65-74', '>74'],
+    'region': ['North', 'South', 'Central', 'North-East'],
+    'credit_type': ['CIB', 'EXP', 'EQUI'],
+    'credit_worthiness': ['Excellent', 'Good', 'Fair', 'Poor'],
+}
+PESOS_WORTHINESS = [0.25, 0.4, 0.28, 0.07]
+
+# Rango habitual de cada variable macro (fuera de crisis)
+RANGOS_MACRO = {
+    'inflacion': (1.5, 12.0),
+    'combustible': (2.0, 4.5),
+    'protestas': (50, 1500),
+    'desempleo': (3.0, 9.0),
+    'covid': (0, 2500),
+    'clima': (5, 32),
+}
+
+BANDERAS = {
+    'neg_amortization': 0.03,
+    'interest_only': 0.08,
+    'lump_sum_payment': 0.05,
+    'business_or_commercial': 0.1,
+    'approv_in_adv': 0.6,
+    'co_applicant': 0.45,
+}
+
+PLAZOS = [60, 120, 180, 240, 300, 360]
+
+
+def generar_solicitudes(n, semilla=0, fraccion_crisis=0.05):
+    """
+    Lista de `n` solicitudes válidas para /predict.
+
+    Args:
+        n: Cantidad de solicitudes
+        semilla: Semilla del generador (mismas solicitudes con la misma semilla)
+        fraccion_crisis: Fracción con variables macro de todo el universo difuso
+    """
+    generador = np.random.default_rng(semilla)
+    columnas = {campo: generador.choice(valores, size=n) for campo, valores in DOMINIOS.items()}
+    columnas['credit_worthiness'] = generador.choice(DOMINIOS['credit_worthiness'], size=n, p=PESOS_WORTHINESS)
+
+    income = np.round(generador.lognormal(np.log(7000), 0.6, size=n), 2)
+    loan_amount = np.round(income * generador.uniform(5, 60, size=n), -2)
+    columnas['income'] = income
+    columnas['loan_amount'] = loan_amount
+    columnas['property_value'] = np.round(loan_amount * generador.uniform(1.0, 2.5, size=n), -2)
+    columnas['term'] = generador.choice(PLAZOS, size=n)
+
+    crisis = generador.random(n) < fraccion_crisis
+    for campo, (minimo, maximo) in RANGOS_MACRO.items():
+        inicio, fin, paso = VARIABLES[campo]
+        valores = np.where(crisis, generador.uniform(inicio, fin - paso, size=n),
+                           generador.uniform(minimo, maximo, size=n))
+        columnas[campo] = np.round(valores, 2)
+
+    for campo, probabilidad in BANDERAS.items():
+        columnas[campo] = generador.random(n) < probabilidad
+
+    campos = list(columnas)
+    valores = [columnas[campo].tolist() for campo in campos]
+    return [dict(zip(campos, fila), nombre=f'Sintetico {i}') for i, fila in enumerate(zip(*valores))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('n', type=int, help='Cantidad de solicitudes')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--crisis', type=float, default=0.05, help='Fracción de solicitudes en crisis macro')
+    args = parser.parse_args(argv)
+    for solicitud in generar_solicitudes(args.n, args.semilla, args.crisis):
+        sys.stdout.write(json.dumps(solicitud, ensure_ascii=False) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Benchmark de /historial con millones de filas: paginación por clave e índices.
+
+Llena una base temporal con solicitudes sintéticas (las migraciones de db_module
+crean los índices), mide p50/p99 de cada consulta de buscar_solicitudes y la
+compara con el patrón anterior (sin índices, ORDER BY fecha y OFFSET para paginar).
+También imprime el plan de SQLite de cada consulta para confirmar el índice usado.
+
+Uso:
+    python benchmarks/historial.py --filas 2000000 --repeticiones 50
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+DECISIONES = ['APROBADO', 'RECHAZADO', 'REVISIÓN MANUAL']
+WORTHINESS = ['Excellent', 'Good', 'Fair', 'Poor']
+
+
+def llenar(conn, filas, semilla=0):
+    """Inserta `filas` solicitudes repartidas en los últimos dos años"""
+    generador = random.Random(semilla)
+    inicio = datetime(2024, 1, 1)
+    segundos = 2 * 365 * 86400
+
+    def filas_sinteticas():
+        for _ in range(filas):
+            fecha = inicio + timedelta(seconds=generador.randrange(segundos))
+            yield (fecha.strftime('%Y-%m-%d %H:%M:%S'), 'Benchmark', generador.choice(WORTHINESS),
+                   generador.uniform(50000, 500000), generador.uniform(5, 60), generador.uniform(30, 95),
+                   generador.uniform(20, 100), generador.uniform(0, 10), generador.uniform(0, 100),
+                   generador.uniform(0, 100), generador.choice(DECISIONES))
+
+    with conn:
+        conn.executemany('''INSERT INTO solicitudes (fecha, nombre, credit_worthiness, monto, dti, ltv,
+            score_cliente, riesgo_difuso, probabilidad, score_final, decision)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', filas_sinteticas())
+
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    tiempos.sort()
+    return {'p50_ms': round(tiempos[len(tiempos) // 2] * 1000, 3),
+            'p99_ms': round(tiempos[min(len(tiempos) - 1, int(0.99 * len(tiempos)))] * 1000, 3)}
+
+
+def plan(conn, sql, parametros):
+    return ' | '.join(fila[-1] for fila in conn.execute(f'EXPLAIN QUERY PLAN {sql}', parametros))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--filas', type=int, default=2_000_000)
+    parser.add_argument('--repeticiones', type=int, default=50)
+    parser.add_argument('--paginas', type=int, default=200, help='Profundidad de página a comparar')
+    parser.add_argument('--sin-legacy', action='store_true', help='No medir las consultas sin índices')
+    args = parser.parse_args(argv)
+
+    directorio = tempfile.mkdtemp(prefix='historial_')
+    os.environ['HISTORIAL_DB'] = os.path.join(directorio, 'historial.db')
+    import db_module
+
+    db_module.init_db()
+    conn = db_module.conectar()
+    inicio = time.perf_counter()
+    llenar(conn, args.filas)
+    conn.execute('ANALYZE')
+    print(f'{args.filas} filas insertadas en {time.perf_counter() - inicio:.1f} s', file=sys.stderr)
+
+    # Cursor de la página `--paginas` para medir una página profunda
+    antes = None
+    for _ in range(args.paginas):
+        filas = db_module.buscar_solicitudes(50, antes=antes)
+        antes = (filas[-1]['fecha'], filas[-1]['id'])
+
+    casos = {
+        'primera_pagina': {},
+        f'pagina_{args.paginas}': {'antes': antes},
+        'decision': {'decision': 'REVISIÓN MANUAL'},
+        'decision_y_worthiness': {'decision': 'APROBADO', 'credit_worthiness': 'Fair'},
+        'rango_fechas': {'desde': '2025-03-01', 'hasta': '2025-03-07 23:59:59'},
+        'rango_score': {'score_min': 99.5},
+        'rango_score_y_pagina': {'score_min': 90, 'antes': antes},
+    }
+    resultados = {}
+    for nombre, filtros in casos.items():
+        resultados[nombre] = medir(lambda: db_module.buscar_solicitudes(50, **filtros), args.repeticiones)
+
+    # Plan de SQLite: reutiliza la construcción de la consulta con un conectar() aparte
+    capturadas = []
+    original = db_module.consultar
+    db_module.consultar = lambda sql, parametros=(): capturadas.append((sql, parametros)) or []
+    for filtros in casos.values():
+        db_module.buscar_solicitudes(50, **filtros)
+    db_module.consultar = original
+    for nombre, (sql, parametros) in zip(casos, capturadas):
+        resultados[nombre]['plan'] = plan(conn, sql, parametros)
+
+    if not args.sin_legacy:
+        # Consultas anteriores: sin índices, paginando con OFFSET
+        for indice in ('idx_solicitudes_fecha', 'idx_solicitudes_decision',
+                       'idx_solicitudes_worthiness', 'idx_solicitudes_score'):
+            conn.execute(f'DROP INDEX {indice}')
+        legacy = sqlite3.connect(os.environ['HISTORIAL_DB'])
+        repeticiones = max(3, args.repeticiones // 10)
+        resultados['legacy_primera_pagina'] = medir(
+            lambda: legacy.execute('SELECT * FROM solicitudes ORDER BY fecha DESC LIMIT 50').fetchall(),
+            repeticiones)
+        resultados[f'legacy_pagina_{args.paginas}_offset'] = medir(
+            lambda: legacy.execute('SELECT * FROM solicitudes ORDER BY fecha DESC LIMIT 50 OFFSET ?',
+                                   (50 * args.paginas,)).fetchall(), repeticiones)
+        resultados['legacy_decision'] = medir(
+            lambda: legacy.execute("SELECT * FROM solicitudes WHERE decision = 'REVISIÓN MANUAL' "
+                                   'ORDER BY fecha DESC LIMIT 50').fetchall(), repeticiones)
+
+    print(json.dumps(resultados, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
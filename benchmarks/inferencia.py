@@ -0,0 +1,73 @@
+"""
+Microbenchmark de inferencia del Random Forest: latencia por fila (p50/p99).
+
+Compara scaler.transform + modelo.predict_proba de sklearn contra el motor de
+arreglos de model_module (predict_proba_crudo), para una fila por llamada (como
+/predict) y por lotes (como /predict/batch y evaluar_cartera.py), y verifica que
+ambos den exactamente las mismas probabilidades.
+
+Uso:
+    python benchmarks/inferencia.py --repeticiones 2000 --lotes 1,64,1024
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+from model_module import cargar_arreglos, cargar_pkl, entradas_verificacion  # noqa: E402
+
+
+def medir(funcion, lotes, filas_por_lote):
+    """Latencia por fila de `funcion` sobre cada lote (ms)"""
+    tiempos = []
+    for lote in lotes:
+        inicio = time.perf_counter()
+        funcion(lote)
+        tiempos.append((time.perf_counter() - inicio) / filas_por_lote)
+    tiempos = np.sort(np.array(tiempos)) * 1000
+    return {'p50_ms': round(float(np.percentile(tiempos, 50)), 4),
+            'p99_ms': round(float(np.percentile(tiempos, 99)), 4)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeticiones', type=int, default=2000, help='Llamadas medidas por tamaño de lote')
+    parser.add_argument('--lotes', default='1,64,1024', help='Tamaños de lote separados por coma')
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings('ignore')
+    modelo, scaler = cargar_pkl()
+    bosque, _ = cargar_arreglos()
+    crudas, _ = entradas_verificacion(scaler, bosque, muestras=20000)
+
+    def sklearn_proba(X):
+        return modelo.predict_proba(scaler.transform(X))
+
+    resultados = {}
+    for tamano in (int(t) for t in args.lotes.split(',')):
+        repeticiones = max(5, min(args.repeticiones, args.repeticiones * 64 // tamano))
+        indices = np.random.default_rng(tamano).integers(0, len(crudas), size=(repeticiones, tamano))
+        lotes = [np.ascontiguousarray(crudas[fila]) for fila in indices]
+
+        # Calentamiento y verificación bit a bit sobre los mismos lotes
+        identicos = all(np.array_equal(sklearn_proba(lote), bosque.predict_proba_crudo(lote))
+                        for lote in lotes[:50])
+        resultados[f'lote_{tamano}'] = {
+            'sklearn': medir(sklearn_proba, lotes, tamano),
+            'motor_arreglos': medir(bosque.predict_proba_crudo, lotes, tamano),
+            'identicos': identicos,
+        }
+
+    print(json.dumps(resultados, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
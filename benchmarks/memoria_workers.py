@@ -0,0 +1,156 @@
+"""
+Memoria por worker con y sin precarga de la app antes del fork.
+
+Reproduce el modelo de procesos de gunicorn con os.fork (sin depender de
+gunicorn): en modo 'sin_preload' cada worker importa app.py y llama a crear_app()
+después del fork, como gunicorn sin preload_app; en modo 'preload' el maestro crea
+y precalienta la app, congela el recolector (gc.freeze, como gunicorn.conf.py) y
+recién entonces hace el fork. Cada worker atiende `--solicitudes` /predict y, con
+todos los workers vivos, se lee /proc/<pid>/smaps_rollup de cada uno:
+
+    rss_mb: memoria residente (cuenta las páginas compartidas en cada worker)
+    pss_mb: residente con las páginas compartidas repartidas entre quienes las usan
+    uss_mb: páginas privadas del worker (lo que se libera si el worker termina)
+
+Cada modo corre en un proceso nuevo contra una base temporal. Solo Linux.
+
+Uso:
+    python benchmarks/memoria_workers.py --workers 4 --solicitudes 50
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+from benchmarks.generador import generar_solicitudes  # noqa: E402
+
+CAMPOS_SMAPS = {'Rss': 'rss_mb', 'Pss': 'pss_mb', 'Private_Clean': 'uss_mb', 'Private_Dirty': 'uss_mb'}
+
+
+def memoria_proceso(pid):
+    """RSS, PSS y USS de `pid` en MB, según /proc/<pid>/smaps_rollup"""
+    memoria = {'rss_mb': 0.0, 'pss_mb': 0.0, 'uss_mb': 0.0}
+    with open(f'/proc/{pid}/smaps_rollup') as archivo:
+        for linea in archivo:
+            partes = linea.split()
+            campo = CAMPOS_SMAPS.get(partes[0].rstrip(':'))
+            if campo:
+                memoria[campo] += int(partes[1]) / 1024
+    return {campo: round(valor, 1) for campo, valor in memoria.items()}
+
+
+def _preparar_entorno(directorio):
+    os.environ['HISTORIAL_DB'] = os.path.join(directorio, 'historial.db')
+    os.environ['AUDITORIA_DERRAME'] = os.path.join(directorio, 'auditoria_pendiente')
+    os.environ['FIREBASE_CREDENCIALES'] = os.path.join(directorio, 'sin_credenciales.json')
+    os.environ.pop('FIRESTORE_LOCAL', None)
+    os.environ['METRICAS_MUESTREO'] = '0'
+    os.environ['IDEMPOTENCIA'] = '0'  # Cada worker repite las mismas solicitudes
+    warnings.filterwarnings('ignore')
+
+
+def _worker(solicitudes, listo, fin):
+    """Cuerpo del worker (tras el fork): atiende las solicitudes y espera al maestro"""
+    import app
+    cliente = app.app.test_client()
+    for solicitud in solicitudes:
+        respuesta = cliente.post('/predict', json=solicitud)
+        assert respuesta.status_code == 200, respuesta.get_data(as_text=True)
+    app.auditoria.vaciar(timeout=60)
+    os.write(listo, b'.')
+    os.read(fin, 1)  # Hasta que el maestro cierre el pipe
+
+
+def _correr_modo(modo, workers, n_solicitudes):
+    """Corre en un proceso nuevo: arranca los workers, mide y devuelve el resultado"""
+    directorio = tempfile.mkdtemp(prefix=f'memoria_{modo}_')
+    _preparar_entorno(directorio)
+    solicitudes = generar_solicitudes(n_solicitudes, semilla=11)
+
+    inicio = time.perf_counter()
+    if modo == 'preload':
+        os.environ['PRECALENTAR'] = 'sincrono'
+        import app
+        app.app  # crear_app() en el maestro, como preload_app
+        gc.freeze()
+    else:
+        import db_module
+        db_module.init_db()
+    maestro = memoria_proceso(os.getpid())
+
+    listo_r, listo_w = os.pipe()
+    fin_r, fin_w = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            codigo = 0
+            try:
+                os.close(listo_r)
+                os.close(fin_w)
+                _worker(solicitudes, listo_w, fin_r)
+            except BaseException:
+                codigo = 1
+            finally:
+                os._exit(codigo)
+        pids.append(pid)
+    os.close(listo_w)
+    os.close(fin_r)
+
+    listos = 0
+    while listos < workers:
+        leido = os.read(listo_r, workers)
+        if not leido:
+            raise RuntimeError('Un worker terminó antes de tiempo')
+        listos += len(leido)
+    segundos_hasta_listos = time.perf_counter() - inicio
+    por_worker = [memoria_proceso(pid) for pid in pids]
+
+    os.close(fin_w)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    def promedio(campo):
+        return round(sum(m[campo] for m in por_worker) / len(por_worker), 1)
+
+    return {
+        'maestro': maestro,
+        'workers': por_worker,
+        'promedio_worker': {campo: promedio(campo) for campo in ('rss_mb', 'pss_mb', 'uss_mb')},
+        'pss_total_mb': round(maestro['pss_mb'] + sum(m['pss_mb'] for m in por_worker), 1),
+        'segundos_hasta_listos': round(segundos_hasta_listos, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--solicitudes', type=int, default=50, help='Solicitudes /predict por worker')
+    parser.add_argument('--modos', default='sin_preload,preload')
+    parser.add_argument('--interno', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.interno:
+        print(json.dumps(_correr_modo(args.interno, args.workers, args.solicitudes)))
+        return 0
+
+    resultados = {}
+    for modo in args.modos.split(','):
+        salida = subprocess.run([sys.executable, os.path.abspath(__file__), '--interno', modo,
+                                 '--workers', str(args.workers), '--solicitudes', str(args.solicitudes)],
+                                check=True, capture_output=True, text=True).stdout
+        resultados[modo] = json.loads(salida.strip().splitlines()[-1])
+    print(json.dumps({'parametros': vars(args), 'resultados': resultados}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Latencia de /predict con modelos retadores en sombra contra sin retadores.
+
+Cada modo corre en un proceso propio (MODELOS_RETADORES se lee al importar
+decision_module) con varios hilos que envían /predict por el cliente de prueba de
+Flask. 'sin_retadores' es la referencia; 'con_retadores' evalúa los retadores de
+--retadores en el hilo de sombra; 'cola_chica' hace lo mismo con SOMBRA_COLA_MAX=2
+para ver cuánto trabajo se descarta cuando la sombra no da abasto. Por defecto los
+retadores son copias del modelo campeón (mismo costo por fila que un bosque
+reentrenado de igual tamaño).
+
+Uso:
+    python benchmarks/sombra.py --hilos 4 --solicitudes 200 --retadores a=models/random_forest
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+from benchmarks.carga_predict import percentiles  # noqa: E402
+from benchmarks.generador import generar_solicitudes  # noqa: E402
+
+MODOS = {
+    'sin_retadores': {},
+    'con_retadores': {},
+    'cola_chica': {'SOMBRA_COLA_MAX': '2'},
+}
+
+
+def _worker(argumentos):
+    modo, directorio, retadores, hilos, solicitudes, semilla = argumentos
+    os.environ.update(MODOS[modo])
+    os.environ['MODELOS_RETADORES'] = '' if modo == 'sin_retadores' else retadores
+    os.environ['HISTORIAL_DB'] = os.path.join(directorio, 'historial.db')
+    os.environ['AUDITORIA_DERRAME'] = os.path.join(directorio, 'auditoria_pendiente')
+    os.environ['PRECALENTAR'] = 'sincrono'
+    os.environ['IDEMPOTENCIA'] = '0'  # Se mide la evaluación, no la caché de respuestas
+    warnings.filterwarnings('ignore')
+    import app
+
+    lotes = [generar_solicitudes(solicitudes, semilla=semilla * 100 + i) for i in range(hilos)]
+    tiempos = []
+
+    def hilo(indice):
+        cliente = app.app.test_client()
+        for data in lotes[indice]:
+            inicio = time.perf_counter()
+            respuesta = cliente.post('/predict', json=data)
+            tiempos.append(time.perf_counter() - inicio)
+            assert respuesta.status_code == 200, respuesta.get_data(as_text=True)
+
+    inicio = time.perf_counter()
+    hilos_activos = [threading.Thread(target=hilo, args=(i,)) for i in range(hilos)]
+    for h in hilos_activos:
+        h.start()
+    for h in hilos_activos:
+        h.join()
+    segundos = time.perf_counter() - inicio
+
+    sombra = None
+    if app.evaluador_sombra is not None:
+        inicio_vaciado = time.perf_counter()
+        app.evaluador_sombra.vaciar(timeout=120)
+        sombra = dict(app.evaluador_sombra.estadisticas(),
+                      vaciado_ms=round((time.perf_counter() - inicio_vaciado) * 1000, 1))
+    app.auditoria.vaciar()
+    return tiempos, segundos, sombra
+
+
+def ejecutar_modo(modo, retadores, hilos, solicitudes, semilla):
+    directorio = tempfile.mkdtemp(prefix=f'sombra_{modo}_')
+    contexto = multiprocessing.get_context('spawn')
+    with contexto.Pool(1) as pool:
+        tiempos, segundos, sombra = pool.apply(_worker, ((modo, directorio, retadores, hilos, solicitudes,
+                                                          semilla),))
+    resultado = {
+        'solicitudes': len(tiempos),
+        'solicitudes_por_segundo': round(len(tiempos) / segundos, 1),
+        'predict': percentiles(tiempos),
+    }
+    if sombra is not None:
+        resultado['sombra'] = sombra
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--hilos', type=int, default=4)
+    parser.add_argument('--solicitudes', type=int, default=200, help='Solicitudes por hilo')
+    parser.add_argument('--retadores', default='retador_1=models/random_forest,retador_2=models/random_forest',
+                        help='MODELOS_RETADORES de los modos con retadores')
+    parser.add_argument('--modo', choices=list(MODOS) + ['todos'], default='todos')
+    parser.add_argument('--semilla', type=int, default=11)
+    args = parser.parse_args(argv)
+
+    modos = list(MODOS) if args.modo == 'todos' else [args.modo]
+    resultados = {'parametros': vars(args)}
+    for modo in modos:
+        resultados[modo] = ejecutar_modo(modo, args.retadores, args.hilos, args.solicitudes, args.semilla)
+    print(json.dumps(resultados, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
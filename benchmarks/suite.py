@@ -0,0 +1,278 @@
+"""
+Suite reproducible de benchmarks del servicio de scoring y chequeo de regresiones.
+
+`correr` mide, para cada tamaño de lote, el tiempo por fila de:
+    riesgo_difuso        calcular_riesgo_difuso (1) / calcular_riesgo_difuso_lote
+    score_cliente        calcular_score_cliente (1) / calcular_score_cliente_lote
+    features_bosque      codificador + motor.predict_proba_crudo
+    persistencia_sqlite  INSERT_SOLICITUD en una base temporal (execute / executemany)
+    predict_http         /predict (1) o /predict/batch con el cliente de prueba de Flask
+sobre solicitudes de benchmarks/generador.py, y guarda un JSON con los resultados
+y los datos de la máquina. No usa red ni Firestore.
+
+`comparar` falla (código 1) si alguna medida de un JSON nuevo es más lenta que la
+del JSON base por encima del umbral (p50 por fila nuevo / base).
+
+Uso:
+    python benchmarks/suite.py correr --salida base.json --tamanos 1,100,10000,100000
+    python benchmarks/suite.py correr --salida nuevo.json
+    python benchmarks/suite.py comparar base.json nuevo.json --umbral 1.25 --umbral-medida riesgo_difuso=1.5
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+from benchmarks.generador import generar_solicitudes  # noqa: E402
+
+MEDIDAS = ['riesgo_difuso', 'score_cliente', 'features_bosque', 'persistencia_sqlite', 'predict_http']
+TAMANOS = '1,100,10000,100000'
+
+
+# ============ MEDICIÓN ============
+
+def medir(funcion, filas, segundos, minimo=3, maximo=1000):
+    """
+    Llama a `funcion` hasta juntar `segundos` de mediciones (entre `minimo` y
+    `maximo` llamadas) después de una llamada de calentamiento.
+
+    Returns:
+        dict: p50/p90 por fila (µs), filas por segundo y repeticiones
+    """
+    funcion()
+    tiempos = []
+    total = 0.0
+    while len(tiempos) < maximo and (len(tiempos) < minimo or total < segundos):
+        inicio = time.perf_counter()
+        funcion()
+        tiempo = time.perf_counter() - inicio
+        tiempos.append(tiempo)
+        total += tiempo
+    tiempos = np.array(tiempos)
+    p50 = float(np.percentile(tiempos, 50))
+    return {
+        'p50_us_por_fila': round(p50 / filas * 1e6, 3),
+        'p90_us_por_fila': round(float(np.percentile(tiempos, 90)) / filas * 1e6, 3),
+        'filas_por_segundo': round(filas / p50, 1),
+        'repeticiones': len(tiempos),
+    }
+
+
+def info_maquina():
+    """Datos para saber si dos resultados son comparables"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RUTA_PROYECTO,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    import sklearn
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'plataforma': platform.platform(),
+        'procesador': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+
+def _preparar_entorno(directorio, tamano_maximo):
+    """Base, derrame y límites temporales; sin Firestore. Debe llamarse antes de importar app."""
+    os.environ['HISTORIAL_DB'] = os.path.join(directorio, 'historial.db')
+    os.environ['AUDITORIA_DERRAME'] = os.path.join(directorio, 'auditoria_pendiente')
+    os.environ['FIREBASE_CREDENCIALES'] = os.path.join(directorio, 'sin_credenciales.json')
+    os.environ.pop('FIRESTORE_LOCAL', None)
+    os.environ['MAX_SOLICITUDES_LOTE'] = str(max(tamano_maximo, 1))
+    os.environ.setdefault('METRICAS_MUESTREO', '0')
+    os.environ['PRECALENTAR'] = 'sincrono'
+    os.environ['IDEMPOTENCIA'] = '0'  # predict_http repite las mismas solicitudes
+
+
+def _casos(medida, solicitudes, modulos):
+    """Función sin argumentos que procesa `solicitudes` con la medida indicada"""
+    d, app = modulos['decision'], modulos['app']
+    n = len(solicitudes)
+
+    if medida == 'riesgo_difuso':
+        if n == 1:
+            macro = [float(solicitudes[0][campo]) for campo in d.CAMPOS_MACRO]
+            return lambda: d.calcular_riesgo_difuso(*macro)
+        columnas = [np.array([s[campo] for s in solicitudes], dtype=np.float64) for campo in d.CAMPOS_MACRO]
+        return lambda: d.calcular_riesgo_difuso_lote(*columnas)
+
+    if medida == 'score_cliente':
+        for s in solicitudes:
+            s['dti'] = d.calcular_dti(s['loan_amount'], s['income'], s['term'])
+            s['ltv'] = d.calcular_ltv(s['loan_amount'], s['property_value'])
+        if n == 1:
+            return lambda: d.calcular_score_cliente(solicitudes[0])
+        columnas = {campo: np.array([bool(s[campo]) for s in solicitudes]) for campo in d.CAMPOS_BOOLEANOS}
+        columnas['credit_worthiness'] = np.array([s['credit_worthiness'] for s in solicitudes], dtype=object)
+        columnas['dti'] = np.array([s['dti'] for s in solicitudes])
+        columnas['ltv'] = np.array([s['ltv'] for s in solicitudes])
+        return lambda: d.calcular_score_cliente_lote(columnas)
+
+    if medida == 'features_bosque':
+        codificador, motor = d.codificador, d.motor
+        if n == 1:
+            return lambda: motor.predict_proba_crudo(codificador.codificar(solicitudes[0]))
+        codigos = np.array([codificador.codigos(s) for s in solicitudes])
+        numericos = np.array([[conversion(s[campo]) for campo, conversion in
+                               zip(codificador.campos_numericos, codificador._conversiones)]
+                              for s in solicitudes], dtype=np.float64)
+        destino = np.zeros((n, codificador.n_features))
+        return lambda: motor.predict_proba_crudo(codificador.codificar_lote(codigos, numericos, destino))
+
+    if medida == 'persistencia_sqlite':
+        filas = [app._fila_solicitud(50.0, 5.0, 50.0, 20.0, 'APROBADO', 'Benchmark', s) for s in solicitudes]
+        if n == 1:
+            return lambda: modulos['db'].ejecutar_escritura(app.INSERT_SOLICITUD, filas[0])
+        return lambda: modulos['db'].ejecutar_escritura(app.INSERT_SOLICITUD, filas, muchos=True)
+
+    if medida == 'predict_http':
+        cliente = app.app.test_client()
+
+        def predict():
+            if n == 1:
+                respuesta = cliente.post('/predict', json=dict(solicitudes[0]))
+            else:
+                respuesta = cliente.post('/predict/batch', json={'solicitudes': solicitudes})
+            assert respuesta.status_code == 200, respuesta.get_data(as_text=True)[:200]
+            # La escritura diferida no cuenta, pero sí que no se acumule entre repeticiones
+            app.auditoria.vaciar(timeout=60)
+        return predict
+
+    raise ValueError(f'Medida desconocida: {medida}')
+
+
+def correr(tamanos, medidas, segundos, semilla):
+    """Corre la suite y devuelve el dict que se guarda como JSON"""
+    directorio = tempfile.mkdtemp(prefix='benchmark_suite_')
+    _preparar_entorno(directorio, max(tamanos))
+    warnings.filterwarnings('ignore')
+    import app
+    import db_module
+    import decision_module
+    db_module.init_db()
+    modulos = {'app': app, 'db': db_module, 'decision': decision_module}
+
+    resultados = {}
+    for medida in medidas:
+        resultados[medida] = {}
+        for tamano in tamanos:
+            solicitudes = generar_solicitudes(tamano, semilla=semilla + tamano)
+            resultado = medir(_casos(medida, solicitudes, modulos), tamano, segundos)
+            resultados[medida][str(tamano)] = resultado
+            print(f'{medida:<20} {tamano:>7} filas  p50 {resultado["p50_us_por_fila"]:>12.3f} µs/fila  '
+                  f'{resultado["filas_por_segundo"]:>12.1f} filas/s', file=sys.stderr)
+    app.auditoria.detener()
+    return {
+        'maquina': info_maquina(),
+        'parametros': {'tamanos': tamanos, 'medidas': medidas, 'segundos': segundos, 'semilla': semilla},
+        'resultados': resultados,
+    }
+
+
+# ============ REGRESIONES ============
+
+def comparar(base, nuevo, umbral=1.25, umbrales_medida=None):
+    """
+    Compara p50 por fila de cada (medida, tamaño) presente en ambos resultados.
+
+    Returns:
+        tuple: (filas de la comparación, lista de regresiones)
+    """
+    umbrales_medida = umbrales_medida or {}
+    filas, regresiones = [], []
+    for medida, por_tamano in nuevo['resultados'].items():
+        for tamano, resultado in por_tamano.items():
+            anterior = base['resultados'].get(medida, {}).get(tamano)
+            if anterior is None:
+                continue
+            razon = resultado['p50_us_por_fila'] / anterior['p50_us_por_fila']
+            limite = umbrales_medida.get(medida, umbral)
+            fila = {'medida': medida, 'tamano': int(tamano), 'base_us': anterior['p50_us_por_fila'],
+                    'nuevo_us': resultado['p50_us_por_fila'], 'razon': round(razon, 3),
+                    'umbral': limite, 'regresion': razon > limite}
+            filas.append(fila)
+            if fila['regresion']:
+                regresiones.append(fila)
+    return filas, regresiones
+
+
+def _umbrales_medida(valores):
+    umbrales = {}
+    for valor in valores or []:
+        medida, _, umbral = valor.partition('=')
+        if medida not in MEDIDAS or not umbral:
+            raise argparse.ArgumentTypeError(f'Umbral inválido: {valor} (medida=razón)')
+        umbrales[medida] = float(umbral)
+    return umbrales
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    p_correr = subparsers.add_parser('correr', help='Corre la suite y guarda los resultados en JSON')
+    p_correr.add_argument('--salida', required=True, help='Archivo JSON de resultados')
+    p_correr.add_argument('--tamanos', default=TAMANOS, help='Tamaños de lote separados por coma')
+    p_correr.add_argument('--medidas', default=','.join(MEDIDAS), help='Medidas separadas por coma')
+    p_correr.add_argument('--segundos', type=float, default=1.0, help='Tiempo medido por caso (mínimo 3 llamadas)')
+    p_correr.add_argument('--semilla', type=int, default=0)
+
+    p_comparar = subparsers.add_parser('comparar', help='Compara dos resultados y falla si hay regresiones')
+    p_comparar.add_argument('base')
+    p_comparar.add_argument('nuevo')
+    p_comparar.add_argument('--umbral', type=float, default=1.25, help='Razón nuevo/base máxima aceptada')
+    p_comparar.add_argument('--umbral-medida', action='append', help='medida=razón para una medida')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'correr':
+        medidas = args.medidas.split(',')
+        for medida in medidas:
+            if medida not in MEDIDAS:
+                parser.error(f'Medida desconocida: {medida} (opciones: {", ".join(MEDIDAS)})')
+        tamanos = [int(t) for t in args.tamanos.split(',')]
+        resultado = correr(tamanos, medidas, args.segundos, args.semilla)
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+        return 0
+
+    with open(args.base, encoding='utf-8') as archivo:
+        base = json.load(archivo)
+    with open(args.nuevo, encoding='utf-8') as archivo:
+        nuevo = json.load(archivo)
+    try:
+        umbrales = _umbrales_medida(args.umbral_medida)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    for campo in ('plataforma', 'procesador', 'cpus', 'python'):
+        if base['maquina'].get(campo) != nuevo['maquina'].get(campo):
+            print(f'Aviso: {campo} distinto ({base["maquina"].get(campo)} vs {nuevo["maquina"].get(campo)})',
+                  file=sys.stderr)
+
+    filas, regresiones = comparar(base, nuevo, args.umbral, umbrales)
+    for fila in filas:
+        marca = 'REGRESIÓN' if fila['regresion'] else 'ok'
+        print(f'{fila["medida"]:<20} {fila["tamano"]:>7}  {fila["base_us"]:>12.3f} -> {fila["nuevo_us"]:>12.3f} µs/fila'
+              f'  x{fila["razon"]:<7} (umbral {fila["umbral"]})  {marca}')
+    print(f'{len(regresiones)} regresiones en {len(filas)} casos')
+    return 1 if regresiones else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Contraofertas: el mayor monto que saldría APROBADO, por plazo, para una solicitud.
+
+buscar_contraoferta() recorre monto × plazo sin pasar por /predict: validación,
+categóricas y riesgo difuso se resuelven una sola vez, y en cada ronda se evalúa
+una rejilla de montos candidatos para todos los plazos como un lote (PASO 1 a 10
+por columnas, una sola llamada al Random Forest).
+
+El DTI, el LTV y los descuentos del score crecen con el monto, así que para cada
+plazo la búsqueda es una bisección con PUNTOS_POR_RONDA puntos por ronda: el
+intervalo entre el mayor monto aprobado y el menor rechazado se divide en
+PUNTOS_POR_RONDA + 1 partes por ronda hasta llegar al paso de montos. El Random
+Forest no garantiza monotonía; el monto devuelto siempre es uno que se evaluó y
+salió aprobado.
+"""
+import numpy as np
+
+from decision_module import (CAMPOS_BOOLEANOS, SolicitudInvalida, _preparar_solicitud, calcular_dti_lote,
+                             calcular_ltv_lote, calcular_riesgo_externo, codificador, combinar_score_final,
+                             motor, motor_reglas)
+from macro_module import CAMPOS_MACRO
+
+# Plazos (meses) que se prueban además del de la solicitud
+PLAZOS_CONTRAOFERTA = [120, 180, 240, 300, 360]
+
+# Montos candidatos: múltiplos de PASO_MONTO entre MONTO_MINIMO y el monto pedido
+PASO_MONTO = 100
+MONTO_MINIMO = 1000
+
+# Montos evaluados por plazo en cada ronda de la bisección
+PUNTOS_POR_RONDA = 15
+
+# Máximo de plazos por búsqueda
+MAX_PLAZOS = 24
+
+
+class EvaluadorCandidatos:
+    """
+    Evalúa una solicitud con otros montos y plazos. Lo que no depende de ellos
+    (validación, categóricas, variables macro y riesgo difuso) se resuelve al
+    construirlo.
+
+    Raises:
+        SolicitudInvalida: Con los mismos mensajes que evaluar_solicitud
+    """
+
+    def __init__(self, data):
+        fila, snapshot, error = _preparar_solicitud(data)
+        if error:
+            raise SolicitudInvalida(error)
+        self.loan_amount, self.income, self.term, property_value = fila[:4]
+        self.term = int(self.term)
+        # Sin property_value el valor de la propiedad sigue al monto, como en /predict
+        self.property_value = property_value if 'property_value' in data else None
+        self.macro = dict(zip(CAMPOS_MACRO, fila[4:]))
+        self.macro_version = snapshot.version if snapshot is not None else None
+        try:
+            self.codigos = codificador.codigos(data)
+        except KeyError as e:
+            raise SolicitudInvalida(f'Valor inválido en campo categórico: {str(e)}')
+        self.booleanos = {campo: bool(data.get(campo, False)) for campo in CAMPOS_BOOLEANOS}
+        self.credit_worthiness = data.get('credit_worthiness', 'Fair')
+
+        # ============ PASO 3: RIESGO DIFUSO (UNA VEZ POR BÚSQUEDA) ============
+        if snapshot is not None:
+            self.riesgo_externo = snapshot.riesgo_externo
+        else:
+            self.riesgo_externo = calcular_riesgo_externo(*fila[4:])
+
+        self.reglas = motor_reglas.actual()
+        self._decisiones = np.array([self.reglas.regla_decision(i).decision
+                                     for i in range(-1, len(self.reglas.reglas_decision))], dtype=object)
+        self._score_bandera = np.array([b.score_final for b in self.reglas.banderas])
+        self._prob_bandera = np.array([b.probabilidad for b in self.reglas.banderas])
+        self.evaluaciones = 0
+        self.lotes = 0
+
+    def evaluar(self, loan_amount, term):
+        """
+        Decisión con cada par (loan_amount[i], term[i]), arreglos float64 de igual largo.
+
+        Returns:
+            dict: Arreglos 'decision', 'dti', 'ltv', 'score_cliente', 'probabilidad'
+            y 'score_final' (mismos valores que evaluar_lote)
+        """
+        reglas = self.reglas
+        n = len(loan_amount)
+        self.evaluaciones += n
+        self.lotes += 1
+        property_value = loan_amount * 1.2 if self.property_value is None else np.full(n, self.property_value)
+        columnas = {campo: np.full(n, valor) for campo, valor in self.booleanos.items()}
+        columnas.update({campo: np.full(n, valor) for campo, valor in self.macro.items()})
+        columnas['credit_worthiness'] = np.full(n, self.credit_worthiness, dtype=object)
+        columnas.update(loan_amount=loan_amount, income=np.full(n, self.income), term=term,
+                        property_value=property_value)
+
+        # ============ PASO 1 y 2: MÉTRICAS FINANCIERAS Y SCORE DEL CLIENTE ============
+        columnas['dti'] = calcular_dti_lote(loan_amount, columnas['income'], term)
+        columnas['ltv'] = calcular_ltv_lote(loan_amount, property_value)
+        columnas['score_cliente'] = reglas.score_cliente_lote(columnas)
+        columnas['riesgo_externo'] = np.full(n, self.riesgo_externo)
+
+        # ============ PASO 4 y 5: BANDERAS ROJAS ============
+        bandera = reglas.banderas_rojas_lote(columnas, n)
+        con_bandera = bandera >= 0
+
+        # ============ PASO 6 y 7: FEATURES Y RANDOM FOREST (una sola llamada) ============
+        numericos = np.column_stack([columnas[campo] for campo in codificador.campos_numericos])
+        codigos = np.broadcast_to(self.codigos, (n, len(self.codigos)))
+        prob_base = motor.predict_proba_crudo(codificador.codificar_lote(codigos, numericos))[:, 1]
+
+        # ============ PASO 8 y 9: PENALIZACIONES Y SCORE FINAL ============
+        prob = np.minimum(100.0, reglas.penalizar_lote(prob_base, columnas) * 100)
+        score_final = combinar_score_final(columnas['score_cliente'], columnas['riesgo_externo'], prob)
+
+        # ============ PASO 10: DECISIÓN FINAL ============
+        columnas.update(score_final=score_final, probabilidad=prob)
+        decision = self._decisiones[reglas.decision_final_lote(columnas, n) + 1]
+        decision[con_bandera] = 'RECHAZADO'
+        if con_bandera.any():
+            score_final = np.where(con_bandera, self._score_bandera[bandera], score_final)
+            prob = np.where(con_bandera, self._prob_bandera[bandera], prob)
+        return {'decision': decision, 'dti': columnas['dti'], 'ltv': columnas['ltv'],
+                'score_cliente': columnas['score_cliente'], 'probabilidad': prob, 'score_final': score_final}
+
+
+def _oferta(evaluacion, i, loan_amount, term):
+    """Monto, plazo y métricas de la fila i de una evaluación"""
+    return {
+        'loan_amount': float(loan_amount),
+        'term': int(term),
+        'decision': str(evaluacion['decision'][i]),
+        'dti': round(float(evaluacion['dti'][i]), 2),
+        'ltv': round(float(evaluacion['ltv'][i]), 2),
+        'score_cliente': round(float(evaluacion['score_cliente'][i]), 2),
+        'probabilidad': round(float(evaluacion['probabilidad'][i]), 2),
+        'score_final': round(float(evaluacion['score_final'][i]), 2),
+    }
+
+
+def buscar_contraoferta(data, plazos=None, paso=PASO_MONTO, monto_minimo=MONTO_MINIMO,
+                        puntos=PUNTOS_POR_RONDA):
+    """
+    Mayor monto aprobable por plazo, entre monto_minimo y el monto pedido.
+
+    Args:
+        data: Solicitud (dict), como en /predict; no se modifica
+        plazos: Plazos en meses a probar (default PLAZOS_CONTRAOFERTA); siempre se
+            agrega el de la solicitud
+        paso: Los montos candidatos son múltiplos de `paso`
+        monto_minimo: Monto más bajo que se ofrece
+        puntos: Montos por plazo en cada ronda
+
+    Returns:
+        dict: 'original' (la solicitud tal como vino), 'contraoferta' (mayor monto
+        aprobable; a igual monto, el plazo pedido o el más corto; None si la
+        solicitud ya sale aprobada o si no hay ninguno), 'por_plazo' (mejor oferta
+        o None por plazo), 'riesgo_difuso', 'macro_version' y la cantidad de
+        'evaluaciones' y 'lotes'
+
+    Raises:
+        SolicitudInvalida: Solicitud o parámetros inválidos
+    """
+    evaluador = EvaluadorCandidatos(data)
+    if paso <= 0 or monto_minimo < 0 or puntos < 1:
+        raise SolicitudInvalida('paso y puntos deben ser positivos y monto_minimo no negativo')
+    plazos = sorted({int(p) for p in (PLAZOS_CONTRAOFERTA if plazos is None else plazos)} | {evaluador.term})
+    if plazos[0] <= 0 or len(plazos) > MAX_PLAZOS:
+        raise SolicitudInvalida(f'Los plazos deben ser positivos (máximo {MAX_PLAZOS})')
+    plazo = np.array(plazos, dtype=np.float64)
+
+    # Montos en unidades de `paso`. Invariante por plazo: `bajo` salió aprobado (o es
+    # el centinela inicial, uno menos que el mínimo) y `alto` rechazado (o el
+    # centinela, uno más que el máximo)
+    minimo = int(np.ceil(monto_minimo / paso))
+    maximo = int(np.floor(evaluador.loan_amount / paso))
+    bajo = np.full(len(plazos), minimo - 1, dtype=np.int64)
+    alto = np.full(len(plazos), maximo + 1, dtype=np.int64)
+    mejor = [None] * len(plazos)
+
+    # La solicitud original va en el primer lote
+    extra_monto = np.array([evaluador.loan_amount])
+    extra_plazo = np.array([float(evaluador.term)])
+    original = None
+    fracciones = np.arange(1, puntos + 1) / (puntos + 1)
+
+    while True:
+        activos = np.flatnonzero(alto - bajo > 1)
+        if not len(activos) and original is not None:
+            break
+        # Hasta `puntos` montos distintos dentro de (bajo, alto) por plazo activo
+        ancho = (alto - bajo)[activos, None]
+        candidatos = np.minimum(bajo[activos, None] + 1 + np.floor((ancho - 1) * fracciones).astype(np.int64),
+                                alto[activos, None] - 1)
+        monto = np.concatenate([extra_monto, (candidatos * paso).ravel().astype(np.float64)])
+        term = np.concatenate([extra_plazo, np.repeat(plazo[activos], candidatos.shape[1])])
+        evaluacion = evaluador.evaluar(monto, term)
+        aprobado = evaluacion['decision'] == 'APROBADO'
+
+        if original is None:
+            original = _oferta(evaluacion, 0, evaluador.loan_amount, evaluador.term)
+        desplazamiento = len(extra_monto)
+        extra_monto = extra_monto[:0]
+        extra_plazo = extra_plazo[:0]
+
+        # Mayor candidato aprobado y menor rechazado por encima de él, por plazo
+        aprobado = aprobado[desplazamiento:].reshape(candidatos.shape)
+        for fila, j in enumerate(activos.tolist()):
+            aprobados = np.flatnonzero(aprobado[fila])
+            if len(aprobados):
+                k = aprobados[-1]
+                bajo[j] = candidatos[fila, k]
+                mejor[j] = _oferta(evaluacion, desplazamiento + fila * candidatos.shape[1] + k,
+                                   candidatos[fila, k] * paso, plazos[j])
+            rechazados = candidatos[fila][~aprobado[fila] & (candidatos[fila] > bajo[j])]
+            alto[j] = min(alto[j], rechazados.min()) if len(rechazados) else alto[j]
+
+    ofertas = [oferta for oferta in mejor if oferta is not None]
+    contraoferta = None
+    if original['decision'] != 'APROBADO' and ofertas:
+        contraoferta = max(ofertas, key=lambda o: (o['loan_amount'], o['term'] == evaluador.term, -o['term']))
+    return {
+        'original': original,
+        'contraoferta': contraoferta,
+        'por_plazo': [{'term': p, 'oferta': oferta} for p, oferta in zip(plazos, mejor)],
+        'riesgo_difuso': round(float(evaluador.riesgo_externo), 2),
+        'macro_version': evaluador.macro_version,
+        'evaluaciones': evaluador.evaluaciones,
+        'lotes': evaluador.lotes,
+    }
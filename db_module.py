@@ -0,0 +1,403 @@
+"""
+Acceso a historial.db compartido por la app y las herramientas.
+
+Cada hilo mantiene una conexión abierta (se recrea tras un fork), con la base en
+modo WAL para que lecturas y escrituras no se bloqueen entre workers. Como la
+conexión persiste, el caché de sentencias de sqlite3 reutiliza las sentencias
+preparadas (INSERT_SOLICITUD, consultas del historial) entre solicitudes.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+RUTA_BASE = os.path.dirname(os.path.abspath(__file__))
+
+# Ruta de la base: HISTORIAL_DB o historial.db junto a la app
+RUTA_DB = os.environ.get('HISTORIAL_DB', os.path.join(RUTA_BASE, 'historial.db'))
+
+# Espera máxima de SQLite ante un bloqueo antes de devolver SQLITE_BUSY (ms)
+BUSY_TIMEOUT_MS = int(os.environ.get('HISTORIAL_DB_BUSY_TIMEOUT_MS', 5000))
+
+# Reintentos de escritura cuando el bloqueo dura más que BUSY_TIMEOUT_MS
+REINTENTOS = 4
+ESPERA_INICIAL = 0.05  # segundos, se duplica en cada reintento
+
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',  # En WAL: durable ante caídas del proceso, fsync solo en checkpoints
+    'PRAGMA cache_size=-16000',  # ~16 MB de caché de páginas por conexión
+    'PRAGMA temp_store=MEMORY',
+    f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}',
+]
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def conectar(ruta=None):
+    """Abre una conexión nueva con los PRAGMAs de la app"""
+    conn = sqlite3.connect(ruta or RUTA_DB, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=256)
+    conn.row_factory = sqlite3.Row  # Acceso por nombre de columna
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def obtener_conexion():
+    """Conexión persistente del hilo actual (una nueva si el proceso hizo fork)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = conectar()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def cerrar_conexion():
+    """Cierra la conexión del hilo actual, si existe"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
+def _es_bloqueo(error):
+    mensaje = str(error).lower()
+    return 'locked' in mensaje or 'busy' in mensaje
+
+
+def con_reintentos(funcion, *args, **kwargs):
+    """
+    Ejecuta `funcion` reintentando con espera exponencial si la base sigue bloqueada
+    después de BUSY_TIMEOUT_MS. Otros errores se propagan de inmediato.
+    """
+    espera = ESPERA_INICIAL
+    for intento in range(REINTENTOS + 1):
+        try:
+            return funcion(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not _es_bloqueo(e) or intento == REINTENTOS:
+                raise
+            logger.warning('historial.db bloqueada (intento %d/%d): %s', intento + 1, REINTENTOS, e)
+            time.sleep(espera)
+            espera *= 2
+
+
+def ejecutar_escritura(sql, parametros=(), muchos=False):
+    """
+    Ejecuta una escritura (o executemany si muchos=True) en una transacción, con reintentos.
+
+    Returns:
+        int: Filas afectadas
+    """
+    def escribir():
+        conn = obtener_conexion()
+        with conn:
+            if muchos:
+                cursor = conn.executemany(sql, parametros)
+            else:
+                cursor = conn.execute(sql, parametros)
+        return cursor.rowcount
+
+    return con_reintentos(escribir)
+
+
+def consultar(sql, parametros=()):
+    """Ejecuta una consulta de lectura y devuelve todas las filas"""
+    return con_reintentos(lambda: obtener_conexion().execute(sql, parametros).fetchall())
+
+
+# ============ RESUMEN INCREMENTAL ============
+
+# Conteos por decisión y columnas promediadas en /estadisticas
+DECISIONES_RESUMEN = {'aprobadas': 'APROBADO', 'rechazadas': 'RECHAZADO', 'revision': 'REVISIÓN MANUAL'}
+CAMPOS_PROMEDIO = ['score_cliente', 'riesgo_difuso', 'probabilidad', 'dti', 'ltv']
+
+# Columnas acumuladas: total, una por decisión y suma/cantidad de no nulos por campo
+# (AVG de SQL ignora los NULL, así que el promedio es suma_x / n_x)
+COLUMNAS_RESUMEN = (['total'] + list(DECISIONES_RESUMEN)
+                    + [f'{prefijo}_{campo}' for campo in CAMPOS_PROMEDIO for prefijo in ('suma', 'n')])
+
+_DIA = "COALESCE(substr({fila}.fecha, 1, 10), '')"
+
+
+def _definicion_columnas():
+    return ',\n        '.join(f'{c} {"REAL" if c.startswith("suma_") else "INTEGER"} NOT NULL DEFAULT 0'
+                               for c in COLUMNAS_RESUMEN)
+
+
+def _incrementos(fila, signo):
+    """Asignaciones SET que suman (o restan) la fila NEW/OLD al resumen"""
+    valores = {'total': '1'}
+    for columna, decision in DECISIONES_RESUMEN.items():
+        valores[columna] = f"({fila}.decision IS '{decision}')"
+    for campo in CAMPOS_PROMEDIO:
+        valores[f'suma_{campo}'] = f'COALESCE({fila}.{campo}, 0)'
+        valores[f'n_{campo}'] = f'({fila}.{campo} IS NOT NULL)'
+    return ', '.join(f'{c} = {c} {signo} {valores[c]}' for c in COLUMNAS_RESUMEN)
+
+
+def _esquema_resumen():
+    """
+    Tablas resumen_estadisticas (una fila, totales globales) y resumen_diario (una
+    fila por día), mantenidas por triggers en cada INSERT/DELETE de solicitudes.
+    """
+    columnas = _definicion_columnas()
+    return [
+        f'''CREATE TABLE IF NOT EXISTS resumen_estadisticas (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        {columnas}
+    )''',
+        f'''CREATE TABLE IF NOT EXISTS resumen_diario (
+        dia TEXT PRIMARY KEY,
+        {columnas}
+    )''',
+        f'''CREATE TRIGGER IF NOT EXISTS resumen_al_insertar AFTER INSERT ON solicitudes
+    BEGIN
+        INSERT OR IGNORE INTO resumen_diario (dia) VALUES ({_DIA.format(fila='NEW')});
+        UPDATE resumen_diario SET {_incrementos('NEW', '+')} WHERE dia = {_DIA.format(fila='NEW')};
+        UPDATE resumen_estadisticas SET {_incrementos('NEW', '+')} WHERE id = 1;
+    END''',
+        f'''CREATE TRIGGER IF NOT EXISTS resumen_al_borrar AFTER DELETE ON solicitudes
+    BEGIN
+        UPDATE resumen_diario SET {_incrementos('OLD', '-')} WHERE dia = {_DIA.format(fila='OLD')};
+        UPDATE resumen_estadisticas SET {_incrementos('OLD', '-')} WHERE id = 1;
+    END''',
+    ]
+
+
+def reconstruir_resumen(conn):
+    """
+    Recalcula ambos resúmenes desde solicitudes en una sola pasada agrupada por día.
+    Debe llamarse dentro de una transacción para no perder inserciones concurrentes.
+    """
+    agregados = ['COUNT(*)']
+    agregados += [f"COALESCE(SUM(decision IS '{decision}'), 0)" for decision in DECISIONES_RESUMEN.values()]
+    for campo in CAMPOS_PROMEDIO:
+        agregados += [f'COALESCE(SUM({campo}), 0)', f'COUNT({campo})']
+    columnas = ', '.join(COLUMNAS_RESUMEN)
+
+    conn.execute('DELETE FROM resumen_diario')
+    conn.execute('DELETE FROM resumen_estadisticas')
+    conn.execute(f"INSERT INTO resumen_diario (dia, {columnas}) "
+                 f"SELECT {_DIA.format(fila='solicitudes')}, {', '.join(agregados)} "
+                 f"FROM solicitudes GROUP BY 1")
+    sumas = ', '.join(f'COALESCE(SUM({c}), 0)' for c in COLUMNAS_RESUMEN)
+    conn.execute(f'INSERT INTO resumen_estadisticas (id, {columnas}) SELECT 1, {sumas} FROM resumen_diario')
+
+
+def _formatear_resumen(fila):
+    return formatear_acumulados(dict(zip(COLUMNAS_RESUMEN, fila)) if fila else dict.fromkeys(COLUMNAS_RESUMEN, 0))
+
+
+def formatear_acumulados(valores):
+    """Resumen (como leer_resumen) a partir de {columna de COLUMNAS_RESUMEN: valor}"""
+    resumen = {c: int(valores[c] or 0) for c in ['total'] + list(DECISIONES_RESUMEN)}
+    for campo in CAMPOS_PROMEDIO:
+        n = valores[f'n_{campo}'] or 0
+        resumen[f'{campo}_promedio'] = valores[f'suma_{campo}'] / n if n else 0
+    return resumen
+
+
+def leer_resumen(desde=None):
+    """
+    Totales y promedios de solicitudes sin recorrer la tabla.
+
+    Args:
+        desde: Día 'YYYY-MM-DD' inicial (inclusive). None = todo el historial,
+            leído de la fila única de resumen_estadisticas; con fecha se suman
+            las filas de resumen_diario desde ese día.
+
+    Returns:
+        dict: total, aprobadas, rechazadas, revision y <campo>_promedio
+    """
+    columnas = ', '.join(COLUMNAS_RESUMEN)
+    if desde is None:
+        filas = consultar(f'SELECT {columnas} FROM resumen_estadisticas WHERE id = 1')
+    else:
+        sumas = ', '.join(f'COALESCE(SUM({c}), 0)' for c in COLUMNAS_RESUMEN)
+        filas = consultar(f'SELECT {sumas} FROM resumen_diario WHERE dia >= ?', (desde,))
+    return _formatear_resumen(filas[0] if filas else None)
+
+
+def leer_acumulados():
+    """Columnas de resumen_estadisticas sin formatear, para seguir sumando en memoria"""
+    filas = consultar(f"SELECT {', '.join(COLUMNAS_RESUMEN)} FROM resumen_estadisticas WHERE id = 1")
+    valores = dict(zip(COLUMNAS_RESUMEN, filas[0])) if filas else dict.fromkeys(COLUMNAS_RESUMEN, 0)
+    return {columna: valor or 0 for columna, valor in valores.items()}
+
+
+# ============ HISTORIAL ============
+
+# Columnas devueltas por /historial
+COLUMNAS_HISTORIAL = ['id', 'fecha', 'nombre', 'monto', 'credit_worthiness', 'dti', 'ltv', 'score_cliente',
+                      'riesgo_difuso', 'probabilidad', 'score_final', 'decision', 'macro_version']
+
+
+def buscar_solicitudes(limite=50, antes=None, decision=None, credit_worthiness=None,
+                       desde=None, hasta=None, score_min=None, score_max=None):
+    """
+    Página del historial ordenada por (fecha, id) descendente, con paginación por
+    clave: `antes` es la tupla (fecha, id) de la última fila de la página anterior,
+    así que cada página cuesta lo mismo sin importar qué tan atrás esté.
+
+    Los filtros de igualdad usan idx_solicitudes_decision / idx_solicitudes_worthiness
+    (que ya vienen ordenados por fecha, id) y el rango de fechas idx_solicitudes_fecha.
+    El rango de score se aplica sobre score_final.
+
+    Returns:
+        list: Filas sqlite3.Row con COLUMNAS_HISTORIAL
+    """
+    condiciones, parametros = [], []
+    if decision is not None:
+        condiciones.append('decision = ?')
+        parametros.append(decision)
+    if credit_worthiness is not None:
+        condiciones.append('credit_worthiness = ?')
+        parametros.append(credit_worthiness)
+    if desde is not None:
+        condiciones.append('fecha >= ?')
+        parametros.append(desde)
+    if hasta is not None:
+        condiciones.append('fecha <= ?')
+        parametros.append(hasta)
+    if score_min is not None:
+        condiciones.append('score_final >= ?')
+        parametros.append(score_min)
+    if score_max is not None:
+        condiciones.append('score_final <= ?')
+        parametros.append(score_max)
+    if antes is not None:
+        condiciones.append('(fecha, id) < (?, ?)')
+        parametros.extend(antes)
+
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    sql = (f"SELECT {', '.join(COLUMNAS_HISTORIAL)} FROM solicitudes {where} "
+           f"ORDER BY fecha DESC, id DESC LIMIT ?")
+    return consultar(sql, (*parametros, limite))
+
+
+# ============ MIGRACIONES ============
+
+def _migracion_solicitudes(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS solicitudes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fecha TIMESTAMP,
+        nombre TEXT,
+        genero TEXT,
+        edad TEXT,
+        region TEXT,
+        income REAL,
+        monto REAL,
+        plazo INTEGER,
+        credit_worthiness TEXT,
+        property_value REAL,
+        dti REAL,
+        ltv REAL,
+        score_cliente REAL,
+        riesgo_difuso REAL,
+        probabilidad REAL,
+        score_final REAL,
+        decision TEXT,
+        motivo TEXT
+    )''')
+
+
+def _migracion_resumen(conn):
+    for sentencia in _esquema_resumen():
+        conn.execute(sentencia)
+    if conn.execute('SELECT 1 FROM resumen_estadisticas WHERE id = 1').fetchone() is None:
+        reconstruir_resumen(conn)
+
+
+def _migracion_indices_historial(conn):
+    # El id al final de cada índice desempata filas con la misma fecha y permite
+    # que la condición de página (fecha, id) < (?, ?) y el ORDER BY usen el índice
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_solicitudes_fecha ON solicitudes (fecha, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_solicitudes_decision ON solicitudes (decision, fecha, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_solicitudes_worthiness '
+                 'ON solicitudes (credit_worthiness, fecha, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_solicitudes_score ON solicitudes (score_final)')
+    conn.execute('ANALYZE solicitudes')
+
+
+def _migracion_snapshots_macro(conn):
+    # Una fila por snapshot macroeconómico; version crece con cada snapshot nuevo
+    # y el vigente es el de mayor versión (ver macro_module)
+    conn.execute('''CREATE TABLE IF NOT EXISTS snapshots_macro (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        fecha TIMESTAMP NOT NULL,
+        inflacion REAL NOT NULL,
+        combustible REAL NOT NULL,
+        protestas REAL NOT NULL,
+        desempleo REAL NOT NULL,
+        covid REAL NOT NULL,
+        clima REAL NOT NULL,
+        riesgo_externo REAL NOT NULL
+    )''')
+    columnas = {fila[1] for fila in conn.execute('PRAGMA table_info(solicitudes)')}
+    if 'macro_version' not in columnas:
+        conn.execute('ALTER TABLE solicitudes ADD COLUMN macro_version INTEGER')
+
+
+def _migracion_evaluaciones_sombra(conn):
+    # Una fila por solicitud y modelo retador, con la decisión del campeón al lado
+    # (ver sombra_module)
+    conn.execute('''CREATE TABLE IF NOT EXISTS evaluaciones_sombra (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fecha TIMESTAMP,
+        modelo TEXT NOT NULL,
+        prob_campeon REAL,
+        decision_campeon TEXT,
+        score_final_campeon REAL,
+        prob_retador REAL,
+        decision_retador TEXT,
+        score_final_retador REAL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sombra_modelo ON evaluaciones_sombra (modelo, fecha)')
+
+
+# Migraciones en orden; la versión aplicada se guarda en PRAGMA user_version.
+# Son idempotentes (IF NOT EXISTS) porque las bases anteriores al versionado
+# tienen user_version 0 aunque ya tengan la tabla solicitudes.
+MIGRACIONES = [
+    (1, 'tabla solicitudes', _migracion_solicitudes),
+    (2, 'resumen incremental para /estadisticas', _migracion_resumen),
+    (3, 'índices del historial', _migracion_indices_historial),
+    (4, 'snapshots macroeconómicos', _migracion_snapshots_macro),
+    (5, 'evaluaciones de modelos retadores', _migracion_evaluaciones_sombra),
+]
+
+
+def version_esquema(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+# Crear o actualizar la base de datos SQLite
+def init_db():
+    """
+    Aplica las migraciones pendientes. Cada una corre en su propia transacción
+    exclusiva junto con el cambio de user_version, así que varios workers pueden
+    arrancar a la vez: el primero migra y los demás ven la versión ya actualizada.
+    """
+    conn = conectar()
+    conn.isolation_level = None
+    try:
+        for version, descripcion, migracion in MIGRACIONES:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if version_esquema(conn) >= version:
+                    conn.execute('ROLLBACK')
+                    continue
+                migracion(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.execute('COMMIT')
+                logger.info('historial.db migrada a la versión %d (%s)', version, descripcion)
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    finally:
+        conn.close()
@@ -0,0 +1,578 @@
+"""
+Lógica de decisión crediticia, independiente de Flask.
+
+La usan la vista /predict, /predict/batch y la evaluación de cartera por línea
+de comandos (evaluar_cartera.py).
+"""
+import atexit
+import os
+import time
+
+import numpy as np
+
+from fuzzy_module import (calcular_riesgo_difuso, calcular_riesgo_difuso_lote, ExplicadorRiesgo, TablaRiesgoDifuso,
+                          motor_difuso)
+from features_module import CodificadorFeatures
+from macro_module import CAMPOS_MACRO, RegistroMacro
+from metrics_module import CRONOMETRO_NULO
+from model_module import CargaPerezosa, cargar_modelo, crear_motor
+from reglas_module import MotorReglas
+from sombra_module import EvaluadorSombra
+
+
+class SolicitudInvalida(ValueError):
+    """Solicitud con datos faltantes o inválidos (respuesta 400)"""
+
+
+# Rutas relativas al proyecto, para poder usar el módulo desde cualquier directorio
+RUTA_BASE = os.path.dirname(os.path.abspath(__file__))
+
+# Cargar modelo y scaler: los arreglos de models/random_forest si están al día con
+# los .pkl (ver model_module), si no los .pkl. MODELO_PEREZOSO=1 difiere la carga
+# hasta la primera predicción.
+# `motor.predict_proba_crudo` aplica scaler + Random Forest en un solo paso.
+if os.environ.get('MODELO_PEREZOSO') == '1':
+    _carga_modelo = CargaPerezosa(cargar_modelo)
+    modelo = CargaPerezosa(lambda: _carga_modelo.cargar()[0])
+    scaler = CargaPerezosa(lambda: _carga_modelo.cargar()[1])
+    motor = CargaPerezosa(lambda: crear_motor(*_carga_modelo.cargar()))
+else:
+    modelo, scaler = cargar_modelo()
+    motor = crear_motor(modelo, scaler)
+
+# Tabla de riesgo difuso precalculada (opcional): RIESGO_TABLA=ruta del .npz
+RUTA_TABLA_RIESGO = os.environ.get('RIESGO_TABLA')
+tabla_riesgo = None
+if RUTA_TABLA_RIESGO:
+    if os.path.exists(RUTA_TABLA_RIESGO):
+        tabla_riesgo = TablaRiesgoDifuso.cargar(RUTA_TABLA_RIESGO)
+    else:
+        tabla_riesgo = TablaRiesgoDifuso()
+    atexit.register(tabla_riesgo.guardar, RUTA_TABLA_RIESGO)
+
+# Mapeos para variables categóricas
+mappings = {
+    'Gender': {'Male': 1, 'Female': 0},
+    'Region': {'North': 0, 'South': 1, 'Central': 2, 'North-East': 3},
+    'credit_type': {'CIB': 0, 'EXP': 1, 'EQUI': 2},
+    'age': {'<25': 6, '25-34': 0, '35-44': 1, '45-54': 2, '55-64': 3, '65-74': 4, '>74': 5},
+    'credit_worthiness': {'Excellent': 4, 'Good': 3, 'Fair': 2, 'Poor': 1},
+    'loan_purpose': {'Personal': 0, 'Hipoteca': 1, 'Auto': 2, 'Comercial': 3, 'Educacion': 4}
+}
+
+# Esquema de las 32 features del Random Forest (nombres y posiciones)
+codificador = CodificadorFeatures(mappings)
+
+# Campos obligatorios de una solicitud
+CAMPOS_REQUERIDOS = ['loan_amount', 'income', 'term', 'inflacion', 'combustible', 
+                     'protestas', 'desempleo', 'covid', 'clima', 'credit_worthiness', 
+                     'gender', 'age', 'region', 'credit_type']
+
+# Reglas de decisión (umbrales, descuentos, penalizaciones y motivos); se recargan
+# solas cuando cambia reglas_decision.json
+motor_reglas = MotorReglas()
+
+# Campos obligatorios cuando las variables macro vienen de un snapshot
+CAMPOS_SIN_MACRO = [campo for campo in CAMPOS_REQUERIDOS if campo not in CAMPOS_MACRO]
+
+def calcular_riesgo_macro(inflacion, combustible, protestas, desempleo, covid, clima):
+    """Riesgo difuso del PASO 3 (con la tabla precalculada si hay una); los errores se propagan"""
+    calcular_riesgo = tabla_riesgo.calcular if tabla_riesgo else calcular_riesgo_difuso
+    return calcular_riesgo(inflacion, combustible, protestas, desempleo, covid, clima)
+
+def calcular_riesgo_externo(inflacion, combustible, protestas, desempleo, covid, clima):
+    """calcular_riesgo_macro con 5.0 si falla"""
+    try:
+        return calcular_riesgo_macro(inflacion, combustible, protestas, desempleo, covid, clima)
+    except Exception as e:
+        print(f"Error en cálculo difuso: {e}")
+        return 5.0  # Valor por defecto en caso de error
+
+# Riesgo difuso con reglas activadas y ajustes aplicados (/predict?explicar=1),
+# memorizado por entrada; usa la tabla precalculada igual que calcular_riesgo_externo
+explicador_riesgo = ExplicadorRiesgo(tabla_riesgo.riesgo_base if tabla_riesgo else None)
+
+def calcular_riesgo_externo_explicado(inflacion, combustible, protestas, desempleo, covid, clima):
+    """calcular_riesgo_externo que devuelve (riesgo, explicación); ver ExplicadorRiesgo"""
+    try:
+        return explicador_riesgo.explicar(inflacion, combustible, protestas, desempleo, covid, clima)
+    except Exception as e:
+        print(f"Error en cálculo difuso: {e}")
+        return 5.0, {'riesgo': 5.0, 'salida_difusa': None, 'reglas': [], 'ajustes': [],
+                     'determinante': 'valor_por_defecto'}
+
+# Snapshots macroeconómicos: el riesgo externo y las banderas macro se calculan una
+# vez por snapshot (ver macro_module). Sin el 5.0 por defecto: un snapshot queda
+# vigente para todas las solicitudes, así que si el cálculo falla no se crea
+registro_macro = RegistroMacro(calcular_riesgo_macro)
+
+def resolver_snapshot(data):
+    """
+    Snapshot macro que usa la solicitud: el de `macro_version` si viene, o el
+    vigente si la solicitud no trae ninguna variable macro. None = usar los valores
+    macro de la solicitud.
+
+    Raises:
+        SolicitudInvalida: Si macro_version no es un entero o no existe
+    """
+    version = data.get('macro_version')
+    if version is not None and version != '':
+        try:
+            snapshot = registro_macro.obtener(int(version))
+        except (ValueError, TypeError):
+            raise SolicitudInvalida(f'Valor inválido en macro_version: {version}')
+        if snapshot is None:
+            raise SolicitudInvalida(f'Snapshot macro inexistente: {version}')
+        return snapshot
+    if not any(campo in data for campo in CAMPOS_MACRO):
+        return registro_macro.vigente()
+    return None
+
+def contexto_decision(data):
+    """
+    Lo que, además de la solicitud, determina su decisión: el hash de las reglas
+    cargadas (no su campo "version", que se edita a mano) y, si la solicitud usa
+    el snapshot vigente, su versión (ver idempotencia_module)
+    """
+    contexto = [motor_reglas.actual().huella]
+    if data.get('macro_version') in (None, '') and not any(campo in data for campo in CAMPOS_MACRO):
+        vigente = registro_macro.vigente()
+        contexto.append(vigente.version if vigente is not None else None)
+    return contexto
+
+def calcular_dti(loan_amount, income, term):
+    """
+    Calcula Debt-to-Income Ratio.
+    DTI = (Cuota Mensual / Ingreso Mensual) * 100
+    """
+    if income == 0:
+        return 100
+    
+    # Cuota mensual aproximada (asumiendo tasa 8% anual)
+    tasa_mensual = 0.08 / 12
+    cuota_mensual = (loan_amount * tasa_mensual * (1 + tasa_mensual)**term) / ((1 + tasa_mensual)**term - 1)
+    
+    dti = (cuota_mensual / income) * 100
+    return round(dti, 2)
+
+def calcular_ltv(loan_amount, property_value):
+    """
+    Calcula Loan-to-Value Ratio.
+    LTV = (Monto Préstamo / Valor Propiedad) * 100
+    """
+    if property_value == 0:
+        return 100
+    
+    ltv = (loan_amount / property_value) * 100
+    return round(ltv, 2)
+
+def _valores_solicitud(data):
+    """Valores que usan las reglas de decisión, convertidos una sola vez"""
+    valores = {campo: bool(data.get(campo, False)) for campo in CAMPOS_BOOLEANOS}
+    valores['credit_worthiness'] = data.get('credit_worthiness', 'Fair')
+    valores['dti'] = float(data.get('dti', 0))
+    valores['ltv'] = float(data.get('ltv', 0))
+    return valores
+
+def calcular_score_cliente(data):
+    """
+    Sistema de puntuación del perfil del cliente (0-100).
+    Mayor score = Menor riesgo. Los descuentos están en reglas_decision.json (score_cliente).
+    """
+    return motor_reglas.actual().score_cliente(_valores_solicitud(data))[0]
+
+def calcular_dti_lote(loan_amount, income, term):
+    """Versión por columnas (arreglos NumPy) de calcular_dti"""
+    tasa_mensual = 0.08 / 12
+    factor = (1 + tasa_mensual) ** term
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cuota_mensual = (loan_amount * tasa_mensual * factor) / (factor - 1)
+        dti = np.round((cuota_mensual / income) * 100, 2)
+    return np.where(income == 0, 100.0, dti)
+
+def calcular_ltv_lote(loan_amount, property_value):
+    """Versión por columnas (arreglos NumPy) de calcular_ltv"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ltv = np.round((loan_amount / property_value) * 100, 2)
+    return np.where(property_value == 0, 100.0, ltv)
+
+def calcular_score_cliente_lote(columnas):
+    """
+    Versión por columnas de calcular_score_cliente.
+    `columnas` contiene arreglos para credit_worthiness, dti, ltv y las banderas booleanas.
+    """
+    return motor_reglas.actual().score_cliente_lote(columnas)
+
+def combinar_score_final(score_cliente, riesgo_externo, probabilidad):
+    """
+    Score final del PASO 9 (escalares o arreglos NumPy).
+    40% Perfil Cliente + 30% Entorno + 30% Modelo ML
+    """
+    return (
+        (score_cliente * 0.40) +
+        ((10 - riesgo_externo) * 10 * 0.30) +
+        ((100 - probabilidad) * 0.30)
+    )
+
+# Modelos retadores evaluados en sombra (MODELOS_RETADORES; None sin retadores)
+evaluador_sombra = EvaluadorSombra.desde_entorno(combinar_score_final)
+
+def formatear_resultado(score_cliente, riesgo_difuso, score_final, probabilidad, decision, motivo, data):
+    """Resultado de una decisión tal como se devuelve al front"""
+    resultado = {
+        'score_cliente': round(float(score_cliente), 2),
+        'riesgo_difuso': round(float(riesgo_difuso), 2),
+        'probabilidad': round(float(probabilidad), 2),
+        'score_final': round(float(score_final), 2),
+        'dti': round(float(data.get('dti', 0)), 2),
+        'ltv': round(float(data.get('ltv', 0)), 2),
+        'decision': str(decision),
+        'motivo': str(motivo)
+    }
+    if data.get('macro_version') is not None:
+        resultado['macro_version'] = data['macro_version']
+    return resultado
+
+def _validar_solicitud(data):
+    """
+    Validación común de evaluar_solicitud y del lote (/predict, /predict/batch, ASGI,
+    contraofertas): mismos errores por cualquier camino.
+    
+    Returns:
+        tuple: (loan_amount, income, term, property_value, macro, snapshot) con
+        `snapshot` el de resolver_snapshot (None = valores macro de la solicitud)
+    
+    Raises:
+        SolicitudInvalida: Si faltan campos o hay valores inválidos
+    """
+    if not data:
+        raise SolicitudInvalida('No se recibieron datos')
+    
+    snapshot = resolver_snapshot(data)
+    
+    # Validar que todos los campos requeridos estén presentes
+    for field in (CAMPOS_REQUERIDOS if snapshot is None else CAMPOS_SIN_MACRO):
+        if field not in data:
+            raise SolicitudInvalida(f'Campo requerido faltante: {field}')
+        if data[field] is None or data[field] == '':
+            raise SolicitudInvalida(f'Campo {field} está vacío')
+    
+    try:
+        loan_amount = float(data['loan_amount'])
+        income = float(data['income'])
+        term = int(data['term'])
+        property_value = float(data.get('property_value', loan_amount * 1.2))
+    except (ValueError, TypeError) as e:
+        raise SolicitudInvalida(f'Valor numérico inválido: {str(e)}')
+    
+    # Sin plazo la cuota de calcular_dti divide por cero
+    if term <= 0:
+        raise SolicitudInvalida('Valor inválido: term debe ser mayor que 0')
+    
+    if snapshot is None:
+        try:
+            macro = [float(data[campo]) for campo in CAMPOS_MACRO]
+        except (ValueError, TypeError) as e:
+            raise SolicitudInvalida(f'Valor inválido: {str(e)}')
+    else:
+        macro = list(snapshot.macro)
+    
+    return loan_amount, income, term, property_value, macro, snapshot
+
+def evaluar_solicitud(data, detalle=None, cronometro=CRONOMETRO_NULO, explicar=False, sombra=True):
+    """
+    Evalúa una solicitud con el flujo completo (PASO 1 a PASO 10).
+    Agrega 'dti', 'ltv' y 'macro_version' a `data`, igual que hacía la vista /predict.
+    Las variables macro pueden venir en la solicitud o de un snapshot (macro_version
+    o, si no trae ninguna, el vigente); con snapshot se copian a `data`.
+    
+    Args:
+        data: Solicitud (dict)
+        detalle: Dict opcional donde se anotan las reglas aplicadas (descuentos,
+            bandera_roja, penalizaciones, regla_decision)
+        cronometro: metrics_module.Cronometro que registra cada etapa con el
+            nombre de su PASO (validacion, paso_1_metricas_financieras, ...)
+        explicar: Anotar en detalle['riesgo_difuso'] la explicación del riesgo
+            externo (reglas activadas y ajustes post-cálculo)
+        sombra: Enviar la solicitud a los modelos retadores, si los hay
+    
+    Returns:
+        tuple: (score_cliente, riesgo_externo, score_final, probabilidad, decision, motivo)
+    
+    Raises:
+        SolicitudInvalida: Si faltan campos o hay valores inválidos
+    """
+    loan_amount, income, term, property_value, macro, snapshot = _validar_solicitud(data)
+
+    reglas = motor_reglas.actual()
+    if detalle is None:
+        detalle = {}
+    cronometro.marca('validacion')
+
+    # ============ PASO 1: CALCULAR MÉTRICAS FINANCIERAS ============
+    if snapshot is None:
+        # Mismos valores que el snapshot vigente: se reutiliza lo ya calculado
+        snapshot = registro_macro.coincidente(macro)
+    else:
+        data.update(snapshot.valores)
+
+    dti = calcular_dti(loan_amount, income, term)
+    ltv = calcular_ltv(loan_amount, property_value)
+
+    data['dti'] = dti
+    data['ltv'] = ltv
+    data['macro_version'] = snapshot.version if snapshot is not None else None
+
+    valores = _valores_solicitud(data)
+    valores.update(zip(CAMPOS_MACRO, macro))
+    valores.update(loan_amount=loan_amount, income=income, term=term, property_value=property_value)
+    cronometro.marca('paso_1_metricas_financieras')
+
+    # ============ PASO 2: CALCULAR SCORE DEL CLIENTE ============
+    score_cliente, detalle['descuentos'] = reglas.score_cliente(valores)
+    valores['score_cliente'] = score_cliente
+    cronometro.marca('paso_2_score_cliente')
+
+    # ============ PASO 3: CALCULAR RIESGO DIFUSO (MACROECONOMÍA) ============
+    if explicar:
+        # Con snapshot el valor ya está calculado y la explicación suele estar en caché
+        riesgo_externo, detalle['riesgo_difuso'] = calcular_riesgo_externo_explicado(*macro)
+    if snapshot is not None:
+        riesgo_externo = snapshot.riesgo_externo
+    elif not explicar:
+        riesgo_externo = calcular_riesgo_externo(*macro)
+    valores['riesgo_externo'] = riesgo_externo
+    cronometro.marca('paso_3_riesgo_difuso')
+
+    # ============ PASO 4 y 5: BANDERAS ROJAS Y SCORE BAJO (RECHAZO AUTOMÁTICO) ============
+    # Las banderas que solo miran variables macro ya están evaluadas en el snapshot
+    bandera = reglas.bandera_roja(valores, snapshot.banderas(reglas) if snapshot is not None else None)
+    cronometro.marca('paso_4_5_banderas_rojas')
+    if bandera is not None:
+        detalle['bandera_roja'] = bandera.id
+        return (score_cliente, riesgo_externo, bandera.score_final, bandera.probabilidad,
+                "RECHAZADO", bandera.motivo)
+
+    # ============ PASO 6: CONSTRUIR FEATURES PARA RANDOM FOREST ============
+    try:
+        features_array = codificador.codificar(data)
+    except KeyError as e:
+        raise SolicitudInvalida(f'Valor inválido en campo categórico: {str(e)}')
+    cronometro.marca('paso_6_features')
+
+    # ============ PASO 7: PREDICCIÓN RANDOM FOREST ============
+    # (el scaler está incluido: el motor compara contra umbrales en escala original)
+    prob_base = float(motor.predict_proba_crudo(features_array)[0][1])
+    cronometro.marca('paso_7_random_forest')
+
+    # ============ PASO 8: AJUSTES Y PENALIZACIONES ============
+    prob_base, detalle['penalizaciones'] = reglas.penalizar(prob_base, valores)
+    prob = min(100.0, prob_base * 100)
+    cronometro.marca('paso_8_ajustes')
+
+    # ============ PASO 9: SCORE FINAL COMBINADO ============
+    score_final = combinar_score_final(score_cliente, riesgo_externo, prob)
+    cronometro.marca('paso_9_score_final')
+
+    # ============ PASO 10: DECISIÓN FINAL ============
+    valores.update(score_final=score_final, probabilidad=prob)
+    regla, decision, motivo = reglas.decision_final(valores)
+    detalle['regla_decision'] = regla.id
+    cronometro.marca('paso_10_decision')
+
+    # ============ MODELOS RETADORES (EN SOMBRA, FUERA DE LA SOLICITUD) ============
+    # features_array es un búfer del hilo que se reutiliza: se envía una copia
+    if sombra and evaluador_sombra is not None:
+        evaluador_sombra.enviar(features_array.copy(), valores, prob, decision, score_final, reglas)
+
+    return (score_cliente, riesgo_externo, score_final, prob, decision, motivo)
+
+# Banderas opcionales de la solicitud (ausente = False)
+CAMPOS_BOOLEANOS = ['neg_amortization', 'interest_only', 'lump_sum_payment',
+                    'business_or_commercial', 'approv_in_adv', 'co_applicant']
+
+def _preparar_solicitud(data):
+    """
+    Valida y convierte una solicitud del lote.
+    Devuelve (fila numérica, snapshot macro o None, None) o (None, None, mensaje de error)
+    con los mismos mensajes que evaluar_solicitud.
+    """
+    if not isinstance(data, dict):
+        return None, None, 'No se recibieron datos'
+    try:
+        loan_amount, income, term, property_value, macro, snapshot = _validar_solicitud(data)
+    except SolicitudInvalida as e:
+        return None, None, str(e)
+    if snapshot is None:
+        snapshot = registro_macro.coincidente(macro)
+    
+    return [loan_amount, income, term, property_value] + macro, snapshot, None
+
+def evaluar_lote(solicitudes, sombra=True):
+    """
+    Evalúa un lote de solicitudes con el mismo flujo que evaluar_solicitud, pero por
+    columnas: métricas, score, riesgo difuso y banderas rojas como operaciones NumPy, y
+    una sola llamada a scaler + Random Forest para todas las solicitudes que llegan al PASO 7.
+    
+    Returns:
+        list: Por solicitud y en el orden de entrada, la tupla
+        (score_cliente, riesgo_externo, score_final, probabilidad, decision, motivo, data)
+        o la excepción SolicitudInvalida que habría lanzado evaluar_solicitud.
+        Con sombra=True las filas que llegan al PASO 7 se envían a los modelos retadores.
+    """
+    resultados = [None] * len(solicitudes)
+    indices = []
+    datos = []
+    filas = []
+    snapshots = []
+    
+    for i, data in enumerate(solicitudes):
+        fila, snapshot, error = _preparar_solicitud(data)
+        if error:
+            resultados[i] = SolicitudInvalida(error)
+            continue
+        indices.append(i)
+        datos.append(dict(data))
+        filas.append(fila)
+        snapshots.append(snapshot)
+        if snapshot is not None:
+            datos[-1].update(snapshot.valores)
+        datos[-1]['macro_version'] = snapshot.version if snapshot is not None else None
+    
+    if not filas:
+        return resultados
+    
+    n = len(filas)
+    matriz = np.array(filas, dtype=np.float64)
+    loan_amount, income, term, property_value = matriz[:, 0], matriz[:, 1], matriz[:, 2], matriz[:, 3]
+    inflacion, combustible, protestas, desempleo, covid, clima = matriz[:, 4:10].T
+    
+    reglas = motor_reglas.actual()
+    columnas = {campo: np.array([bool(d.get(campo, False)) for d in datos]) for campo in CAMPOS_BOOLEANOS}
+    columnas['credit_worthiness'] = np.array([d.get('credit_worthiness', 'Fair') for d in datos], dtype=object)
+    columnas.update(loan_amount=loan_amount, income=income, term=term, property_value=property_value,
+                    inflacion=inflacion, combustible=combustible, protestas=protestas,
+                    desempleo=desempleo, covid=covid, clima=clima)
+    
+    # ============ PASO 1: CALCULAR MÉTRICAS FINANCIERAS ============
+    dti = calcular_dti_lote(loan_amount, income, term)
+    ltv = calcular_ltv_lote(loan_amount, property_value)
+    columnas['dti'] = dti
+    columnas['ltv'] = ltv
+    for d, dti_i, ltv_i in zip(datos, dti.tolist(), ltv.tolist()):
+        d['dti'] = dti_i
+        d['ltv'] = ltv_i
+    
+    # ============ PASO 2: CALCULAR SCORE DEL CLIENTE ============
+    score_cliente = reglas.score_cliente_lote(columnas)
+    columnas['score_cliente'] = score_cliente
+    
+    # ============ PASO 3: CALCULAR RIESGO DIFUSO (MACROECONOMÍA) ============
+    # Las filas con snapshot macro usan su riesgo ya calculado; el resto se evalúa junto
+    riesgo_externo = np.array([s.riesgo_externo if s is not None else np.nan for s in snapshots])
+    sin_snapshot = np.array([s is None for s in snapshots])
+    if sin_snapshot.any():
+        riesgo_externo[sin_snapshot] = calcular_riesgo_difuso_lote(
+            inflacion[sin_snapshot], combustible[sin_snapshot], protestas[sin_snapshot],
+            desempleo[sin_snapshot], covid[sin_snapshot], clima[sin_snapshot])
+    riesgo_externo = np.where(np.isnan(riesgo_externo), 5.0, riesgo_externo)  # Valor por defecto
+    columnas['riesgo_externo'] = riesgo_externo
+    
+    # ============ PASO 4 y 5: BANDERAS ROJAS Y SCORE BAJO ============
+    # Primera bandera de reglas_decision.json que dispara en cada fila (-1 = ninguna)
+    bandera = reglas.banderas_rojas_lote(columnas, n)
+    
+    score_final = np.zeros(n)
+    prob = np.zeros(n)
+    decision = np.empty(n, dtype=object)
+    motivo = np.empty(n, dtype=object)
+    pendiente = bandera < 0
+    for k in np.flatnonzero(~pendiente).tolist():
+        regla = reglas.banderas[bandera[k]]
+        score_final[k], prob[k] = regla.score_final, regla.probabilidad
+        decision[k], motivo[k] = "RECHAZADO", regla.motivo
+    
+    # ============ PASO 6: CONSTRUIR FEATURES PARA RANDOM FOREST ============
+    invalidos = np.zeros(n, dtype=bool)
+    codigos = np.zeros((n, len(codificador.campos_categoricos)), dtype=np.intp)
+    for k in np.flatnonzero(pendiente):
+        try:
+            codigos[k] = codificador.codigos(datos[k])
+        except KeyError as e:
+            resultados[indices[k]] = SolicitudInvalida(f'Valor inválido en campo categórico: {str(e)}')
+            invalidos[k] = True
+    pendiente &= ~invalidos
+    
+    modelo_idx = np.flatnonzero(pendiente)
+    if len(modelo_idx):
+        numericos = np.column_stack([income, loan_amount, term, inflacion, combustible,
+                                     protestas, covid, desempleo, clima])[modelo_idx]
+        features = codificador.codificar_lote(codigos[modelo_idx], numericos)
+        columnas_m = {campo: columna[modelo_idx] for campo, columna in columnas.items()}
+        
+        # ============ PASO 7: PREDICCIÓN RANDOM FOREST (una sola llamada) ============
+        prob_base = motor.predict_proba_crudo(features)[:, 1]
+        
+        # ============ PASO 8: AJUSTES Y PENALIZACIONES ============
+        prob_base = reglas.penalizar_lote(prob_base, columnas_m)
+        prob_m = np.minimum(100.0, prob_base * 100)
+        
+        # ============ PASO 9: SCORE FINAL COMBINADO ============
+        score_m = combinar_score_final(columnas_m['score_cliente'], columnas_m['riesgo_externo'], prob_m)
+        prob[modelo_idx] = prob_m
+        score_final[modelo_idx] = score_m
+        
+        # ============ PASO 10: DECISIÓN FINAL ============
+        columnas_m.update(score_final=score_m, probabilidad=prob_m)
+        aplicada = reglas.decision_final_lote(columnas_m, len(modelo_idx))
+        for k, indice, sf, p, sc in zip(modelo_idx.tolist(), aplicada.tolist(), score_m.tolist(),
+                                        prob_m.tolist(), columnas_m['score_cliente'].tolist()):
+            regla = reglas.regla_decision(indice)
+            decision[k] = regla.decision
+            motivo[k] = regla.motivo.format(score_final=sf, probabilidad=p, score_cliente=sc)
+
+        # ============ MODELOS RETADORES (EN SOMBRA, FUERA DE LA SOLICITUD) ============
+        if sombra and evaluador_sombra is not None:
+            evaluador_sombra.enviar(features, columnas_m, prob_m, decision[modelo_idx], score_m, reglas)
+    
+    # ============ RESULTADOS EN EL ORDEN DE ENTRADA ============
+    for k in np.flatnonzero(~invalidos).tolist():
+        resultados[indices[k]] = (float(score_cliente[k]), float(riesgo_externo[k]), float(score_final[k]),
+                                  float(prob[k]), decision[k], motivo[k], datos[k])
+    
+    return resultados
+
+
+# ============ PRECALENTAMIENTO ============
+# Solicitudes sintéticas que recorren los 10 pasos (sin banderas rojas, con variables
+# macro propias) para cargar el modelo y construir el sistema difuso antes de la
+# primera solicitud real
+SOLICITUDES_PRECALENTAMIENTO = [
+    {'nombre': 'Precalentamiento 1', 'gender': 'Female', 'age': '35-44', 'region': 'Central',
+     'credit_type': 'EXP', 'credit_worthiness': 'Good', 'income': 8000, 'loan_amount': 150000,
+     'property_value': 250000, 'term': 360, 'inflacion': 4.5, 'combustible': 3.2, 'protestas': 300,
+     'desempleo': 5.5, 'covid': 200, 'clima': 18},
+    {'nombre': 'Precalentamiento 2', 'gender': 'Male', 'age': '25-34', 'region': 'North',
+     'credit_type': 'CIB', 'credit_worthiness': 'Fair', 'income': 4500, 'loan_amount': 90000,
+     'property_value': 120000, 'term': 240, 'inflacion': 9.0, 'combustible': 4.0, 'protestas': 900,
+     'desempleo': 7.5, 'covid': 1200, 'clima': 25, 'co_applicant': True},
+]
+
+
+def precalentar():
+    """
+    Construye el pool de simulaciones difusas (una por hilo que atiende solicitudes,
+    ver fuzzy_module.MotorDifuso) y evalúa SOLICITUDES_PRECALENTAMIENTO por
+    evaluar_solicitud y evaluar_lote, sin guardar nada, para que la carga del
+    modelo (MODELO_PEREZOSO), el sistema difuso y las reglas no se paguen en la
+    primera solicitud de ningún hilo.
+
+    Returns:
+        float: Duración del precalentamiento en ms
+    """
+    inicio = time.perf_counter()
+    motor_difuso.precalentar()
+    for data in SOLICITUDES_PRECALENTAMIENTO:
+        evaluar_solicitud(dict(data), sombra=False)
+    evaluar_lote([dict(data) for data in SOLICITUDES_PRECALENTAMIENTO], sombra=False)
+    return round((time.perf_counter() - inicio) * 1000, 1)
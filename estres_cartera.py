@@ -0,0 +1,86 @@
+"""
+Prueba de estrés macroeconómico de la cartera guardada (ver estres_module).
+
+Cada --escenario da algunas variables macro (las demás salen de --base o, si no se
+indica, del último snapshot macro); --rejilla arma un escenario por combinación de
+valores. Imprime como JSON la distribución de decisiones de cada escenario y su
+variación contra las decisiones guardadas.
+
+Uso:
+    python estres_cartera.py --escenario inflacion=25,desempleo=12
+    python estres_cartera.py --base inflacion=4,combustible=3,protestas=300,desempleo=5,covid=200,clima=18 \\
+        --rejilla inflacion=5:60:5 --rejilla desempleo=4,8,12,16 --desde 2025-01-01
+    python estres_cartera.py --archivo escenarios.json
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from estres_module import CarteraHistorica, completar_escenarios, estresar, macro_vigente, rejilla_escenarios
+from macro_module import CAMPOS_MACRO
+
+
+def _pares(texto):
+    """'inflacion=25,desempleo=12' -> {'inflacion': 25.0, 'desempleo': 12.0} (nombre queda como texto)"""
+    valores = {}
+    for par in texto.split(','):
+        campo, _, valor = par.partition('=')
+        campo = campo.strip()
+        if campo != 'nombre' and campo not in CAMPOS_MACRO:
+            raise argparse.ArgumentTypeError(f'Variable macro desconocida: {campo}')
+        valores[campo] = valor.strip() if campo == 'nombre' else float(valor)
+    return valores
+
+
+def _rango(texto):
+    """'inflacion=5:60:5' (inicio:fin:paso, fin incluido) o 'desempleo=4,8,12'"""
+    campo, _, valores = texto.partition('=')
+    if campo not in CAMPOS_MACRO:
+        raise argparse.ArgumentTypeError(f'Variable macro desconocida: {campo}')
+    if ':' in valores:
+        inicio, fin, paso = (float(v) for v in valores.split(':'))
+        return campo, np.round(np.arange(inicio, fin + paso / 2, paso), 6).tolist()
+    return campo, [float(v) for v in valores.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--escenario', type=_pares, action='append', default=[],
+                        help='Variables macro del escenario: campo=valor,... (nombre=... opcional)')
+    parser.add_argument('--rejilla', type=_rango, action='append', default=[],
+                        help='campo=inicio:fin:paso o campo=v1,v2,...; una por variable')
+    parser.add_argument('--archivo', help='JSON con una lista de escenarios')
+    parser.add_argument('--base', type=_pares, help='Valores para las variables que un escenario no da')
+    parser.add_argument('--db', help='Base a usar (default HISTORIAL_DB o historial.db)')
+    parser.add_argument('--desde', help='Solo solicitudes desde esta fecha')
+    parser.add_argument('--hasta', help='Solo solicitudes hasta esta fecha')
+    args = parser.parse_args(argv)
+
+    escenarios = list(args.escenario)
+    if args.archivo:
+        with open(args.archivo, encoding='utf-8') as archivo:
+            escenarios += json.load(archivo)
+    if args.rejilla:
+        escenarios += rejilla_escenarios(dict(args.rejilla))
+    if not escenarios:
+        parser.error('Indicar al menos un --escenario, --rejilla o --archivo')
+    try:
+        escenarios = completar_escenarios(escenarios, args.base or macro_vigente(args.db))
+    except ValueError as e:
+        parser.error(str(e))
+
+    inicio = time.perf_counter()
+    cartera = CarteraHistorica.cargar(args.db, args.desde, args.hasta)
+    carga = time.perf_counter() - inicio
+    resultado = estresar(cartera, escenarios)
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+    print(f'{cartera.n} solicitudes × {len(escenarios)} escenarios: carga {carga:.2f} s, '
+          f'cálculo {time.perf_counter() - inicio - carga:.2f} s', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""
+Pruebas de estrés macroeconómico sobre la cartera guardada en historial.db.
+
+CarteraHistorica carga las solicitudes una vez en arreglos y estresar() vuelve a
+aplicar, para N escenarios × M solicitudes como operaciones de arreglos, la parte
+de predict() que depende del entorno: banderas rojas macro, riesgo difuso (una
+evaluación vectorizada para todos los escenarios), penalizaciones sobre el riesgo,
+score final combinado y decisión final.
+
+La probabilidad del Random Forest se mantiene fija: el historial no guarda
+credit_type ni las banderas de la solicitud (ni, sin snapshot, las variables macro
+originales), así que el modelo no se puede volver a correr. Se recupera de la
+probabilidad guardada restando las penalizaciones que dependen del entorno. Las
+solicitudes que en su momento cayeron en una bandera macro nunca llegaron al
+modelo: si un escenario las deja pasar quedan como INDETERMINADO.
+"""
+import itertools
+import sqlite3
+
+import numpy as np
+
+from db_module import conectar
+from decision_module import combinar_score_final, motor_reglas
+from fuzzy_module import calcular_riesgo_difuso_lote
+from macro_module import CAMPOS_MACRO
+
+INDETERMINADO = 'INDETERMINADO'
+
+# Elementos (escenarios × solicitudes) por bloque de cálculo, para acotar la memoria
+ELEMENTOS_BLOQUE = 2_000_000
+
+# Columna de solicitudes -> campo que leen las reglas de decisión
+COLUMNAS_CARTERA = {
+    'income': 'income',
+    'monto': 'loan_amount',
+    'plazo': 'term',
+    'property_value': 'property_value',
+    'credit_worthiness': 'credit_worthiness',
+    'dti': 'dti',
+    'ltv': 'ltv',
+    'score_cliente': 'score_cliente',
+    'riesgo_difuso': 'riesgo_externo',
+    'probabilidad': 'probabilidad',
+    'score_final': 'score_final',
+    'decision': 'decision',
+    'motivo': 'motivo',
+}
+COLUMNAS_TEXTO = {'credit_worthiness', 'decision', 'motivo'}
+
+# Campos que cambian con el escenario
+CAMPOS_ENTORNO = frozenset(CAMPOS_MACRO) | {'riesgo_externo'}
+
+
+class CarteraHistorica:
+    """
+    Solicitudes guardadas como columnas NumPy (campos de las reglas). Las variables
+    macro originales solo se conocen para las solicitudes con snapshot (NaN si no).
+    """
+
+    def __init__(self, columnas):
+        self.columnas = columnas
+        self.n = len(columnas['decision'])
+
+    @classmethod
+    def cargar(cls, ruta_db=None, desde=None, hasta=None):
+        """Lee solicitudes (opcionalmente entre dos fechas) en una sola consulta"""
+        conn = conectar(ruta_db)
+        conn.row_factory = None
+        try:
+            existentes = {fila[1] for fila in conn.execute('PRAGMA table_info(solicitudes)')}
+            seleccion = [f's.{columna}' for columna in COLUMNAS_CARTERA]
+            if 'macro_version' in existentes:
+                seleccion += [f'm.{campo}' for campo in CAMPOS_MACRO]
+                union = 'LEFT JOIN snapshots_macro m ON m.version = s.macro_version'
+            else:
+                seleccion += ['NULL'] * len(CAMPOS_MACRO)
+                union = ''
+            condiciones, parametros = [], []
+            if desde:
+                condiciones.append('s.fecha >= ?')
+                parametros.append(desde)
+            if hasta:
+                condiciones.append('s.fecha <= ?')
+                parametros.append(hasta)
+            where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+            filas = conn.execute(f"SELECT {', '.join(seleccion)} FROM solicitudes s {union} {where} ORDER BY s.id",
+                                 parametros).fetchall()
+        finally:
+            conn.close()
+
+        campos = list(COLUMNAS_CARTERA.values()) + list(CAMPOS_MACRO)
+        valores = list(zip(*filas)) if filas else [()] * len(campos)
+        columnas = {}
+        for columna, campo, valores_campo in zip(list(COLUMNAS_CARTERA) + list(CAMPOS_MACRO), campos, valores):
+            if columna in COLUMNAS_TEXTO:
+                columnas[campo] = np.array(valores_campo, dtype=object)
+            else:
+                columnas[campo] = np.array(valores_campo, dtype=np.float64)
+        return cls(columnas)
+
+
+def completar_escenarios(escenarios, base=None):
+    """
+    Escenarios con las seis variables macro: lo que falta en cada uno se toma de `base`.
+
+    Raises:
+        ValueError: Si a un escenario le falta una variable y `base` no la tiene
+    """
+    completos = []
+    for i, escenario in enumerate(escenarios):
+        completo = {'nombre': escenario.get('nombre', f'escenario_{i + 1}')}
+        for campo in CAMPOS_MACRO:
+            valor = escenario.get(campo, (base or {}).get(campo))
+            if valor is None:
+                raise ValueError(f"Falta {campo} en {completo['nombre']} (sin valor base)")
+            completo[campo] = float(valor)
+        completos.append(completo)
+    return completos
+
+
+def rejilla_escenarios(rangos):
+    """Producto cartesiano de {campo: valores}: un escenario por combinación"""
+    campos = list(rangos)
+    return [dict(zip(campos, combinacion), nombre=','.join(f'{c}={v:g}' for c, v in zip(campos, combinacion)))
+            for combinacion in itertools.product(*(rangos[c] for c in campos))]
+
+
+def _conteos(codigos, categorias, filas):
+    """Conteo por categoría de cada fila de `codigos` (filas × solicitudes)"""
+    desplazados = codigos + np.arange(filas)[:, None] * categorias
+    return np.bincount(desplazados.ravel(), minlength=filas * categorias).reshape(filas, categorias)
+
+
+def _distribucion(conteo, decisiones):
+    total = int(conteo.sum())
+    return {decision: {'cantidad': int(c), 'tasa': round(int(c) / total, 4) if total else 0.0}
+            for decision, c in zip(decisiones, conteo.tolist()) if c}
+
+
+def estresar(cartera, escenarios, reglas=None):
+    """
+    Decisiones de la cartera bajo cada escenario macro.
+
+    Args:
+        cartera: CarteraHistorica
+        escenarios: Dicts con las seis variables macro (ver completar_escenarios)
+            y opcionalmente 'nombre'
+        reglas: TablaReglas (default las vigentes)
+
+    Returns:
+        dict: Distribución guardada ('base') y, por escenario, riesgo externo,
+        distribución de decisiones, promedios, variaciones contra la base,
+        cambios de decisión ('APROBADO -> RECHAZADO': n) y banderas rojas
+    """
+    reglas = reglas or motor_reglas.actual()
+    columnas = cartera.columnas
+    m = cartera.n
+
+    # Decisiones posibles: las de las reglas, más las guardadas que ya no existan
+    decisiones = ['APROBADO', 'REVISIÓN MANUAL', 'RECHAZADO']
+    for regla in reglas.reglas_decision + [reglas.aprobacion]:
+        if regla.decision not in decisiones:
+            decisiones.append(regla.decision)
+    for decision in dict.fromkeys(columnas['decision'].tolist()):
+        if decision not in decisiones:
+            decisiones.append(decision)
+    decisiones.append(INDETERMINADO)
+    indice_decision = {decision: i for i, decision in enumerate(decisiones)}
+    k = len(decisiones)
+    codigo_base = np.array([indice_decision[d] for d in columnas['decision'].tolist()], dtype=np.intp)
+
+    # Bandera roja de cada solicitud en su evaluación original (-1: llegó al modelo)
+    por_motivo = {bandera.motivo: i for i, bandera in enumerate(reglas.banderas)}
+    bandera_base = np.array([por_motivo.get(motivo, -1) for motivo in columnas['motivo'].tolist()], dtype=np.intp)
+    # Las banderas que leen campos que no se guardan (p. ej. neg_amortization) no
+    # dependen del entorno: dan lo mismo que en la evaluación original
+    disponibles = set(columnas) | CAMPOS_ENTORNO
+    fijas = {i: bandera_base == i for i in range(len(reglas.banderas))
+             if not reglas.campos_bandera(i) <= disponibles}
+
+    # Probabilidad del modelo más las penalizaciones propias de la solicitud
+    penalizaciones_entorno = [p for p in reglas.penalizaciones if p.campo in CAMPOS_ENTORNO]
+    penalizacion_base = sum((p.evaluar_lote(columnas) for p in penalizaciones_entorno), np.zeros(m))
+    prob_modelo = columnas['probabilidad'] / 100 - penalizacion_base
+    prob_modelo[bandera_base >= 0] = np.nan
+
+    escenarios = completar_escenarios(escenarios)
+    macro = np.array([[e[campo] for campo in CAMPOS_MACRO] for e in escenarios]).reshape(-1, len(CAMPOS_MACRO))
+    riesgo = calcular_riesgo_difuso_lote(*macro.T)
+    riesgo = np.where(np.isnan(riesgo), 5.0, riesgo)  # Valor por defecto, como evaluar_lote
+
+    # Columnas de la cartera como (1, M) y del escenario como (N, 1): las reglas se
+    # evalúan por broadcasting sobre escenarios × solicitudes sin copiar la cartera
+    filas = {campo: valores[None, :] for campo, valores in columnas.items()
+             if campo not in CAMPOS_ENTORNO | {'probabilidad', 'score_final', 'decision', 'motivo'}}
+    fijas = {i: valores[None, :] for i, valores in fijas.items()}
+    prob_modelo = prob_modelo[None, :]
+    score_bandera = np.array([b.score_final for b in reglas.banderas] + [np.nan])
+    prob_bandera = np.array([b.probabilidad for b in reglas.banderas] + [np.nan])
+    codigo_regla = np.array([indice_decision[reglas.regla_decision(i).decision]
+                             for i in range(-1, len(reglas.reglas_decision))])
+    rechazado = indice_decision['RECHAZADO']
+
+    resultados = []
+    por_bloque = max(1, ELEMENTOS_BLOQUE // max(m, 1))
+    for inicio in range(0, len(escenarios), por_bloque):
+        nb = min(por_bloque, len(escenarios) - inicio)
+        forma = (nb, m)
+        bloque = dict(filas)
+        for j, campo in enumerate(CAMPOS_MACRO):
+            bloque[campo] = macro[inicio:inicio + nb, j, None]
+        bloque['riesgo_externo'] = riesgo[inicio:inicio + nb, None]
+
+        # ============ PASO 4 y 5: BANDERAS ROJAS ============
+        bandera = reglas.banderas_rojas_lote(bloque, forma, fijas)
+        con_bandera = bandera >= 0
+
+        # ============ PASO 8: PENALIZACIONES DEL ENTORNO ============
+        prob_base = prob_modelo
+        for penalizacion in penalizaciones_entorno:
+            prob_base = prob_base + penalizacion.evaluar_lote(bloque)
+        prob = np.broadcast_to(np.minimum(100.0, prob_base * 100), forma)
+
+        # ============ PASO 9 y 10: SCORE FINAL Y DECISIÓN ============
+        score = combinar_score_final(bloque['score_cliente'], bloque['riesgo_externo'], prob)
+        bloque.update(score_final=score, probabilidad=prob)
+        codigo = codigo_regla[reglas.decision_final_lote(bloque, forma) + 1]
+        codigo[con_bandera] = rechazado
+        score = np.where(con_bandera, score_bandera[bandera], score)
+        prob = np.where(con_bandera, prob_bandera[bandera], prob)
+        indeterminado = ~con_bandera & np.isnan(prob)
+        codigo[indeterminado] = indice_decision[INDETERMINADO]
+
+        conteos = _conteos(codigo, k, nb)
+        cambios = _conteos(codigo_base[None, :] * k + codigo, k * k, nb)
+        banderas = _conteos(bandera + 1, len(reglas.banderas) + 1, nb)
+        determinado = codigo != indice_decision[INDETERMINADO]
+
+        for b in range(nb):
+            escenario = escenarios[inicio + b]
+            validos = determinado[b]
+            score_escenario = float(score[b][validos].mean()) if validos.any() else None
+            score_original = float(columnas['score_final'][validos].mean()) if validos.any() else None
+            distribucion = _distribucion(conteos[b], decisiones)
+            resultados.append({
+                'nombre': escenario['nombre'],
+                'macro': {campo: escenario[campo] for campo in CAMPOS_MACRO},
+                'riesgo_externo': round(float(riesgo[inicio + b]), 2),
+                'decisiones': distribucion,
+                'score_final_promedio': round(score_escenario, 4) if score_escenario is not None else None,
+                'probabilidad_promedio': round(float(prob[b][validos].mean()), 4) if validos.any() else None,
+                'variacion_score_final_promedio': (round(score_escenario - score_original, 4)
+                                                   if score_escenario is not None else None),
+                'cambios': {f'{decisiones[c // k]} -> {decisiones[c % k]}': int(v)
+                            for c, v in enumerate(cambios[b].tolist()) if v and c // k != c % k},
+                'banderas_rojas': {reglas.banderas[i - 1].id: int(v)
+                                   for i, v in enumerate(banderas[b].tolist()) if i and v},
+            })
+
+    base = _distribucion(np.bincount(codigo_base, minlength=k), decisiones)
+    for resultado in resultados:
+        resultado['variacion_tasas'] = {
+            decision: round(resultado['decisiones'].get(decision, {}).get('tasa', 0.0)
+                            - base.get(decision, {}).get('tasa', 0.0), 4)
+            for decision in decisiones
+            if decision in base or decision in resultado['decisiones']}
+    return {
+        'solicitudes': m,
+        'base': {'decisiones': base,
+                 'score_final_promedio': round(float(columnas['score_final'].mean()), 4) if m else None},
+        'escenarios': resultados,
+    }
+
+
+def macro_vigente(ruta_db=None):
+    """Variables macro del último snapshot de la base (None si no hay)"""
+    conn = conectar(ruta_db)
+    try:
+        fila = conn.execute(f"SELECT {', '.join(CAMPOS_MACRO)} FROM snapshots_macro "
+                            f"ORDER BY version DESC LIMIT 1").fetchone()
+    except sqlite3.OperationalError:  # Base sin la tabla de snapshots
+        return None
+    finally:
+        conn.close()
+    return dict(zip(CAMPOS_MACRO, fila)) if fila else None
@@ -0,0 +1,204 @@
+"""
+Reevaluación de cartera por línea de comandos.
+
+Lee solicitudes desde un CSV o NDJSON, las evalúa por bloques con la misma lógica
+de decisión que /predict (decision_module) y escribe cada decisión a medida que se
+calcula. La memoria queda acotada por el tamaño de bloque y el número de bloques en
+vuelo, no por el tamaño del archivo.
+
+Uso:
+    python evaluar_cartera.py cartera.csv decisiones.ndjson --bloque 2000 --procesos 4
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from decision_module import CAMPOS_BOOLEANOS, SolicitudInvalida, evaluar_lote, formatear_resultado
+
+# Columnas del archivo de salida en formato CSV
+COLUMNAS_SALIDA = ['fila', 'nombre', 'decision', 'motivo', 'score_cliente', 'riesgo_difuso',
+                   'probabilidad', 'score_final', 'dti', 'ltv', 'error']
+
+VERDADEROS = {'1', 'true', 'si', 'sí', 'yes', 'y', 't'}
+
+
+def _formato(ruta, formato):
+    if formato:
+        return formato
+    return 'csv' if ruta.lower().endswith('.csv') else 'ndjson'
+
+
+def _normalizar_fila_csv(fila):
+    """Convierte una fila de csv.DictReader (todo texto) a los tipos que espera la decisión"""
+    data = {}
+    for campo, valor in fila.items():
+        if campo is None or valor is None:
+            continue
+        valor = valor.strip()
+        if valor == '':
+            continue  # Campo ausente: aplica el valor por defecto de la lógica de decisión
+        if campo in CAMPOS_BOOLEANOS:
+            data[campo] = valor.lower() in VERDADEROS
+            continue
+        try:
+            data[campo] = float(valor)
+        except ValueError:
+            data[campo] = valor
+    return data
+
+
+def leer_solicitudes(ruta, formato):
+    """Generador de solicitudes (dict) leídas una a una"""
+    with open(ruta, newline='', encoding='utf-8') as archivo:
+        if formato == 'csv':
+            for fila in csv.DictReader(archivo):
+                yield _normalizar_fila_csv(fila)
+        else:
+            for linea in archivo:
+                linea = linea.strip()
+                if linea:
+                    try:
+                        valor = json.loads(linea)
+                    except json.JSONDecodeError as e:
+                        yield {'_error': f'JSON inválido: {e}'}
+                        continue
+                    if not isinstance(valor, dict):
+                        valor = {'_error': 'La línea no es un objeto JSON'}
+                    yield valor
+
+
+def leer_bloques(solicitudes, tamano):
+    """Agrupa el generador de solicitudes en listas de `tamano` elementos"""
+    iterador = iter(solicitudes)
+    while True:
+        bloque = list(islice(iterador, tamano))
+        if not bloque:
+            return
+        yield bloque
+
+
+def evaluar_bloque(bloque):
+    """
+    Evalúa un bloque y devuelve registros de salida listos para escribir.
+    Se ejecuta en el proceso principal o en un proceso del pool.
+    """
+    validas = [s for s in bloque if '_error' not in s]
+    evaluadas = iter(evaluar_lote(validas)) if validas else iter(())
+
+    registros = []
+    for solicitud in bloque:
+        registro = {'nombre': solicitud.get('nombre', '')}
+        if '_error' in solicitud:
+            registro['error'] = solicitud['_error']
+        else:
+            item = next(evaluadas)
+            if isinstance(item, SolicitudInvalida):
+                registro['error'] = str(item)
+            else:
+                registro.update(formatear_resultado(*item))
+        registros.append(registro)
+    return registros
+
+
+class EscritorDecisiones:
+    """Escribe registros de decisión en NDJSON o CSV a medida que llegan"""
+
+    def __init__(self, archivo, formato):
+        self.archivo = archivo
+        self.formato = formato
+        self.filas = 0
+        self.errores = 0
+        self._csv = None
+        if formato == 'csv':
+            self._csv = csv.DictWriter(archivo, fieldnames=COLUMNAS_SALIDA, extrasaction='ignore')
+            self._csv.writeheader()
+
+    def escribir(self, registros):
+        for registro in registros:
+            registro['fila'] = self.filas
+            self.filas += 1
+            if 'error' in registro:
+                self.errores += 1
+            if self._csv:
+                self._csv.writerow(registro)
+            else:
+                self.archivo.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        self.archivo.flush()
+
+
+def evaluar_cartera(entrada, salida, tamano_bloque=2000, procesos=1,
+                    formato_entrada=None, formato_salida=None):
+    """
+    Evalúa todas las solicitudes de `entrada` y escribe las decisiones en `salida`.
+
+    Con procesos > 1 los bloques se reparten en un ProcessPoolExecutor, con como
+    máximo 2 bloques en vuelo por proceso para mantener la memoria acotada. Las
+    decisiones se escriben en el mismo orden que el archivo de entrada.
+
+    Returns:
+        dict: Filas, errores, segundos, filas por segundo y memoria máxima (MB)
+    """
+    formato_entrada = _formato(entrada, formato_entrada)
+    formato_salida = _formato(salida, formato_salida)
+    inicio = time.perf_counter()
+
+    with open(salida, 'w', newline='', encoding='utf-8') as archivo:
+        escritor = EscritorDecisiones(archivo, formato_salida)
+        bloques = leer_bloques(leer_solicitudes(entrada, formato_entrada), tamano_bloque)
+
+        if procesos <= 1:
+            for bloque in bloques:
+                escritor.escribir(evaluar_bloque(bloque))
+        else:
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                en_vuelo = deque()
+                for bloque in bloques:
+                    en_vuelo.append(pool.submit(evaluar_bloque, bloque))
+                    if len(en_vuelo) >= 2 * procesos:
+                        escritor.escribir(en_vuelo.popleft().result())
+                while en_vuelo:
+                    escritor.escribir(en_vuelo.popleft().result())
+
+    segundos = time.perf_counter() - inicio
+    # ru_maxrss está en KB en Linux
+    memoria_propia = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    memoria_hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {
+        'filas': escritor.filas,
+        'errores': escritor.errores,
+        'segundos': round(segundos, 3),
+        'filas_por_segundo': round(escritor.filas / segundos, 1) if segundos > 0 else 0.0,
+        'memoria_maxima_mb': round(memoria_propia, 1),
+        'memoria_maxima_proceso_hijo_mb': round(memoria_hijos, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reevalúa una cartera de solicitudes (CSV o NDJSON)')
+    parser.add_argument('entrada', help='Archivo de solicitudes (.csv o .ndjson)')
+    parser.add_argument('salida', help='Archivo de decisiones (.csv o .ndjson)')
+    parser.add_argument('--bloque', type=int, default=2000, help='Solicitudes por bloque (default 2000)')
+    parser.add_argument('--procesos', type=int, default=1,
+                        help=f'Procesos del pool (default 1; esta máquina tiene {os.cpu_count()})')
+    parser.add_argument('--formato-entrada', choices=['csv', 'ndjson'])
+    parser.add_argument('--formato-salida', choices=['csv', 'ndjson'])
+    args = parser.parse_args(argv)
+
+    resumen = evaluar_cartera(args.entrada, args.salida, args.bloque, args.procesos,
+                              args.formato_entrada, args.formato_salida)
+    print(f"Filas: {resumen['filas']} ({resumen['errores']} con error)", file=sys.stderr)
+    print(f"Tiempo: {resumen['segundos']} s - {resumen['filas_por_segundo']} filas/s", file=sys.stderr)
+    print(f"Memoria máxima: {resumen['memoria_maxima_mb']} MB "
+          f"(procesos hijos: {resumen['memoria_maxima_proceso_hijo_mb']} MB)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""
+Eventos del tablero por server-sent events (GET /eventos).
+
+Cada decisión que registra app.py (registrar_decision y guardar_decisiones) se
+publica aquí: un evento 'decisiones' con las filas nuevas del historial y las
+estadísticas actualizadas, sumadas en memoria sobre los acumulados de
+resumen_estadisticas (mismos cálculos que los triggers de db_module), así que el
+tablero no vuelve a consultar /historial ni /estadisticas.
+
+Los eventos ya serializados quedan en un búfer circular de CAPACIDAD eventos
+compartido por todos los clientes; cada cliente solo guarda hasta qué evento
+leyó. Publicar cuesta lo mismo con 1 o con 1000 clientes, y la memoria por
+cliente está acotada: el que se atrasa más que CAPACIDAD eventos pierde los
+intermedios y recibe un 'resincronizar' con las estadísticas vigentes (el
+tablero vuelve a pedir /historial una vez). Sin clientes no se hace nada.
+
+Los eventos son de cada proceso: con varios workers, cada stream trae las
+decisiones de su worker, y las estadísticas se vuelven a leer de la base cada
+RESINCRONIZAR_S para sumar las de los demás.
+
+Configuración:
+    EVENTOS_CAPACIDAD        Eventos en el búfer (atraso máximo por cliente; default 256)
+    EVENTOS_MAX_CLIENTES     Streams simultáneos por proceso (default 1000)
+    EVENTOS_LATIDO_S         Comentario de latido para proxies y desconexiones (default 15)
+    EVENTOS_RESINCRONIZAR_S  Relectura de las estadísticas de la base (default 30)
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from db_module import DECISIONES_RESUMEN, CAMPOS_PROMEDIO, formatear_acumulados, leer_acumulados
+
+CAPACIDAD = int(os.environ.get('EVENTOS_CAPACIDAD', 256))
+MAX_CLIENTES = int(os.environ.get('EVENTOS_MAX_CLIENTES', 1000))
+LATIDO_S = float(os.environ.get('EVENTOS_LATIDO_S', 15))
+RESINCRONIZAR_S = float(os.environ.get('EVENTOS_RESINCRONIZAR_S', 30))
+
+# Filas por evento: un lote grande de /predict/batch manda solo las últimas
+FILAS_POR_EVENTO = 50
+
+# Columnas de las filas del historial que viajan en cada evento (como /historial, sin id)
+CAMPOS_FILA = ['fecha', 'nombre', 'monto', 'credit_worthiness', 'dti', 'ltv', 'score_cliente',
+               'riesgo_difuso', 'probabilidad', 'score_final', 'decision', 'macro_version']
+
+# Reintento de EventSource tras un corte (ms)
+REINTENTO_MS = 3000
+
+_COLUMNA_DECISION = {decision: columna for columna, decision in DECISIONES_RESUMEN.items()}
+
+
+class Suscripcion:
+    """Un cliente del stream: hasta qué evento leyó y qué le queda por enviar"""
+
+    __slots__ = ('secuencia', 'iniciales')
+
+    def __init__(self, secuencia, iniciales):
+        self.secuencia = secuencia
+        self.iniciales = iniciales
+
+
+class DifusorEventos:
+    """
+    Publica decisiones a todos los streams abiertos del proceso.
+
+    `columnas` son los nombres de los valores de cada fila publicada (en el orden
+    de INSERT_SOLICITUD) y `formatear(resumen)` arma las estadísticas tal como
+    las devuelve /estadisticas.
+    """
+
+    def __init__(self, columnas, formatear, capacidad=CAPACIDAD, max_clientes=MAX_CLIENTES,
+                 latido_s=LATIDO_S, resincronizar_s=RESINCRONIZAR_S):
+        self.columnas = list(columnas)
+        self.formatear = formatear
+        self.max_clientes = max_clientes
+        self.latido = latido_s
+        self.resincronizar_s = resincronizar_s
+        self._eventos = deque(maxlen=capacidad)  # (secuencia, bytes)
+        self._secuencia = 0
+        self._condicion = threading.Condition()
+        self._loops = {}  # event loop -> asyncio.Event que se reemplaza en cada publicación
+        self._acumulados = None
+        self._leidos = 0.0
+        self._pid = None
+        self._proceso = None
+        self.clientes = 0
+        self.contadores = {'conexiones': 0, 'rechazadas': 0, 'publicados': 0, 'decisiones': 0,
+                           'desbordes': 0, 'reanudaciones': 0, 'resincronizaciones': 0}
+
+    # ============ SERIALIZACIÓN ============
+
+    def _id(self, secuencia):
+        # El id lleva el proceso: Last-Event-ID de otro worker (o de antes de un
+        # reinicio) no se confunde con una secuencia de este
+        return f'{self._proceso}-{secuencia}'
+
+    def _serializar(self, tipo, datos, secuencia=None):
+        lineas = [] if secuencia is None else [f'id: {self._id(secuencia)}']
+        lineas += [f'event: {tipo}', f'data: {json.dumps(datos, ensure_ascii=False, default=str)}', '', '']
+        return '\n'.join(lineas).encode('utf-8')
+
+    def _estadisticas(self):
+        return self.formatear(formatear_acumulados(self._acumulados))
+
+    def _cargar_acumulados(self):
+        """Lee los acumulados de la base (con el lock tomado)"""
+        self._leidos = time.monotonic()
+        self._acumulados = leer_acumulados()
+
+    def _agregar(self, tipo, datos):
+        """Guarda un evento en el búfer y despierta a los clientes (con el lock tomado)"""
+        self._secuencia += 1
+        self._eventos.append((self._secuencia, self._serializar(tipo, datos, self._secuencia)))
+        self.contadores['publicados'] += 1
+        self._condicion.notify_all()
+        for loop in list(self._loops):
+            try:
+                loop.call_soon_threadsafe(self._despertar, loop)
+            except RuntimeError:  # Loop cerrado
+                del self._loops[loop]
+
+    def _despertar(self, loop):
+        # Corre en el loop: los que esperaban el evento anterior se despiertan y
+        # los siguientes esperan uno nuevo
+        anterior = self._loops.get(loop)
+        self._loops[loop] = asyncio.Event()
+        if anterior is not None:
+            anterior.set()
+
+    # ============ PUBLICACIÓN (EN EL HILO DE LA SOLICITUD) ============
+
+    def publicar(self, filas):
+        """
+        Publica decisiones ya encoladas para SQLite.
+
+        Args:
+            filas: Valores de INSERT_SOLICITUD por decisión (orden de `columnas`)
+        """
+        if not self.clientes or not filas:
+            return
+        registros = [dict(zip(self.columnas, fila)) for fila in filas]
+        with self._condicion:
+            if self._acumulados is None:
+                return
+            acumulados = self._acumulados
+            for registro in registros:
+                acumulados['total'] += 1
+                columna = _COLUMNA_DECISION.get(registro['decision'])
+                if columna is not None:
+                    acumulados[columna] += 1
+                for campo in CAMPOS_PROMEDIO:
+                    if registro.get(campo) is not None:
+                        acumulados[f'suma_{campo}'] += registro[campo]
+                        acumulados[f'n_{campo}'] += 1
+            self.contadores['decisiones'] += len(registros)
+            self._agregar('decisiones', {
+                'decisiones': [{campo: registro.get(campo) for campo in CAMPOS_FILA}
+                               for registro in reversed(registros[-FILAS_POR_EVENTO:])],
+                'cantidad': len(registros),
+                'estadisticas': self._estadisticas(),
+            })
+
+    def resincronizar(self, forzar=False):
+        """
+        Vuelve a leer las estadísticas de la base si pasaron RESINCRONIZAR_S (suma las
+        decisiones de otros workers) y las publica si cambiaron. La llaman los
+        streams en cada latido; solo uno por vez lee la base.
+        """
+        with self._condicion:
+            if not self.clientes or (not forzar and time.monotonic() - self._leidos < self.resincronizar_s):
+                return
+            self._leidos = time.monotonic()
+        # La lectura va fuera del lock para no demorar a quienes publican
+        acumulados = leer_acumulados()
+        with self._condicion:
+            if self._acumulados is None or acumulados == self._acumulados:
+                return
+            self._acumulados = acumulados
+            self.contadores['resincronizaciones'] += 1
+            self._agregar('estadisticas', self._estadisticas())
+
+    # ============ SUSCRIPCIÓN ============
+
+    def suscribir(self, ultimo_id=None, max_clientes=None):
+        """
+        Registra un cliente, o None si ya hay max_clientes (el del difusor si no se indica).
+
+        Con `ultimo_id` (encabezado Last-Event-ID de un EventSource que se
+        reconecta) se reenvían los eventos perdidos si siguen en el búfer; si no,
+        el primer evento es 'resincronizar'. Sin él, el primero es 'estadisticas'.
+        """
+        with self._condicion:
+            if self.clientes >= min(self.max_clientes, max_clientes or self.max_clientes):
+                self.contadores['rechazadas'] += 1
+                return None
+            if self._pid != os.getpid():
+                # Tras un fork el búfer y los loops del padre no sirven
+                self._pid = os.getpid()
+                self._proceso = uuid.uuid4().hex[:8]
+                self._eventos.clear()
+                self._loops.clear()
+                self._acumulados = None
+            if self._acumulados is None or not self.clientes:
+                self._cargar_acumulados()
+            self.clientes += 1
+            self.contadores['conexiones'] += 1
+
+            reanudar = self._secuencia_de(ultimo_id)
+            if reanudar is not None and (not self._eventos or reanudar + 1 >= self._eventos[0][0]):
+                self.contadores['reanudaciones'] += 1
+                return Suscripcion(reanudar, [])
+            tipo = 'resincronizar' if ultimo_id else 'estadisticas'
+            datos = {'estadisticas': self._estadisticas()} if ultimo_id else self._estadisticas()
+            inicial = f'retry: {REINTENTO_MS}\n\n'.encode() + self._serializar(tipo, datos, self._secuencia)
+            return Suscripcion(self._secuencia, [inicial])
+
+    def _secuencia_de(self, ultimo_id):
+        proceso, _, secuencia = (ultimo_id or '').rpartition('-')
+        if proceso != self._proceso or not secuencia.isdigit() or int(secuencia) > self._secuencia:
+            return None
+        return int(secuencia)
+
+    def cancelar(self, suscripcion):
+        with self._condicion:
+            self.clientes -= 1
+            if not self.clientes:
+                # Sin clientes no se publica: al volver alguno se leen de nuevo
+                self._acumulados = None
+
+    def pendientes(self, suscripcion):
+        """Eventos que el cliente todavía no recibió (lista de bytes)"""
+        with self._condicion:
+            salida, suscripcion.iniciales = suscripcion.iniciales, []
+            if self._secuencia == suscripcion.secuencia:
+                return salida
+            primero = self._eventos[0][0] if self._eventos else self._secuencia + 1
+            if suscripcion.secuencia + 1 < primero:
+                # Se atrasó más que el búfer: se salta al presente
+                self.contadores['desbordes'] += 1
+                salida.append(self._serializar('resincronizar', {'estadisticas': self._estadisticas()},
+                                               self._secuencia))
+            else:
+                salida.extend(evento for _, evento in
+                              itertools.islice(self._eventos, suscripcion.secuencia + 1 - primero, None))
+            suscripcion.secuencia = self._secuencia
+            return salida
+
+    # ============ STREAMS ============
+
+    def iterar(self, suscripcion):
+        """Stream para un servidor WSGI con hilos: bytes a enviar, con latidos"""
+        try:
+            while True:
+                salida = self.pendientes(suscripcion)
+                if salida:
+                    yield b''.join(salida)
+                    continue
+                with self._condicion:
+                    nuevos = self._condicion.wait_for(lambda: self._secuencia != suscripcion.secuencia,
+                                                      self.latido)
+                if not nuevos:
+                    self.resincronizar()
+                    yield b': latido\n\n'
+        finally:
+            self.cancelar(suscripcion)
+
+    async def siguiente_async(self, suscripcion):
+        """
+        Próximo fragmento del stream para ASGI (eventos o latido), esperando en el
+        event loop sin ocupar un hilo por cliente. Quien llama debe cancelar la
+        suscripción al desconectarse el cliente.
+        """
+        loop = asyncio.get_running_loop()
+        limite = loop.time() + self.latido
+        while True:
+            # El evento del loop se toma antes de mirar el búfer: una publicación
+            # posterior lo despierta
+            evento = self._loops.get(loop)
+            if evento is None:
+                evento = self._loops.setdefault(loop, asyncio.Event())
+            salida = self.pendientes(suscripcion)
+            if salida:
+                return b''.join(salida)
+            try:
+                await asyncio.wait_for(evento.wait(), max(limite - loop.time(), 0))
+            except asyncio.TimeoutError:
+                await loop.run_in_executor(None, self.resincronizar)
+                return b': latido\n\n'
+
+    def estadisticas(self):
+        """Contadores de este proceso"""
+        return dict(self.contadores, clientes=self.clientes, en_bufer=len(self._eventos))
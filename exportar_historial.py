@@ -0,0 +1,66 @@
+"""
+Exportación columnar del historial y consultas sobre ella (ver analitica_module).
+
+exportar agrega las solicitudes nuevas desde la última exportación (pensado para
+correr periódicamente, p. ej. desde cron); tasas y distribucion leen solo la
+exportación. Los resultados se imprimen como JSON.
+
+Uso:
+    python exportar_historial.py exportar --destino analitica/
+    python exportar_historial.py compactar --destino analitica/
+    python exportar_historial.py tasas --desde 2025-12-01 --hasta 2025-12-31 --por-dia
+    python exportar_historial.py distribucion --columna score_final --decision APROBADO --bins 10
+"""
+import argparse
+import json
+import sys
+import time
+
+from analitica_module import RUTA_ANALITICA, BLOQUE_FILAS, ConsultaColumnar, compactar, exportar
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    p_exportar = subparsers.add_parser('exportar', help='Exporta las solicitudes nuevas')
+    p_exportar.add_argument('--db', help='Base a exportar (default HISTORIAL_DB o historial.db)')
+    p_exportar.add_argument('--bloque', type=int, default=BLOQUE_FILAS, help='Filas por consulta a SQLite')
+    p_exportar.add_argument('--sin-compactar', action='store_true', help='No juntar las partes de cada día')
+
+    subparsers.add_parser('compactar', help='Junta las partes de cada día en una sola')
+
+    p_tasas = subparsers.add_parser('tasas', help='Tasas de decisión')
+    p_tasas.add_argument('--por-dia', action='store_true')
+
+    p_distribucion = subparsers.add_parser('distribucion', help='Histograma y percentiles de una columna')
+    p_distribucion.add_argument('--columna', default='score_final')
+    p_distribucion.add_argument('--bins', type=int, default=20)
+    p_distribucion.add_argument('--rango', type=float, nargs=2, metavar=('MIN', 'MAX'))
+    p_distribucion.add_argument('--decision', help='Solo filas con esta decisión (p. ej. APROBADO)')
+
+    for sub in (p_tasas, p_distribucion):
+        sub.add_argument('--desde', help='Primer día (YYYY-MM-DD)')
+        sub.add_argument('--hasta', help='Último día (YYYY-MM-DD), inclusive')
+    for sub in subparsers.choices.values():
+        sub.add_argument('--destino', default=RUTA_ANALITICA, help='Directorio de la exportación')
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    if args.comando == 'exportar':
+        resultado = exportar(args.destino, args.db, args.bloque, compactar_dias=not args.sin_compactar)
+    elif args.comando == 'compactar':
+        resultado = {'dias_compactados': compactar(args.destino)}
+    elif args.comando == 'tasas':
+        resultado = ConsultaColumnar(args.destino).tasas_decision(args.desde, args.hasta, por_dia=args.por_dia)
+    else:
+        resultado = ConsultaColumnar(args.destino).distribucion(
+            args.columna, args.bins, tuple(args.rango) if args.rango else None,
+            args.desde, args.hasta, args.decision)
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+    print(f'{args.comando}: {time.perf_counter() - inicio:.2f} s', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Codificación de una solicitud en el vector de 32 features del Random Forest.
+
+El esquema (nombre y posición de cada columna) se arma una sola vez a partir de
+los mapeos categóricos; cada solicitud se escribe directamente en una fila float64
+ya reservada (o en filas de una matriz para lotes): se copia la fila base de su
+combinación de categóricas (códigos y one-hot) y se escriben las 9 numéricas.
+Si un mapeo no entra en su bloque one-hot o el esquema no suma exactamente el
+número de features del modelo, falla al construirse en lugar de truncar columnas.
+"""
+import threading
+
+import numpy as np
+
+# Features numéricas en el orden del modelo: (campo de la solicitud, conversión).
+# term se convierte con int() como en el entrenamiento.
+COLUMNAS_NUMERICAS = [
+    ('income', float),
+    ('loan_amount', float),
+    ('term', int),
+    ('inflacion', float),
+    ('combustible', float),
+    ('protestas', float),
+    ('covid', float),
+    ('desempleo', float),
+    ('clima', float),
+]
+
+# Categóricas: (campo de la solicitud, clave en mappings, columnas del bloque one-hot).
+# El tamaño de cada bloque lo fija el modelo entrenado, no el número de valores.
+CATEGORICAS = [
+    ('gender', 'Gender', 3),
+    ('age', 'age', 7),
+    ('region', 'Region', 4),
+    ('credit_type', 'credit_type', 3),
+]
+
+# Features que espera el Random Forest (las últimas quedan en 0)
+N_FEATURES = 32
+
+
+class CodificadorFeatures:
+    """
+    Esquema de features y escritura de solicitudes en filas preasignadas.
+
+    Layout: códigos de las categóricas (0-3), numéricas (4-12), bloques one-hot
+    (gender 13-15, age 16-22, region 23-26, credit_type 27-29) y relleno en 0.
+    """
+
+    def __init__(self, mappings, n_features=N_FEATURES):
+        self.mappings = mappings
+        self.n_features = n_features
+        self.campos_categoricos = [campo for campo, _, _ in CATEGORICAS]
+        self.campos_numericos = [campo for campo, _ in COLUMNAS_NUMERICAS]
+        self._conversiones = [conversion for _, conversion in COLUMNAS_NUMERICAS]
+        self._tablas = [mappings[clave] for _, clave, _ in CATEGORICAS]
+
+        nombres = list(self.campos_categoricos) + list(self.campos_numericos)
+        inicios = []
+        for campo, clave, tamano in CATEGORICAS:
+            codigos = mappings[clave]
+            if max(codigos.values()) >= tamano or min(codigos.values()) < 0:
+                raise ValueError(f'Los códigos de {clave} no entran en su bloque one-hot de {tamano} columnas')
+            por_codigo = {codigo: valor for valor, codigo in codigos.items()}
+            inicios.append(len(nombres))
+            nombres.extend(f'{campo}={por_codigo.get(codigo, f"sin_uso_{codigo}")}' for codigo in range(tamano))
+        if len(nombres) > n_features:
+            raise ValueError(f'El esquema tiene {len(nombres)} columnas y el modelo espera {n_features}')
+        nombres.extend(f'relleno_{i}' for i in range(len(nombres), n_features))
+
+        self.nombres = nombres
+        self.esquema = {nombre: posicion for posicion, nombre in enumerate(nombres)}
+        self.inicios_onehot = np.array(inicios, dtype=np.intp)
+        self._inicio_numericas = len(self.campos_categoricos)
+        self._fin_numericas = self._inicio_numericas + len(self.campos_numericos)
+        self._local = threading.local()
+        # Fila base (códigos + one-hot, numéricas en 0) por combinación de categóricas
+        self._plantillas = {}
+
+    def codigos(self, data):
+        """
+        Códigos de las categóricas de `data`. Lanza KeyError (campo faltante o
+        valor fuera del mapeo) antes de escribir nada.
+        """
+        return tuple(tabla[data[campo]] for campo, tabla in zip(self.campos_categoricos, self._tablas))
+
+    def plantilla(self, codigos):
+        """Fila con los códigos y el one-hot de `codigos` ya escritos (se guarda por combinación)"""
+        plantilla = self._plantillas.get(codigos)
+        if plantilla is None:
+            plantilla = np.zeros(self.n_features)
+            plantilla[:self._inicio_numericas] = codigos
+            plantilla[self.inicios_onehot + codigos] = 1.0
+            plantilla.flags.writeable = False
+            self._plantillas[codigos] = plantilla
+        return plantilla
+
+    def fila(self):
+        """Fila (1, n_features) reservada por hilo que reutiliza codificar()"""
+        fila = getattr(self._local, 'fila', None)
+        if fila is None:
+            fila = self._local.fila = np.zeros((1, self.n_features))
+        return fila
+
+    def codificar(self, data, destino=None):
+        """
+        Escribe la solicitud en `destino` (vector de n_features) o en la fila del
+        hilo, que se sobrescribe en la siguiente llamada del mismo hilo.
+
+        Returns:
+            np.ndarray: La fila escrita, shape (1, n_features) si no se pasó destino
+        """
+        codigos = self.codigos(data)
+        numericos = [conversion(data[campo]) for campo, conversion in
+                     zip(self.campos_numericos, self._conversiones)]
+        fila = self.fila() if destino is None else destino
+        vector = fila.reshape(-1)
+        np.copyto(vector, self.plantilla(codigos))
+        vector[self._inicio_numericas:self._fin_numericas] = numericos
+        return fila
+
+    def codificar_lote(self, codigos, numericos, destino=None):
+        """
+        Matriz de features para un lote.
+
+        Args:
+            codigos: (m, 4) códigos de las categóricas, en el orden de CATEGORICAS
+            numericos: (m, 9) valores en el orden de COLUMNAS_NUMERICAS
+            destino: Matriz (m, n_features) a reutilizar; si no, se crea una
+
+        Returns:
+            np.ndarray: (m, n_features)
+        """
+        codigos = np.asarray(codigos, dtype=np.intp)
+        m = len(codigos)
+        if destino is None:
+            destino = np.zeros((m, self.n_features))
+        else:
+            destino[:] = 0.0
+        destino[:, :self._inicio_numericas] = codigos
+        destino[:, self._inicio_numericas:self._fin_numericas] = numericos
+        destino[np.arange(m)[:, None], self.inicios_onehot + codigos] = 1.0
+        return destino
@@ -1,190 +1,795 @@
+import os
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import skfuzzy as fuzz
 from skfuzzy import control as ctrl
 
-def calcular_riesgo_difuso(inflacion, combustible, protestas, desempleo, covid, clima):
-    """
-    Calcula el riesgo externo usando lógica difusa con valores REALISTAS.
-    
-    Returns:
-        float: Riesgo externo en escala 0-10
-    """
-    
-    # Definir variables de entrada con rangos REALISTAS
-    inflacion_var = ctrl.Antecedent(np.arange(0, 101, 1), 'inflacion')  # 0-100% (máximo realista)
-    combustible_var = ctrl.Antecedent(np.arange(0, 8.1, 0.1), 'combustible')  # $0-8 (crisis extrema)
-    protestas_var = ctrl.Antecedent(np.arange(0, 5001, 1), 'protestas')  # 0-5000 (más realista)
-    desempleo_var = ctrl.Antecedent(np.arange(0, 25.1, 0.1), 'desempleo')  # 0-25% (depresión)
-    covid_var = ctrl.Antecedent(np.arange(0, 10001, 1), 'covid')  # 0-10000 (pico pandemia)
-    clima_var = ctrl.Antecedent(np.arange(-10, 41, 1), 'clima')  # -10 a 40°C
-    
-    # Variable de salida
-    riesgo = ctrl.Consequent(np.arange(0, 10.1, 0.1), 'riesgo')
-    
+# Simulaciones de skfuzzy que se construyen al precalentar: una por hilo que atiende
+# solicitudes (DIFUSO_SIMULACIONES, o GUNICORN_HILOS de gunicorn.conf.py)
+SIMULACIONES = int(os.environ.get('DIFUSO_SIMULACIONES', os.environ.get('GUNICORN_HILOS', 4)))
+
+# ============ DEFINICIÓN DEL SISTEMA DIFUSO ============
+# Universos como argumentos de np.arange (inicio, fin, paso) y funciones de
+# pertenencia como (tipo, parámetros). Se comparten entre el motor skfuzzy y
+# cualquier otra implementación del mismo sistema.
+
+VARIABLES = {
+    'inflacion': (0, 101, 1),  # 0-100% (máximo realista)
+    'combustible': (0, 8.1, 0.1),  # $0-8 (crisis extrema)
+    'protestas': (0, 5001, 1),  # 0-5000 (más realista)
+    'desempleo': (0, 25.1, 0.1),  # 0-25% (depresión)
+    'covid': (0, 10001, 1),  # 0-10000 (pico pandemia)
+    'clima': (-10, 41, 1),  # -10 a 40°C
+}
+
+# Variable de salida
+SALIDA = ('riesgo', (0, 10.1, 0.1))
+
+TERMINOS = {
     # INFLACIÓN (0-100%) - AJUSTADA A VALORES REALISTAS
     # Baja: 0-4% (óptimo)
     # Media: 3-10% (tolerable)
     # Alta: 8-25% (preocupante)
     # Muy Alta: 20-100% (crisis)
-    inflacion_var['baja'] = fuzz.trapmf(inflacion_var.universe, [0, 0, 2, 5])
-    inflacion_var['media'] = fuzz.trimf(inflacion_var.universe, [3, 6, 12])
-    inflacion_var['alta'] = fuzz.trimf(inflacion_var.universe, [10, 18, 30])
-    inflacion_var['muy_alta'] = fuzz.trapmf(inflacion_var.universe, [25, 50, 100, 100])
-    
+    'inflacion': {
+        'baja': ('trap', [0, 0, 2, 5]),
+        'media': ('tri', [3, 6, 12]),
+        'alta': ('tri', [10, 18, 30]),
+        'muy_alta': ('trap', [25, 50, 100, 100]),
+    },
+
     # COMBUSTIBLE ($0-8) - MAYOR PESO EN DECISIONES
     # Bajo: $0-2.5 (económico)
     # Medio: $2-4 (normal)
     # Alto: $3.5-5.5 (caro)
     # Muy Alto: $5-8 (crisis energética)
-    combustible_var['bajo'] = fuzz.trapmf(combustible_var.universe, [0, 0, 1.5, 2.5])
-    combustible_var['medio'] = fuzz.trimf(combustible_var.universe, [2, 3, 4])
-    combustible_var['alto'] = fuzz.trimf(combustible_var.universe, [3.5, 4.5, 5.5])
-    combustible_var['muy_alto'] = fuzz.trapmf(combustible_var.universe, [5, 6.5, 8, 8])
-    
+    'combustible': {
+        'bajo': ('trap', [0, 0, 1.5, 2.5]),
+        'medio': ('tri', [2, 3, 4]),
+        'alto': ('tri', [3.5, 4.5, 5.5]),
+        'muy_alto': ('trap', [5, 6.5, 8, 8]),
+    },
+
     # PROTESTAS (0-5000) - AJUSTADO
     # Bajas: 0-500 (tranquilo)
     # Medias: 400-1500 (moderado)
     # Altas: 1200-3000 (preocupante)
     # Muy Altas: 2500-5000 (crisis social)
-    protestas_var['bajas'] = fuzz.trapmf(protestas_var.universe, [0, 0, 300, 600])
-    protestas_var['medias'] = fuzz.trimf(protestas_var.universe, [400, 900, 1600])
-    protestas_var['altas'] = fuzz.trimf(protestas_var.universe, [1200, 2000, 3200])
-    protestas_var['muy_altas'] = fuzz.trapmf(protestas_var.universe, [2500, 3500, 5000, 5000])
-    
+    'protestas': {
+        'bajas': ('trap', [0, 0, 300, 600]),
+        'medias': ('tri', [400, 900, 1600]),
+        'altas': ('tri', [1200, 2000, 3200]),
+        'muy_altas': ('trap', [2500, 3500, 5000, 5000]),
+    },
+
     # DESEMPLEO (0-25%) - CRÍTICO
     # Bajo: 0-5% (pleno empleo)
     # Medio: 4-8% (normal)
     # Alto: 7-15% (recesión)
     # Muy Alto: 12-25% (depresión)
-    desempleo_var['bajo'] = fuzz.trapmf(desempleo_var.universe, [0, 0, 3, 5.5])
-    desempleo_var['medio'] = fuzz.trimf(desempleo_var.universe, [4, 6, 9])
-    desempleo_var['alto'] = fuzz.trimf(desempleo_var.universe, [7, 11, 16])
-    desempleo_var['muy_alto'] = fuzz.trapmf(desempleo_var.universe, [12, 18, 25, 25])
-    
+    'desempleo': {
+        'bajo': ('trap', [0, 0, 3, 5.5]),
+        'medio': ('tri', [4, 6, 9]),
+        'alto': ('tri', [7, 11, 16]),
+        'muy_alto': ('trap', [12, 18, 25, 25]),
+    },
+
     # COVID (0-10000) - AJUSTADO
     # Bajo: 0-1000 (controlado)
     # Medio: 800-3000 (moderado)
     # Alto: 2500-6000 (ola fuerte)
     # Muy Alto: 5000-10000 (colapso sanitario)
-    covid_var['bajo'] = fuzz.trapmf(covid_var.universe, [0, 0, 600, 1200])
-    covid_var['medio'] = fuzz.trimf(covid_var.universe, [800, 1800, 3500])
-    covid_var['alto'] = fuzz.trimf(covid_var.universe, [2500, 4000, 6500])
-    covid_var['muy_alto'] = fuzz.trapmf(covid_var.universe, [5000, 7500, 10000, 10000])
-    
+    'covid': {
+        'bajo': ('trap', [0, 0, 600, 1200]),
+        'medio': ('tri', [800, 1800, 3500]),
+        'alto': ('tri', [2500, 4000, 6500]),
+        'muy_alto': ('trap', [5000, 7500, 10000, 10000]),
+    },
+
     # CLIMA - Sin cambios (menos crítico)
-    clima_var['extremo_frio'] = fuzz.trapmf(clima_var.universe, [-10, -10, 2, 8])
-    clima_var['normal'] = fuzz.trapmf(clima_var.universe, [5, 15, 25, 32])
-    clima_var['extremo_calor'] = fuzz.trapmf(clima_var.universe, [28, 35, 40, 40])
-    
+    'clima': {
+        'extremo_frio': ('trap', [-10, -10, 2, 8]),
+        'normal': ('trap', [5, 15, 25, 32]),
+        'extremo_calor': ('trap', [28, 35, 40, 40]),
+    },
+
     # RIESGO (salida) - REDEFINIDO
-    riesgo['muy_bajo'] = fuzz.trapmf(riesgo.universe, [0, 0, 1, 2.5])
-    riesgo['bajo'] = fuzz.trimf(riesgo.universe, [1.5, 3, 4.5])
-    riesgo['medio'] = fuzz.trimf(riesgo.universe, [3.5, 5, 6.5])
-    riesgo['alto'] = fuzz.trimf(riesgo.universe, [5.5, 7, 8.5])
-    riesgo['muy_alto'] = fuzz.trapmf(riesgo.universe, [7.5, 9, 10, 10])
-    
-    # REGLAS DIFUSAS JERARQUIZADAS (Más realistas y sensibles)
-    rules = [
-        # ============ REGLAS CRÍTICAS (Riesgo MUY ALTO) ============
-        # Crisis económica completa
-        ctrl.Rule(inflacion_var['muy_alta'] | desempleo_var['muy_alto'], riesgo['muy_alto']),
-        ctrl.Rule(protestas_var['muy_altas'], riesgo['muy_alto']),
-        ctrl.Rule(covid_var['muy_alto'], riesgo['muy_alto']),
-        
-        # Estanflación (inflación + desempleo altos)
-        ctrl.Rule(inflacion_var['alta'] & desempleo_var['alto'], riesgo['muy_alto']),
-        
-        # Crisis energética + económica
-        ctrl.Rule(combustible_var['muy_alto'] & inflacion_var['alta'], riesgo['muy_alto']),
-        ctrl.Rule(combustible_var['muy_alto'] & desempleo_var['alto'], riesgo['muy_alto']),
-        
-        # Combinaciones múltiples
-        ctrl.Rule(inflacion_var['alta'] & protestas_var['altas'], riesgo['muy_alto']),
-        ctrl.Rule(covid_var['alto'] & protestas_var['muy_altas'], riesgo['muy_alto']),
-        
-        # ============ REGLAS ALTO RIESGO ============
-        ctrl.Rule(inflacion_var['alta'] & combustible_var['alto'], riesgo['alto']),
-        ctrl.Rule(desempleo_var['alto'] & protestas_var['altas'], riesgo['alto']),
-        ctrl.Rule(covid_var['alto'] & desempleo_var['medio'], riesgo['alto']),
-        ctrl.Rule(combustible_var['alto'] & protestas_var['altas'], riesgo['alto']),
-        ctrl.Rule(inflacion_var['media'] & desempleo_var['alto'], riesgo['alto']),
-        
-        # Combustible tiene PESO IMPORTANTE
-        ctrl.Rule(combustible_var['muy_alto'], riesgo['alto']),
-        
-        # ============ REGLAS RIESGO MEDIO ============
-        ctrl.Rule(inflacion_var['media'] & desempleo_var['medio'], riesgo['medio']),
-        ctrl.Rule(combustible_var['medio'] & protestas_var['medias'], riesgo['medio']),
-        ctrl.Rule(covid_var['medio'] & desempleo_var['medio'], riesgo['medio']),
-        ctrl.Rule(inflacion_var['baja'] & protestas_var['altas'], riesgo['medio']),
-        ctrl.Rule(clima_var['extremo_frio'] | clima_var['extremo_calor'], riesgo['medio']),
-        ctrl.Rule(combustible_var['alto'] & inflacion_var['baja'], riesgo['medio']),
-        
-        # ============ REGLAS BAJO RIESGO ============
-        ctrl.Rule(inflacion_var['baja'] & desempleo_var['bajo'] & protestas_var['bajas'], riesgo['bajo']),
-        ctrl.Rule(inflacion_var['baja'] & covid_var['bajo'] & combustible_var['bajo'], riesgo['bajo']),
-        ctrl.Rule(desempleo_var['bajo'] & protestas_var['bajas'] & clima_var['normal'], riesgo['muy_bajo']),
-        ctrl.Rule(combustible_var['bajo'] & inflacion_var['baja'] & desempleo_var['bajo'], riesgo['muy_bajo']),
-    ]
-    
-    # Sistema de control
-    sistema_ctrl = ctrl.ControlSystem(rules)
-    sistema = ctrl.ControlSystemSimulation(sistema_ctrl)
-    
-    # Asignar valores de entrada
-    sistema.input['inflacion'] = min(inflacion, 100)  # Limitar a 100%
-    sistema.input['combustible'] = min(combustible, 8)  # Limitar a $8
-    sistema.input['protestas'] = min(protestas, 5000)  # Limitar a 5000
-    sistema.input['desempleo'] = min(desempleo, 25)  # Limitar a 25%
-    sistema.input['covid'] = min(covid, 10000)  # Limitar a 10000
-    sistema.input['clima'] = max(-10, min(clima, 40))  # Limitar -10 a 40
-    
-    # Calcular
-    sistema.compute()
-    
-    riesgo_calculado = sistema.output['riesgo']
-    
-    # ============ AJUSTES CRÍTICOS POST-CÁLCULO ============
+    'riesgo': {
+        'muy_bajo': ('trap', [0, 0, 1, 2.5]),
+        'bajo': ('tri', [1.5, 3, 4.5]),
+        'medio': ('tri', [3.5, 5, 6.5]),
+        'alto': ('tri', [5.5, 7, 8.5]),
+        'muy_alto': ('trap', [7.5, 9, 10, 10]),
+    },
+}
+
+# REGLAS DIFUSAS JERARQUIZADAS (Más realistas y sensibles)
+# Cada regla: (operador, [(variable, término), ...], término de riesgo).
+# El operador 'y' combina con mínimo y 'o' con máximo.
+REGLAS = [
+    # ============ REGLAS CRÍTICAS (Riesgo MUY ALTO) ============
+    # Crisis económica completa
+    ('o', [('inflacion', 'muy_alta'), ('desempleo', 'muy_alto')], 'muy_alto'),
+    ('y', [('protestas', 'muy_altas')], 'muy_alto'),
+    ('y', [('covid', 'muy_alto')], 'muy_alto'),
+
+    # Estanflación (inflación + desempleo altos)
+    ('y', [('inflacion', 'alta'), ('desempleo', 'alto')], 'muy_alto'),
+
+    # Crisis energética + económica
+    ('y', [('combustible', 'muy_alto'), ('inflacion', 'alta')], 'muy_alto'),
+    ('y', [('combustible', 'muy_alto'), ('desempleo', 'alto')], 'muy_alto'),
+
+    # Combinaciones múltiples
+    ('y', [('inflacion', 'alta'), ('protestas', 'altas')], 'muy_alto'),
+    ('y', [('covid', 'alto'), ('protestas', 'muy_altas')], 'muy_alto'),
+
+    # ============ REGLAS ALTO RIESGO ============
+    ('y', [('inflacion', 'alta'), ('combustible', 'alto')], 'alto'),
+    ('y', [('desempleo', 'alto'), ('protestas', 'altas')], 'alto'),
+    ('y', [('covid', 'alto'), ('desempleo', 'medio')], 'alto'),
+    ('y', [('combustible', 'alto'), ('protestas', 'altas')], 'alto'),
+    ('y', [('inflacion', 'media'), ('desempleo', 'alto')], 'alto'),
+
+    # Combustible tiene PESO IMPORTANTE
+    ('y', [('combustible', 'muy_alto')], 'alto'),
+
+    # ============ REGLAS RIESGO MEDIO ============
+    ('y', [('inflacion', 'media'), ('desempleo', 'medio')], 'medio'),
+    ('y', [('combustible', 'medio'), ('protestas', 'medias')], 'medio'),
+    ('y', [('covid', 'medio'), ('desempleo', 'medio')], 'medio'),
+    ('y', [('inflacion', 'baja'), ('protestas', 'altas')], 'medio'),
+    ('o', [('clima', 'extremo_frio'), ('clima', 'extremo_calor')], 'medio'),
+    ('y', [('combustible', 'alto'), ('inflacion', 'baja')], 'medio'),
+
+    # ============ REGLAS BAJO RIESGO ============
+    ('y', [('inflacion', 'baja'), ('desempleo', 'bajo'), ('protestas', 'bajas')], 'bajo'),
+    ('y', [('inflacion', 'baja'), ('covid', 'bajo'), ('combustible', 'bajo')], 'bajo'),
+    ('y', [('desempleo', 'bajo'), ('protestas', 'bajas'), ('clima', 'normal')], 'muy_bajo'),
+    ('y', [('combustible', 'bajo'), ('inflacion', 'baja'), ('desempleo', 'bajo')], 'muy_bajo'),
+]
+
+
+def _funcion_pertenencia(universo, tipo, parametros):
+    if tipo == 'trap':
+        return fuzz.trapmf(universo, parametros)
+    return fuzz.trimf(universo, parametros)
+
+
+def _limitar_entradas(inflacion, combustible, protestas, desempleo, covid, clima):
+    """Recorta las entradas a los universos del sistema."""
+    return {
+        'inflacion': min(inflacion, 100),  # Limitar a 100%
+        'combustible': min(combustible, 8),  # Limitar a $8
+        'protestas': min(protestas, 5000),  # Limitar a 5000
+        'desempleo': min(desempleo, 25),  # Limitar a 25%
+        'covid': min(covid, 10000),  # Limitar a 10000
+        'clima': max(-10, min(clima, 40)),  # Limitar -10 a 40
+    }
+
+
+def construir_sistema():
+    """
+    Construye el ControlSystem de skfuzzy a partir de VARIABLES, TERMINOS y REGLAS.
+
+    Returns:
+        ctrl.ControlSystem: Sistema listo para crear simulaciones
+    """
+    variables = {}
+    for nombre, rango in VARIABLES.items():
+        variables[nombre] = ctrl.Antecedent(np.arange(*rango), nombre)
+
+    nombre_salida, rango_salida = SALIDA
+    riesgo = ctrl.Consequent(np.arange(*rango_salida), nombre_salida)
+    variables[nombre_salida] = riesgo
+
+    for nombre, terminos in TERMINOS.items():
+        variable = variables[nombre]
+        for termino, (tipo, parametros) in terminos.items():
+            variable[termino] = _funcion_pertenencia(variable.universe, tipo, parametros)
+
+    rules = []
+    for operador, antecedentes, consecuente in REGLAS:
+        condicion = variables[antecedentes[0][0]][antecedentes[0][1]]
+        for nombre, termino in antecedentes[1:]:
+            if operador == 'y':
+                condicion = condicion & variables[nombre][termino]
+            else:
+                condicion = condicion | variables[nombre][termino]
+        rules.append(ctrl.Rule(condicion, riesgo[consecuente]))
+
+    return ctrl.ControlSystem(rules)
+
+
+class MotorDifuso:
+    """
+    Sistema de inferencia difusa compilado una vez y reutilizado entre solicitudes.
+
+    skfuzzy guarda el estado de cada simulación dentro de las propias variables
+    del ControlSystem, así que dos hilos no pueden usar la misma a la vez. El
+    motor guarda un pool de simulaciones ya construidas (cada una con su propio
+    sistema): cada cálculo toma una libre y la devuelve al terminar, y si no hay
+    ninguna libre construye otra, que queda en el pool. precalentar() las
+    construye antes del fork, así los hilos de los workers (gthread, pool del modo
+    ASGI) no pagan la construcción en su primera solicitud. La simulación se crea
+    sin caché para que cada cálculo sea idéntico al de un sistema recién
+    construido.
+    """
+
+    def __init__(self, simulaciones=SIMULACIONES):
+        self.simulaciones = simulaciones
+        self._libres = []
+        self._lock = threading.Lock()
+        # Un fork con el lock tomado por otro hilo lo dejaría tomado para siempre en el hijo
+        os.register_at_fork(after_in_child=self._reiniciar_lock)
+
+    def _reiniciar_lock(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _construir():
+        return ctrl.ControlSystemSimulation(construir_sistema(), cache=False)
+
+    def precalentar(self, cantidad=None):
+        """Construye simulaciones hasta tener `cantidad` libres (default `simulaciones`)"""
+        faltan = (cantidad or self.simulaciones) - len(self._libres)
+        nuevas = [self._construir() for _ in range(faltan)]
+        with self._lock:
+            self._libres.extend(nuevas)
+
+    def libres(self):
+        return len(self._libres)
+
+    def _tomar(self):
+        with self._lock:
+            if self._libres:
+                return self._libres.pop()
+        return self._construir()
+
+    def _devolver(self, sistema):
+        with self._lock:
+            self._libres.append(sistema)
+
+    def evaluar(self, inflacion, combustible, protestas, desempleo, covid, clima):
+        """
+        Ejecuta la inferencia difusa sin los ajustes post-cálculo.
+
+        Returns:
+            float: Riesgo defuzzificado (centroide) en escala 0-10
+        """
+        sistema = self._tomar()
+        try:
+            entradas = _limitar_entradas(inflacion, combustible, protestas, desempleo, covid, clima)
+            for nombre, valor in entradas.items():
+                sistema.input[nombre] = valor
+
+            # Calcular
+            sistema.compute()
+
+            return sistema.output['riesgo']
+        finally:
+            self._devolver(sistema)
+
+
+motor_difuso = MotorDifuso()
+
+
+def calcular_riesgo_difuso(inflacion, combustible, protestas, desempleo, covid, clima):
+    """
+    Calcula el riesgo externo usando lógica difusa con valores REALISTAS.
+
+    Usa el motor compartido `motor_difuso`; el resultado es idéntico al de
+    construir el sistema completo en cada llamada (tolerancia 0).
     
+    Returns:
+        float: Riesgo externo en escala 0-10
+    """
+    riesgo_calculado = motor_difuso.evaluar(inflacion, combustible, protestas,
+                                            desempleo, covid, clima)
+    return ajustar_riesgo(riesgo_calculado, inflacion, combustible, protestas,
+                          desempleo, covid, clima)
+
+
+# ============ AJUSTES CRÍTICOS POST-CÁLCULO ============
+# (nombre, condición sobre las entradas sin recortar, tipo, valor), en orden de
+# aplicación. 'piso' sube el riesgo hasta `valor`; 'fijo' lo reemplaza. Las
+# condiciones sirven igual para escalares y para arreglos de NumPy.
+AJUSTES = [
     # Inflación muy alta (>50%) = Crisis automática
-    if inflacion > 50:
-        riesgo_calculado = max(riesgo_calculado, 9.0)
-    elif inflacion > 30:
-        riesgo_calculado = max(riesgo_calculado, 7.5)
-    elif inflacion > 15:
-        riesgo_calculado = max(riesgo_calculado, 6.0)
-    
+    ('inflacion_mayor_50', lambda e: e['inflacion'] > 50, 'piso', 9.0),
+    ('inflacion_mayor_30', lambda e: (e['inflacion'] > 30) & (e['inflacion'] <= 50), 'piso', 7.5),
+    ('inflacion_mayor_15', lambda e: (e['inflacion'] > 15) & (e['inflacion'] <= 30), 'piso', 6.0),
+
     # COVID crítico
-    if covid > 7000:
-        riesgo_calculado = max(riesgo_calculado, 8.5)
-    elif covid > 5000:
-        riesgo_calculado = max(riesgo_calculado, 7.0)
-    
+    ('covid_mayor_7000', lambda e: e['covid'] > 7000, 'piso', 8.5),
+    ('covid_mayor_5000', lambda e: (e['covid'] > 5000) & (e['covid'] <= 7000), 'piso', 7.0),
+
     # Protestas masivas
-    if protestas > 3500:
-        riesgo_calculado = max(riesgo_calculado, 8.0)
-    elif protestas > 2000:
-        riesgo_calculado = max(riesgo_calculado, 6.5)
-    
+    ('protestas_mayor_3500', lambda e: e['protestas'] > 3500, 'piso', 8.0),
+    ('protestas_mayor_2000', lambda e: (e['protestas'] > 2000) & (e['protestas'] <= 3500), 'piso', 6.5),
+
     # Desempleo crítico
-    if desempleo > 15:
-        riesgo_calculado = max(riesgo_calculado, 8.5)
-    elif desempleo > 10:
-        riesgo_calculado = max(riesgo_calculado, 7.0)
-    
+    ('desempleo_mayor_15', lambda e: e['desempleo'] > 15, 'piso', 8.5),
+    ('desempleo_mayor_10', lambda e: (e['desempleo'] > 10) & (e['desempleo'] <= 15), 'piso', 7.0),
+
     # Combustible crítico (MÁS SENSIBLE)
-    if combustible > 6:
-        riesgo_calculado = max(riesgo_calculado, 7.5)
-    elif combustible > 5:
-        riesgo_calculado = max(riesgo_calculado, 6.5)
-    elif combustible > 4:
-        riesgo_calculado = max(riesgo_calculado, 5.0)
-    
+    ('combustible_mayor_6', lambda e: e['combustible'] > 6, 'piso', 7.5),
+    ('combustible_mayor_5', lambda e: (e['combustible'] > 5) & (e['combustible'] <= 6), 'piso', 6.5),
+    ('combustible_mayor_4', lambda e: (e['combustible'] > 4) & (e['combustible'] <= 5), 'piso', 5.0),
+
     # Combinaciones mortales
-    if inflacion > 20 and desempleo > 10:  # Estanflación severa
-        riesgo_calculado = 9.5
-    
-    if combustible > 5 and inflacion > 15:  # Crisis energética + inflación
-        riesgo_calculado = max(riesgo_calculado, 8.0)
-    
-    return round(min(riesgo_calculado, 10.0), 2)
\ No newline at end of file
+    ('estanflacion_severa', lambda e: (e['inflacion'] > 20) & (e['desempleo'] > 10), 'fijo', 9.5),
+    ('crisis_energetica_inflacion', lambda e: (e['combustible'] > 5) & (e['inflacion'] > 15), 'piso', 8.0),
+]
+
+
+def ajustar_riesgo(riesgo_calculado, inflacion, combustible, protestas, desempleo, covid, clima):
+    """
+    Aplica los ajustes críticos post-cálculo sobre la salida del sistema difuso.
+
+    Returns:
+        float: Riesgo externo ajustado en escala 0-10
+    """
+    return ajustar_riesgo_explicado(riesgo_calculado, inflacion, combustible, protestas,
+                                    desempleo, covid, clima)[0]
+
+
+def ajustar_riesgo_explicado(riesgo_calculado, inflacion, combustible, protestas, desempleo, covid, clima):
+    """
+    `ajustar_riesgo` que además informa qué ajustes cambiaron el valor.
+
+    Returns:
+        tuple: (riesgo ajustado, [(nombre del ajuste, antes, después), ...])
+    """
+    entradas = {'inflacion': inflacion, 'combustible': combustible, 'protestas': protestas,
+                'desempleo': desempleo, 'covid': covid, 'clima': clima}
+    aplicados = []
+    for nombre, condicion, tipo, valor in AJUSTES:
+        if condicion(entradas):
+            nuevo = valor if tipo == 'fijo' else max(riesgo_calculado, valor)
+            if nuevo != riesgo_calculado:
+                aplicados.append((nombre, riesgo_calculado, nuevo))
+            riesgo_calculado = nuevo
+    return round(min(riesgo_calculado, 10.0), 2), aplicados
+
+
+class EvaluadorDifusoVectorizado:
+    """
+    Implementación en NumPy del mismo sistema difuso para lotes de entradas.
+
+    Reproduce la inferencia Mamdani de skfuzzy como operaciones de arreglos:
+    pertenencia por interpolación sobre los universos muestreados, 'y'/'o' como
+    mínimo/máximo, acumulación por máximo y centroide exacto sobre el universo
+    de riesgo ampliado con los puntos de corte de cada término (igual que
+    skfuzzy). Coincide con `MotorDifuso` hasta ~1e-12 antes de redondear.
+    """
+
+    def __init__(self, tamano_bloque=8192):
+        self.tamano_bloque = tamano_bloque
+        self._universos = {nombre: np.arange(*rango) for nombre, rango in VARIABLES.items()}
+        self._pertenencias = {
+            nombre: {
+                termino: _funcion_pertenencia(self._universos[nombre], tipo, parametros)
+                for termino, (tipo, parametros) in TERMINOS[nombre].items()
+            }
+            for nombre in VARIABLES
+        }
+
+        nombre_salida, rango_salida = SALIDA
+        self._universo_salida = np.arange(*rango_salida)
+        self._terminos_salida = list(TERMINOS[nombre_salida])
+        self._pertenencias_salida = [
+            _funcion_pertenencia(self._universo_salida, tipo, parametros)
+            for tipo, parametros in TERMINOS[nombre_salida].values()
+        ]
+        # Bordes de subida (a, b) y bajada (c, d) de cada término de salida
+        self._bordes_salida = []
+        for tipo, parametros in TERMINOS[nombre_salida].values():
+            if tipo == 'trap':
+                a, b, c, d = parametros
+            else:
+                a, b, d = parametros
+                c = b
+            self._bordes_salida.append((a, b, c, d))
+
+        self._consecuentes = np.array(
+            [self._terminos_salida.index(salida) for _, _, salida in REGLAS]
+        )
+
+    def _pertenencia_entradas(self, entradas):
+        """Grado de pertenencia de cada término de entrada, como arreglos (n,)."""
+        grados = {}
+        for nombre, valores in entradas.items():
+            universo = self._universos[nombre]
+            valores = np.clip(valores, universo.min(), universo.max())
+            grados[nombre] = {
+                termino: np.interp(valores, universo, mf)
+                for termino, mf in self._pertenencias[nombre].items()
+            }
+        return grados
+
+    def activaciones(self, inflacion, combustible, protestas, desempleo, covid, clima):
+        """
+        Fuerza de disparo de cada regla de REGLAS.
+
+        Returns:
+            np.ndarray: Matriz (n, len(REGLAS))
+        """
+        entradas = _limitar_entradas_lote(inflacion, combustible, protestas,
+                                          desempleo, covid, clima)
+        grados = self._pertenencia_entradas(entradas)
+        n = len(entradas['inflacion'])
+
+        disparos = np.empty((n, len(REGLAS)))
+        for i, (operador, antecedentes, _) in enumerate(REGLAS):
+            valor = grados[antecedentes[0][0]][antecedentes[0][1]]
+            for nombre, termino in antecedentes[1:]:
+                if operador == 'y':
+                    valor = np.fmin(valor, grados[nombre][termino])
+                else:
+                    valor = np.fmax(valor, grados[nombre][termino])
+            disparos[:, i] = valor
+        return disparos
+
+    def defuzzificar(self, disparos):
+        """
+        Acumula las reglas por término de salida y calcula el centroide.
+
+        Returns:
+            np.ndarray: Riesgo (n,); NaN donde ninguna regla aporta área
+        """
+        resultado = np.empty(len(disparos))
+        for inicio in range(0, len(disparos), self.tamano_bloque):
+            bloque = disparos[inicio:inicio + self.tamano_bloque]
+            resultado[inicio:inicio + len(bloque)] = self._centroide(bloque)
+        return resultado
+
+    def _centroide(self, disparos):
+        n = len(disparos)
+        cortes = np.zeros((n, len(self._terminos_salida)))
+        for t in range(len(self._terminos_salida)):
+            columnas = self._consecuentes == t
+            if columnas.any():
+                cortes[:, t] = disparos[:, columnas].max(axis=1)
+
+        # Universo ampliado: puntos originales + cruces de cada término con su corte
+        puntos = [np.broadcast_to(self._universo_salida, (n, len(self._universo_salida)))]
+        for t, (a, b, c, d) in enumerate(self._bordes_salida):
+            y = cortes[:, t]
+            if b > a:
+                puntos.append((a + y * (b - a))[:, None])
+            if d > c:
+                puntos.append((d - y * (d - c))[:, None])
+        x = np.sort(np.concatenate(puntos, axis=1), axis=1)
+
+        mf = np.zeros_like(x)
+        for t, pertenencia in enumerate(self._pertenencias_salida):
+            recortada = np.minimum(cortes[:, t:t + 1], np.interp(x, self._universo_salida, pertenencia))
+            np.maximum(mf, recortada, out=mf)
+
+        # Centroide exacto por tramos lineales (rectángulos, triángulos y trapecios)
+        x1, x2 = x[:, :-1], x[:, 1:]
+        y1, y2 = mf[:, :-1], mf[:, 1:]
+        ancho = x2 - x1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            momento = np.where(
+                y1 == y2, 0.5 * (x1 + x2),
+                np.where(y1 == 0.0, 2.0 / 3.0 * ancho + x1,
+                         np.where(y2 == 0.0, 1.0 / 3.0 * ancho + x1,
+                                  (2.0 / 3.0 * ancho * (y2 + 0.5 * y1)) / (y1 + y2) + x1)))
+        area = 0.5 * ancho * (y1 + y2)
+        validos = ~(((y1 == 0.0) & (y2 == 0.0)) | (ancho == 0.0))
+        area = np.where(validos, area, 0.0)
+        momento = np.where(validos, momento, 0.0)
+
+        suma_area = area.sum(axis=1)
+        riesgo = (momento * area).sum(axis=1) / np.fmax(suma_area, np.finfo(float).eps)
+        riesgo[mf.sum(axis=1) == 0] = np.nan
+        return riesgo
+
+    def evaluar(self, inflacion, combustible, protestas, desempleo, covid, clima):
+        """
+        Inferencia difusa vectorizada sin los ajustes post-cálculo.
+
+        Returns:
+            np.ndarray: Riesgo (n,); NaN donde skfuzzy no produciría salida
+        """
+        return self.defuzzificar(self.activaciones(inflacion, combustible, protestas,
+                                                   desempleo, covid, clima))
+
+
+def _limitar_entradas_lote(inflacion, combustible, protestas, desempleo, covid, clima):
+    """Versión para arreglos de `_limitar_entradas`."""
+    inflacion, combustible, protestas, desempleo, covid, clima = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(v, dtype=np.float64))
+          for v in (inflacion, combustible, protestas, desempleo, covid, clima))
+    )
+    return {
+        'inflacion': np.minimum(inflacion, 100),
+        'combustible': np.minimum(combustible, 8),
+        'protestas': np.minimum(protestas, 5000),
+        'desempleo': np.minimum(desempleo, 25),
+        'covid': np.minimum(covid, 10000),
+        'clima': np.clip(clima, -10, 40),
+    }
+
+
+def ajustar_riesgo_lote(riesgo, inflacion, combustible, protestas, desempleo, covid, clima):
+    """
+    Versión con máscaras de `ajustar_riesgo` para arreglos.
+
+    Las filas NaN (sin salida difusa) se mantienen en NaN.
+    """
+    inflacion, combustible, protestas, desempleo, covid, clima = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(v, dtype=np.float64))
+          for v in (inflacion, combustible, protestas, desempleo, covid, clima))
+    )
+    entradas = {'inflacion': inflacion, 'combustible': combustible, 'protestas': protestas,
+                'desempleo': desempleo, 'covid': covid, 'clima': clima}
+    r = np.array(riesgo, dtype=np.float64)
+
+    for _, condicion, tipo, valor in AJUSTES:
+        mascara = condicion(entradas)
+        if tipo == 'fijo':
+            r[mascara & ~np.isnan(r)] = valor
+        else:
+            r[mascara] = np.maximum(r[mascara], valor)
+
+    return np.round(np.minimum(r, 10.0), 2)
+
+
+evaluador_vectorizado = EvaluadorDifusoVectorizado()
+
+
+def calcular_riesgo_difuso_lote(inflacion, combustible, protestas, desempleo, covid, clima):
+    """
+    Versión vectorizada de `calcular_riesgo_difuso` para arreglos de entradas.
+
+    Acepta arreglos (o escalares, que se difunden) y evalúa todo el lote en
+    operaciones de NumPy. Donde la versión escalar lanzaría una excepción por
+    no disparar ninguna regla, devuelve NaN.
+
+    Returns:
+        np.ndarray: Riesgo externo en escala 0-10 por fila
+    """
+    riesgo = evaluador_vectorizado.evaluar(inflacion, combustible, protestas,
+                                           desempleo, covid, clima)
+    return ajustar_riesgo_lote(riesgo, inflacion, combustible, protestas,
+                               desempleo, covid, clima)
+
+
+# Resolución de la tabla de riesgo por variable. Los pasos de los controles del
+# formulario (inflación 0.5, combustible 0.1, protestas 50, covid 100...) caen
+# exactamente en esta rejilla, así que esas entradas no tienen error.
+PASOS_TABLA = {
+    'inflacion': 0.1,
+    'combustible': 0.01,
+    'protestas': 1,
+    'desempleo': 0.01,
+    'covid': 1,
+    'clima': 0.1,
+}
+
+
+class TablaRiesgoDifuso:
+    """
+    Superficie de riesgo difuso memorizada sobre entradas cuantizadas (LRU).
+
+    Guarda la salida del sistema difuso (antes de los ajustes post-cálculo) en
+    el punto de rejilla más cercano a cada entrada; los ajustes se aplican
+    después sobre los valores exactos, así que los umbrales críticos nunca se
+    desplazan por la cuantización. La tabla se puede persistir a .npz y cargar
+    al arrancar sin recalcular nada.
+    """
+
+    def __init__(self, pasos=None, capacidad=200_000):
+        self.pasos = dict(PASOS_TABLA if pasos is None else pasos)
+        self.capacidad = capacidad
+        self._pasos = tuple(self.pasos[nombre] for nombre in VARIABLES)
+        self._valores = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _clave(self, entradas):
+        return tuple(int(round(valor / paso)) for valor, paso in zip(entradas, self._pasos))
+
+    def _guardar_valor(self, clave, valor):
+        with self._lock:
+            self._valores[clave] = valor
+            self._valores.move_to_end(clave)
+            while len(self._valores) > self.capacidad:
+                self._valores.popitem(last=False)
+
+    def riesgo_base(self, inflacion, combustible, protestas, desempleo, covid, clima):
+        """
+        Salida difusa (sin ajustes) en el punto de rejilla de la entrada.
+
+        Returns:
+            float: Riesgo defuzzificado; NaN si ninguna regla se activa
+        """
+        clave = self._clave((inflacion, combustible, protestas, desempleo, covid, clima))
+        with self._lock:
+            valor = self._valores.get(clave)
+            if valor is not None:
+                self._valores.move_to_end(clave)
+                self.aciertos += 1
+                return valor
+            self.fallos += 1
+
+        punto = [k * paso for k, paso in zip(clave, self._pasos)]
+        valor = float(evaluador_vectorizado.evaluar(*punto)[0])
+        self._guardar_valor(clave, valor)
+        return valor
+
+    def calcular(self, inflacion, combustible, protestas, desempleo, covid, clima):
+        """
+        Equivalente de `calcular_riesgo_difuso` usando la tabla.
+
+        Returns:
+            float: Riesgo externo en escala 0-10
+        """
+        riesgo_calculado = self.riesgo_base(inflacion, combustible, protestas,
+                                            desempleo, covid, clima)
+        if riesgo_calculado != riesgo_calculado:
+            raise ValueError('Ninguna regla difusa se activó para estas entradas')
+        return ajustar_riesgo(riesgo_calculado, inflacion, combustible, protestas,
+                              desempleo, covid, clima)
+
+    def precalcular(self, inflacion, combustible, protestas, desempleo, covid, clima):
+        """Llena la tabla para arreglos de entradas en una sola evaluación vectorizada."""
+        columnas = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(v, dtype=np.float64))
+              for v in (inflacion, combustible, protestas, desempleo, covid, clima))
+        )
+        pasos = np.array(self._pasos)
+        claves = np.unique(np.rint(np.column_stack(columnas) / pasos).astype(np.int64), axis=0)
+        valores = evaluador_vectorizado.evaluar(*(claves * pasos).T)
+        for clave, valor in zip(map(tuple, claves.tolist()), valores.tolist()):
+            self._guardar_valor(clave, valor)
+        return len(claves)
+
+    def reportar_error(self, muestras=2000, semilla=0):
+        """
+        Compara la tabla contra la evaluación exacta en entradas aleatorias.
+
+        Returns:
+            dict: Error absoluto máximo y medio del riesgo final, y fracción de
+            resultados que cambian tras redondear a 2 decimales
+        """
+        generador = np.random.default_rng(semilla)
+        columnas = []
+        for nombre, (inicio, fin, _) in VARIABLES.items():
+            columnas.append(generador.uniform(inicio, fin, muestras))
+
+        # Tabla auxiliar con la misma rejilla para no alterar la tabla en uso
+        auxiliar = TablaRiesgoDifuso(pasos=self.pasos, capacidad=muestras)
+        exacto = calcular_riesgo_difuso_lote(*columnas)
+        tabla = np.array([
+            auxiliar._calcular_o_nan(*fila) for fila in zip(*(c.tolist() for c in columnas))
+        ])
+        validos = ~(np.isnan(exacto) | np.isnan(tabla))
+        diferencia = np.abs(exacto[validos] - tabla[validos])
+        return {
+            'muestras': int(muestras),
+            'error_maximo': float(diferencia.max()) if diferencia.size else 0.0,
+            'error_medio': float(diferencia.mean()) if diferencia.size else 0.0,
+            'fraccion_distinta': float(np.mean(diferencia > 0)) if diferencia.size else 0.0,
+            'nan_distintos': int(np.sum(np.isnan(exacto) != np.isnan(tabla))),
+        }
+
+    def _calcular_o_nan(self, *entradas):
+        try:
+            return self.calcular(*entradas)
+        except ValueError:
+            return np.nan
+
+    def estadisticas(self):
+        total = self.aciertos + self.fallos
+        return {
+            'entradas': len(self._valores),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'tasa_aciertos': round(self.aciertos / total, 4) if total else 0.0,
+        }
+
+    def guardar(self, ruta):
+        """Persiste la tabla (claves cuantizadas, valores y pasos) en un .npz."""
+        with self._lock:
+            claves = np.array(list(self._valores.keys()), dtype=np.int64).reshape(-1, len(VARIABLES))
+            valores = np.array(list(self._valores.values()), dtype=np.float64)
+        np.savez(ruta, claves=claves, valores=valores, pasos=np.array(self._pasos))
+
+    @classmethod
+    def cargar(cls, ruta, capacidad=200_000):
+        """Carga una tabla guardada con `guardar`, sin recalcular ninguna entrada."""
+        with np.load(ruta) as datos:
+            pasos = dict(zip(VARIABLES, datos['pasos'].tolist()))
+            tabla = cls(pasos=pasos, capacidad=capacidad)
+            tabla._valores = OrderedDict(zip(map(tuple, datos['claves'].tolist()),
+                                             datos['valores'].tolist()))
+        return tabla
+
+
+def _describir_regla(operador, antecedentes, consecuente):
+    union = ' y ' if operador == 'y' else ' o '
+    condicion = union.join(f'{nombre} {termino}' for nombre, termino in antecedentes)
+    return f'{condicion} -> riesgo {consecuente}'
+
+
+# Descripción legible de cada regla, en el orden de REGLAS
+DESCRIPCION_REGLAS = [_describir_regla(*regla) for regla in REGLAS]
+
+
+class ExplicadorRiesgo:
+    """
+    Riesgo difuso con su explicación, memorizado por entrada exacta (LRU).
+
+    La explicación trae la fuerza de disparo de cada regla activada, la salida
+    del sistema antes de los ajustes y los ajustes post-cálculo que cambiaron el
+    valor; `determinante` es el último de ellos (None si el valor es la salida
+    difusa). El riesgo sale de `riesgo_base` (por defecto el motor skfuzzy, como
+    calcular_riesgo_difuso) y las activaciones de una fila del evaluador
+    vectorizado, que usa las mismas funciones de pertenencia, así que explicar no
+    repite la inferencia. Las explicaciones devueltas se comparten entre
+    llamadas: no modificarlas.
+    """
+
+    def __init__(self, riesgo_base=None, capacidad=4096):
+        self.riesgo_base = riesgo_base or motor_difuso.evaluar
+        self.capacidad = capacidad
+        self._valores = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def explicar(self, inflacion, combustible, protestas, desempleo, covid, clima):
+        """
+        Returns:
+            tuple: (riesgo externo en escala 0-10, explicación)
+
+        Raises:
+            ValueError: Si ninguna regla difusa se activa (o la excepción de skfuzzy)
+        """
+        clave = (inflacion, combustible, protestas, desempleo, covid, clima)
+        with self._lock:
+            valor = self._valores.get(clave)
+            if valor is not None:
+                self._valores.move_to_end(clave)
+                self.aciertos += 1
+                return valor
+            self.fallos += 1
+
+        riesgo_calculado = self.riesgo_base(*clave)
+        if riesgo_calculado != riesgo_calculado:
+            raise ValueError('Ninguna regla difusa se activó para estas entradas')
+        riesgo, ajustes = ajustar_riesgo_explicado(riesgo_calculado, *clave)
+        disparos = evaluador_vectorizado.activaciones(*clave)[0]
+        activadas = sorted(np.flatnonzero(disparos > 0).tolist(), key=lambda i: -disparos[i])
+        explicacion = {
+            'riesgo': riesgo,
+            'salida_difusa': round(float(riesgo_calculado), 4),
+            'reglas': [{'regla': i, 'descripcion': DESCRIPCION_REGLAS[i], 'consecuente': REGLAS[i][2],
+                        'activacion': round(float(disparos[i]), 4)} for i in activadas],
+            'ajustes': [{'ajuste': nombre, 'antes': round(float(antes), 4), 'despues': float(despues)}
+                        for nombre, antes, despues in ajustes],
+            'determinante': ajustes[-1][0] if ajustes else None,
+        }
+
+        with self._lock:
+            self._valores[clave] = (riesgo, explicacion)
+            self._valores.move_to_end(clave)
+            while len(self._valores) > self.capacidad:
+                self._valores.popitem(last=False)
+        return riesgo, explicacion
+
+    def estadisticas(self):
+        total = self.aciertos + self.fallos
+        return {
+            'entradas': len(self._valores),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'tasa_aciertos': round(self.aciertos / total, 4) if total else 0.0,
+        }
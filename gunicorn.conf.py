@@ -0,0 +1,38 @@
+"""
+Configuración de gunicorn (Procfile: gunicorn -c gunicorn.conf.py).
+
+Con preload_app el maestro importa app.py y llama a crear_app() antes del fork:
+el modelo, el scaler, las tablas de reglas y el sistema difuso quedan en páginas
+compartidas (copy-on-write) por todos los workers, y el precalentamiento corre
+una sola vez. gc.freeze() mueve esos objetos a la generación permanente para que
+el recolector de cada worker no los toque (tocarlos copia sus páginas).
+
+Los workers usan hilos (gthread, GUNICORN_HILOS=4 por defecto) para que el
+tablero reciba los server-sent events de /eventos: cada stream ocupa un hilo, así
+que se admiten EVENTOS_MAX_WSGI streams por worker (por defecto la mitad de los
+hilos) y el resto queda para /predict. Con GUNICORN_HILOS=1 (worker sync)
+/eventos responde 503 y el tablero vuelve a consultar /historial y /estadisticas.
+
+Variables: PORT, WEB_CONCURRENCY (workers), GUNICORN_HILOS, GUNICORN_TIMEOUT,
+EVENTOS_MAX_WSGI.
+"""
+import gc
+import os
+
+wsgi_app = 'app:crear_app(precalentar_modo="sincrono")'
+preload_app = True
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_HILOS', 4))
+# Se leen al importar app.py (preload_app), después de esta configuración: una
+# simulación difusa precalentada por hilo
+os.environ.setdefault('DIFUSO_SIMULACIONES', str(threads))
+if threads > 1:
+    os.environ.setdefault('EVENTOS_MAX_WSGI', str(max(1, threads // 2)))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+
+def pre_fork(server, worker):
+    # La app ya se cargó (preload_app): congelar lo que hay para compartirlo sin copias
+    gc.freeze()
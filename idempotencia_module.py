@@ -0,0 +1,279 @@
+"""
+Caché de decisiones idempotente para absorber reintentos y envíos duplicados.
+
+Cada /predict se identifica por una clave: la Idempotency-Key que mande el
+cliente o, si no manda ninguna, el hash (SHA-256) de la solicitud normalizada.
+Si la clave ya tiene una decisión vigente se devuelve la misma respuesta sin
+volver a evaluar ni insertar otra fila en `solicitudes`.
+
+Las entradas viven en una base SQLite aparte (idempotencia.db junto a
+historial.db, en modo WAL) que comparten todos los workers. Antes de evaluar, la
+clave se reserva en una transacción BEGIN IMMEDIATE: si otro worker ya la
+reservó (un doble clic que cae en dos workers), se espera a que guarde su
+respuesta en lugar de evaluar dos veces. Las entradas vencen a los TTL_SEGUNDOS
+y, cada PODA_CADA respuestas guardadas por proceso, se borran las vencidas y las
+menos usadas por encima de MAX_ENTRADAS.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from db_module import RUTA_DB, con_reintentos, conectar
+from decision_module import CAMPOS_BOOLEANOS, CAMPOS_MACRO
+
+# IDEMPOTENCIA=0 desactiva la caché
+ACTIVA = os.environ.get('IDEMPOTENCIA', '1') != '0'
+# Cada base de historial tiene su caché al lado (las bases temporales no comparten)
+RUTA_IDEMPOTENCIA = os.environ.get('IDEMPOTENCIA_DB',
+                                   os.path.join(os.path.dirname(RUTA_DB), 'idempotencia.db'))
+TTL_SEGUNDOS = float(os.environ.get('IDEMPOTENCIA_TTL_S', 900))
+MAX_ENTRADAS = int(os.environ.get('IDEMPOTENCIA_MAX', 50000))
+# Espera máxima por una clave que está evaluando otra solicitud (después: 409)
+ESPERA_MS = float(os.environ.get('IDEMPOTENCIA_ESPERA_MS', 5000))
+# Una reserva sin respuesta después de este tiempo se considera abandonada
+RESERVA_SEGUNDOS = 30
+PODA_CADA = 200
+
+# Estados de una clave al reservar
+REPETIDA = 'repetida'      # Ya hay respuesta: devolverla
+RESERVADA = 'reservada'    # Reservada por quien llama: evaluar y completar (o liberar)
+EN_PROCESO = 'en_proceso'  # Otra solicitud la está evaluando
+CONFLICTO = 'conflicto'    # Idempotency-Key reutilizada con otra solicitud
+
+# Campos que se comparan como números ("150000" == 150000)
+CAMPOS_NUMERICOS = {'loan_amount', 'income', 'term', 'property_value', 'macro_version', *CAMPOS_MACRO}
+
+
+class ConflictoIdempotencia(Exception):
+    """La clave no se puede usar ahora: reutilizada con otra solicitud (422) o en proceso (409)"""
+
+    def __init__(self, mensaje, estado):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def normalizar_solicitud(data):
+    """Solicitud con números, booleanos y textos en forma canónica"""
+    normalizada = {}
+    for campo, valor in data.items():
+        if campo in CAMPOS_NUMERICOS and isinstance(valor, (int, float, str)) and not isinstance(valor, bool):
+            try:
+                valor = float(valor)
+            except ValueError:
+                pass
+        elif campo in CAMPOS_BOOLEANOS:
+            valor = bool(valor)
+        elif isinstance(valor, str):
+            valor = valor.strip()
+        normalizada[str(campo)] = valor
+    return normalizada
+
+
+def _hash(valor):
+    canonico = json.dumps(valor, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonico.encode('utf-8')).hexdigest()
+
+
+class CacheIdempotencia:
+    """Respuestas de /predict por clave, compartidas entre procesos por SQLite"""
+
+    def __init__(self, ruta=RUTA_IDEMPOTENCIA, ttl_segundos=TTL_SEGUNDOS, max_entradas=MAX_ENTRADAS,
+                 espera_ms=ESPERA_MS, reserva_segundos=RESERVA_SEGUNDOS):
+        self.ruta = ruta
+        self.ttl = ttl_segundos
+        self.max_entradas = max_entradas
+        self.espera = espera_ms / 1000
+        self.reserva = reserva_segundos
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._completadas = 0
+        self.contadores = {'aciertos': 0, 'fallos': 0, 'esperas': 0, 'conflictos': 0, 'podas': 0}
+
+    # ============ CONEXIÓN ============
+
+    def _conexion(self):
+        """Conexión del hilo (nueva tras un fork), en autocommit para usar BEGIN IMMEDIATE"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = conectar(self.ruta)
+            conn.isolation_level = None
+            conn.execute('''CREATE TABLE IF NOT EXISTS idempotencia (
+                clave TEXT PRIMARY KEY,
+                huella TEXT NOT NULL,
+                respuesta TEXT,
+                creada REAL NOT NULL,
+                usada REAL NOT NULL,
+                repeticiones INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_idempotencia_usada ON idempotencia (usada)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaccion(self, funcion):
+        """Corre funcion(conn) dentro de BEGIN IMMEDIATE, con reintentos si la base está bloqueada"""
+        def ejecutar():
+            conn = self._conexion()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                resultado = funcion(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return resultado
+
+        return con_reintentos(ejecutar)
+
+    def _contar(self, campo, valor=1):
+        with self._lock:
+            self.contadores[campo] += valor
+
+    # ============ CLAVES ============
+
+    @staticmethod
+    def claves(data, clave_cliente=None, variante=(), contexto=()):
+        """
+        (clave, huella) de una solicitud.
+
+        La huella es el hash de la solicitud normalizada y `variante` (opciones que
+        cambian la respuesta, como ?explicar); una Idempotency-Key con otra huella
+        es un conflicto. La clave es la Idempotency-Key del cliente o, sin ella, el
+        hash de la huella y `contexto` (lo que decide sin estar en la solicitud:
+        hash de las reglas cargadas, snapshot vigente), así un cambio de reglas no
+        devuelve decisiones viejas.
+        """
+        huella = _hash([normalizar_solicitud(data), list(variante)])
+        if clave_cliente:
+            return f'cliente:{clave_cliente}', huella
+        return f'contenido:{_hash([huella, list(contexto)])}', huella
+
+    # ============ RESERVA Y RESPUESTA ============
+
+    def reservar_lote(self, pedidos):
+        """
+        Reserva varias claves en una sola transacción.
+
+        Args:
+            pedidos: Lista de (clave, huella)
+
+        Returns:
+            list: (estado, respuesta) por pedido; respuesta (dict) solo con REPETIDA.
+            Una clave repetida dentro del lote queda EN_PROCESO (la reservó el primero).
+        """
+        def reservar(conn):
+            ahora = time.time()
+            estados = []
+            for clave, huella in pedidos:
+                fila = conn.execute('SELECT huella, respuesta, creada FROM idempotencia WHERE clave = ?',
+                                    (clave,)).fetchone()
+                vigente = fila is not None and fila['creada'] >= ahora - (
+                    self.ttl if fila['respuesta'] is not None else self.reserva)
+                if not vigente:
+                    conn.execute('INSERT OR REPLACE INTO idempotencia (clave, huella, respuesta, creada, usada) '
+                                 'VALUES (?, ?, NULL, ?, ?)', (clave, huella, ahora, ahora))
+                    estados.append((RESERVADA, None))
+                elif fila['huella'] != huella:
+                    estados.append((CONFLICTO, None))
+                elif fila['respuesta'] is None:
+                    estados.append((EN_PROCESO, None))
+                else:
+                    conn.execute('UPDATE idempotencia SET usada = ?, repeticiones = repeticiones + 1 '
+                                 'WHERE clave = ?', (ahora, clave))
+                    estados.append((REPETIDA, json.loads(fila['respuesta'])))
+            return estados
+
+        estados = self._transaccion(reservar)
+        for estado, _ in estados:
+            if estado == REPETIDA:
+                self._contar('aciertos')
+            elif estado == RESERVADA:
+                self._contar('fallos')
+            elif estado == CONFLICTO:
+                self._contar('conflictos')
+        return estados
+
+    def reservar(self, clave, huella):
+        """
+        Respuesta guardada (dict) o None si quien llama reservó la clave y debe
+        evaluar. Si otra solicitud la está evaluando, espera su respuesta.
+
+        Raises:
+            ConflictoIdempotencia: Clave reutilizada con otra solicitud (422) o
+                todavía en proceso después de la espera máxima (409)
+        """
+        limite = time.monotonic() + self.espera
+        pausa = 0.005
+        esperando = False
+        while True:
+            estado, respuesta = self.reservar_lote([(clave, huella)])[0]
+            if estado == REPETIDA or estado == RESERVADA:
+                return respuesta
+            if estado == CONFLICTO:
+                raise ConflictoIdempotencia('Idempotency-Key ya usada con otra solicitud', 422)
+            if not esperando:
+                esperando = True
+                self._contar('esperas')
+            if time.monotonic() >= limite:
+                raise ConflictoIdempotencia('Hay una solicitud idéntica en proceso; reintente', 409)
+            time.sleep(pausa)
+            pausa = min(pausa * 2, 0.1)
+
+    def completar_lote(self, respuestas):
+        """Guarda [(clave, respuesta dict)] de claves reservadas y poda cada PODA_CADA"""
+        if not respuestas:
+            return
+        filas = [(json.dumps(respuesta, ensure_ascii=False), clave) for clave, respuesta in respuestas]
+        self._transaccion(lambda conn: conn.executemany(
+            'UPDATE idempotencia SET respuesta = ? WHERE clave = ? AND respuesta IS NULL', filas))
+        with self._lock:
+            self._completadas += len(respuestas)
+            podar = self._completadas >= PODA_CADA
+            if podar:
+                self._completadas = 0
+        if podar:
+            self.podar()
+
+    def completar(self, clave, respuesta):
+        self.completar_lote([(clave, respuesta)])
+
+    def liberar(self, claves):
+        """Borra reservas sin respuesta (la solicitud fue inválida o falló): un reintento vuelve a evaluar"""
+        if claves:
+            self._transaccion(lambda conn: conn.executemany(
+                'DELETE FROM idempotencia WHERE clave = ? AND respuesta IS NULL', [(c,) for c in claves]))
+
+    def podar(self):
+        """Borra las entradas vencidas y las menos usadas por encima de max_entradas"""
+        def borrar(conn):
+            ahora = time.time()
+            borradas = conn.execute(
+                'DELETE FROM idempotencia WHERE (respuesta IS NOT NULL AND creada < ?) '
+                'OR (respuesta IS NULL AND creada < ?)', (ahora - self.ttl, ahora - self.reserva)).rowcount
+            sobrantes = conn.execute('SELECT COUNT(*) FROM idempotencia').fetchone()[0] - self.max_entradas
+            if sobrantes > 0:
+                borradas += conn.execute(
+                    'DELETE FROM idempotencia WHERE clave IN (SELECT clave FROM idempotencia '
+                    'WHERE respuesta IS NOT NULL ORDER BY usada LIMIT ?)', (sobrantes,)).rowcount
+            return borradas
+
+        self._contar('podas', self._transaccion(borrar))
+
+    # ============ ESTADÍSTICAS ============
+
+    def estadisticas(self):
+        """Contadores de este proceso, tasa de aciertos y entradas en la base (de todos los workers)"""
+        with self._lock:
+            estadisticas = dict(self.contadores)
+        consultas = estadisticas['aciertos'] + estadisticas['fallos']
+        estadisticas['tasa_aciertos'] = round(estadisticas['aciertos'] / consultas, 4) if consultas else 0.0
+        try:
+            fila = self._conexion().execute(
+                'SELECT COUNT(*), COALESCE(SUM(repeticiones), 0) FROM idempotencia').fetchone()
+            estadisticas['entradas'], estadisticas['repeticiones_totales'] = fila[0], fila[1]
+        except sqlite3.Error:
+            pass
+        return estadisticas
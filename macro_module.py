@@ -0,0 +1,174 @@
+"""
+Snapshots del entorno macroeconómico compartidos por todas las solicitudes.
+
+Las variables macro (inflación, combustible, protestas, desempleo, covid, clima)
+cambian más o menos una vez al día y son las mismas para todos los clientes. Un
+snapshot guarda esos valores con una versión y el riesgo difuso ya calculado, así
+que el sistema difuso corre una vez por snapshot y no una vez por solicitud; las
+banderas rojas que solo dependen de las variables macro también se evalúan una
+vez por snapshot (y por tabla de reglas, que puede recargarse).
+
+Los snapshots viven en la tabla snapshots_macro de historial.db y no se modifican
+una vez creados; el vigente es el de mayor versión. Cada proceso los guarda en
+memoria y revisa cada MACRO_REVISION_S segundos si otro worker creó uno nuevo.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from db_module import con_reintentos, consultar, obtener_conexion
+
+# Variables macroeconómicas, en el orden de calcular_riesgo_difuso
+CAMPOS_MACRO = ['inflacion', 'combustible', 'protestas', 'desempleo', 'covid', 'clima']
+
+# Segundos entre revisiones del snapshot vigente en la base
+REVISION_SEGUNDOS = float(os.environ.get('MACRO_REVISION_S', 5))
+
+COLUMNAS_SNAPSHOT = ['version', 'fecha'] + CAMPOS_MACRO + ['riesgo_externo']
+
+logger = logging.getLogger(__name__)
+
+
+class RiesgoNoCalculado(RuntimeError):
+    """El riesgo externo de un snapshot no se pudo calcular (no se guarda nada)"""
+
+
+class SnapshotMacro:
+    """Valores macro de una versión, con su riesgo externo ya calculado (inmutable)"""
+
+    def __init__(self, version, fecha, valores, riesgo_externo):
+        self.version = version
+        self.fecha = fecha
+        self.valores = {campo: float(valores[campo]) for campo in CAMPOS_MACRO}
+        self.macro = tuple(self.valores[campo] for campo in CAMPOS_MACRO)
+        self.riesgo_externo = float(riesgo_externo)
+        # (tabla de reglas, banderas precalculadas con esa tabla)
+        self._banderas = (None, None)
+
+    @classmethod
+    def desde_fila(cls, fila):
+        return cls(fila['version'], fila['fecha'], fila, fila['riesgo_externo'])
+
+    def banderas(self, tabla):
+        """Banderas macro evaluadas con `tabla` (ver TablaReglas.banderas_precalculadas)"""
+        tabla_calculada, banderas = self._banderas
+        if tabla_calculada is not tabla:
+            banderas = tabla.banderas_precalculadas(self.valores)
+            self._banderas = (tabla, banderas)
+        return banderas
+
+    def como_dict(self, tabla=None):
+        """Snapshot tal como lo devuelve /macro; con `tabla` incluye la primera bandera macro que dispara"""
+        resultado = {'version': self.version, 'fecha': self.fecha, **self.valores,
+                     'riesgo_externo': round(self.riesgo_externo, 2)}
+        if tabla is not None:
+            disparadas = [bandera for bandera, disparada in zip(tabla.banderas, self.banderas(tabla))
+                          if disparada]
+            resultado['bandera_roja'] = ({'id': disparadas[0].id, 'motivo': disparadas[0].motivo}
+                                         if disparadas else None)
+        return resultado
+
+
+class RegistroMacro:
+    """
+    Snapshots conocidos por el proceso y el vigente.
+
+    Args:
+        calcular_riesgo: Función (inflacion, combustible, protestas, desempleo,
+            covid, clima) -> riesgo externo 0-10, la misma que usa el PASO 3 pero
+            sin valor por defecto: debe lanzar una excepción si no puede calcularlo
+        revision_segundos: Cada cuánto se vuelve a leer el snapshot vigente
+    """
+
+    def __init__(self, calcular_riesgo, revision_segundos=REVISION_SEGUNDOS):
+        self.calcular_riesgo = calcular_riesgo
+        self.revision_segundos = revision_segundos
+        self._lock = threading.Lock()
+        self._por_version = {}
+        self._vigente = None
+        self._proxima_revision = 0.0
+        self._error_reportado = False
+
+    def _leer(self, sql, parametros=()):
+        try:
+            filas = consultar(sql, parametros)
+        except sqlite3.OperationalError as e:
+            # Base sin la migración de snapshots (p. ej. herramientas que no llaman init_db)
+            if not self._error_reportado:
+                logger.warning('No se pudieron leer los snapshots macro: %s', e)
+                self._error_reportado = True
+            return None
+        return SnapshotMacro.desde_fila(filas[0]) if filas else None
+
+    def _guardar(self, snapshot):
+        # Una versión nunca cambia, así que el primer objeto leído se reutiliza siempre
+        return self._por_version.setdefault(snapshot.version, snapshot)
+
+    def vigente(self):
+        """Snapshot de mayor versión, o None si todavía no hay ninguno"""
+        if time.monotonic() >= self._proxima_revision:
+            with self._lock:
+                if time.monotonic() >= self._proxima_revision:
+                    self._proxima_revision = time.monotonic() + self.revision_segundos
+                    snapshot = self._leer(f"SELECT {', '.join(COLUMNAS_SNAPSHOT)} FROM snapshots_macro "
+                                          f"ORDER BY version DESC LIMIT 1")
+                    if snapshot is not None:
+                        self._vigente = self._guardar(snapshot)
+        return self._vigente
+
+    def obtener(self, version):
+        """Snapshot de una versión, o None si no existe"""
+        snapshot = self._por_version.get(version)
+        if snapshot is None:
+            snapshot = self._leer(f"SELECT {', '.join(COLUMNAS_SNAPSHOT)} FROM snapshots_macro "
+                                  f"WHERE version = ?", (version,))
+            if snapshot is not None:
+                snapshot = self._guardar(snapshot)
+        return snapshot
+
+    def coincidente(self, macro):
+        """El snapshot vigente si sus valores son exactamente `macro` (en el orden de CAMPOS_MACRO)"""
+        snapshot = self.vigente()
+        if snapshot is not None and snapshot.macro == tuple(macro):
+            return snapshot
+        return None
+
+    def crear(self, valores):
+        """
+        Calcula el riesgo externo de `valores` (dict con CAMPOS_MACRO), guarda el
+        snapshot como nueva versión vigente y lo devuelve.
+
+        Raises:
+            KeyError: Si falta una variable
+            ValueError: Si un valor no es numérico
+            RiesgoNoCalculado: Si falla el cálculo del riesgo externo
+        """
+        valores = {campo: float(valores[campo]) for campo in CAMPOS_MACRO}
+        try:
+            riesgo_externo = float(self.calcular_riesgo(*(valores[campo] for campo in CAMPOS_MACRO)))
+        except Exception as e:
+            raise RiesgoNoCalculado(f'No se pudo calcular el riesgo externo: {e}') from e
+        if not math.isfinite(riesgo_externo):
+            raise RiesgoNoCalculado(f'Riesgo externo inválido: {riesgo_externo}')
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        def insertar():
+            conn = obtener_conexion()
+            with conn:
+                cursor = conn.execute(
+                    f"INSERT INTO snapshots_macro ({', '.join(COLUMNAS_SNAPSHOT[1:])}) "
+                    f"VALUES ({', '.join('?' * (len(COLUMNAS_SNAPSHOT) - 1))})",
+                    (fecha, *(valores[campo] for campo in CAMPOS_MACRO), float(riesgo_externo)))
+            return cursor.lastrowid
+
+        snapshot = SnapshotMacro(con_reintentos(insertar), fecha, valores, riesgo_externo)
+        with self._lock:
+            self._guardar(snapshot)
+            if self._vigente is None or snapshot.version > self._vigente.version:
+                self._vigente = snapshot
+        logger.info('Snapshot macro %d creado (riesgo externo %.2f)', snapshot.version, snapshot.riesgo_externo)
+        return snapshot
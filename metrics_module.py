@@ -0,0 +1,217 @@
+"""
+Métricas de latencia y decisiones en formato de texto de Prometheus (/metrics).
+
+Los histogramas tienen buckets fijos y guardan conteos por bucket (no muestras),
+así que observar un valor cuesta una búsqueda binaria y un incremento. Los tiempos
+por etapa de /predict se toman solo en una fracción de las solicitudes
+(METRICAS_MUESTREO, default 0.1); en las demás el cronómetro es un objeto nulo
+cuyas marcas no hacen nada. Las etapas llevan el nombre del PASO de
+evaluar_solicitud que miden.
+
+Las métricas son por proceso: con varios workers cada scrape ve las del worker
+que atiende /metrics.
+"""
+import bisect
+import os
+import random
+import re
+import threading
+import time
+
+# Fracción de solicitudes con tiempos por etapa (0 = nunca, 1 = todas)
+MUESTREO = float(os.environ.get('METRICAS_MUESTREO', 0.1))
+
+# Límites superiores de los buckets, en segundos (de 5 µs a 2.5 s)
+BUCKETS_SEGUNDOS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_NUMEROS = re.compile(r'\d+(?:\.\d+)?')
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(nombres, valores, extra=''):
+    pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histograma:
+    """Histograma con etiquetas; cada combinación de valores tiene sus propios conteos"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # valores de etiquetas -> [conteos por bucket (+Inf al final), suma]
+        self._series = {}
+
+    def observar(self, valor, *etiquetas):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def exponer(self):
+        with self._lock:
+            series = [(etiquetas, list(conteos), suma) for etiquetas, (conteos, suma) in self._series.items()]
+        lineas = []
+        for etiquetas, conteos, suma in sorted(series):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float('inf'),), conteos):
+                acumulado += conteo
+                le = 'le="+Inf"' if limite == float('inf') else f'le="{limite!r}"'
+                lineas.append(f'{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, le)} {acumulado}')
+            lineas.append(f'{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {_numero(suma)}')
+            lineas.append(f'{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {acumulado}')
+        return lineas
+
+
+class Contador:
+    """Contador monótono con etiquetas"""
+
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def incrementar(self, *etiquetas, valor=1):
+        with self._lock:
+            self._series[etiquetas] = self._series.get(etiquetas, 0) + valor
+
+    def exponer(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        return [f'{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {_numero(valor)}'
+                for etiquetas, valor in series]
+
+
+class Medidor:
+    """Valores leídos al exponer: `funcion` devuelve un número o un dict {etiqueta: número}"""
+
+    tipo = 'gauge'
+
+    def __init__(self, nombre, ayuda, funcion, etiqueta=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.etiqueta = etiqueta
+
+    def exponer(self):
+        valores = self.funcion()
+        if self.etiqueta is None:
+            return [f'{self.nombre} {_numero(valores)}']
+        return [f'{self.nombre}{_etiquetas((self.etiqueta,), (clave,))} {_numero(valor)}'
+                for clave, valor in sorted(valores.items())
+                if isinstance(valor, (int, float)) and not isinstance(valor, bool)]
+
+
+class Registro:
+    """Conjunto de métricas que se exponen juntas"""
+
+    def __init__(self):
+        self._metricas = {}
+
+    def _agregar(self, metrica):
+        self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        return self._agregar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._agregar(Contador(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre, ayuda, funcion, etiqueta=None):
+        return self._agregar(Medidor(nombre, ayuda, funcion, etiqueta))
+
+    def exponer(self):
+        """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)"""
+        lineas = []
+        for metrica in self._metricas.values():
+            lineas.append(f'# HELP {metrica.nombre} {metrica.ayuda}')
+            lineas.append(f'# TYPE {metrica.nombre} {metrica.tipo}')
+            lineas.extend(metrica.exponer())
+        return '\n'.join(lineas) + '\n'
+
+
+# ============ CRONÓMETRO POR ETAPAS ============
+
+class Cronometro:
+    """Registra en `histograma` el tiempo transcurrido desde la marca anterior"""
+
+    __slots__ = ('histograma', '_ultima')
+
+    def __init__(self, histograma):
+        self.histograma = histograma
+        self._ultima = time.perf_counter()
+
+    def marca(self, etapa):
+        ahora = time.perf_counter()
+        self.histograma.observar(ahora - self._ultima, etapa)
+        self._ultima = ahora
+
+
+class _CronometroNulo:
+    """Cronómetro de las solicitudes fuera de la muestra"""
+
+    __slots__ = ()
+
+    def marca(self, etapa):
+        pass
+
+
+CRONOMETRO_NULO = _CronometroNulo()
+
+
+def normalizar_motivo(motivo):
+    """Motivo sin los valores numéricos, para que la etiqueta tenga pocos valores posibles"""
+    return _NUMEROS.sub('#', str(motivo))
+
+
+# ============ MÉTRICAS DE LA APP ============
+
+registro = Registro()
+
+etapas = registro.histograma(
+    'crediticio_etapa_segundos',
+    'Duración de cada etapa de /predict (validacion, paso_1 ... paso_10, persistencia), muestreada',
+    ['etapa'])
+solicitudes_http = registro.histograma(
+    'crediticio_solicitud_segundos', 'Latencia de extremo a extremo por endpoint y código HTTP',
+    ['endpoint', 'codigo'])
+decisiones = registro.contador(
+    'crediticio_decisiones_total', 'Decisiones emitidas por decisión y motivo (números como #)',
+    ['decision', 'motivo'])
+escrituras_auditoria = registro.histograma(
+    'crediticio_auditoria_lote_segundos',
+    'Duración de cada lote del escritor diferido por destino (sqlite, firestore)', ['destino'])
+
+
+def cronometro(muestreo=MUESTREO):
+    """Cronómetro para una solicitud: real con probabilidad `muestreo`, nulo si no"""
+    if muestreo >= 1 or (muestreo > 0 and random.random() < muestreo):
+        return Cronometro(etapas)
+    return CRONOMETRO_NULO
+
+
+def contar_decision(decision, motivo):
+    decisiones.incrementar(str(decision), normalizar_motivo(motivo))
@@ -0,0 +1,491 @@
+"""
+Formato compacto del Random Forest y el scaler como arreglos NumPy planos.
+
+`python model_module.py convertir` guarda los nodos de los 100 árboles (feature,
+umbral, hijos y valores de hoja) y la media/escala del scaler como archivos .npy
+en models/random_forest/. Los workers los abren con mmap, así que comparten las
+páginas a través del caché del sistema operativo en lugar de deserializar cada uno
+su copia del .pkl.
+
+BosqueNumpy reproduce exactamente RandomForestClassifier.predict_proba: convierte
+X a float32 como los árboles de sklearn, compara contra umbrales float64 y suma
+las probabilidades de cada árbol en el mismo orden antes de dividir por la
+cantidad de árboles. Recorre los 100 árboles a la vez (una matriz de nodos
+filas × árboles), así que una fila cuesta lo mismo que unas pocas.
+
+Para predecir desde features sin escalar, `predict_proba_crudo` usa umbrales
+llevados al espacio original: como x -> float32((x - media) / escala) es monótona,
+para cada nodo hay un único float64 T con "float32((x - media) / escala) <= umbral"
+equivalente a "x <= T". Se calcula por bisección al convertir, así que la
+predicción no escala ni convierte a float32 y da los mismos bits que scaler +
+predict_proba. `python model_module.py verificar` lo comprueba.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import warnings
+
+import numpy as np
+
+RUTA_BASE = os.path.dirname(os.path.abspath(__file__))
+RUTA_MODELOS = os.path.join(RUTA_BASE, 'models')
+RUTA_PKL_MODELO = os.path.join(RUTA_MODELOS, 'Random_Forest_modelo_final.pkl')
+RUTA_PKL_SCALER = os.path.join(RUTA_MODELOS, 'scaler_datos.pkl')
+RUTA_ARREGLOS = os.path.join(RUTA_MODELOS, 'random_forest')
+
+# Formato del modelo a cargar: 'auto' (arreglos si están al día con el .pkl, si no
+# el .pkl), 'npy' o 'pkl'
+FORMATO = os.environ.get('MODELO_FORMATO', 'auto')
+
+VERSION_FORMATO = 2
+
+# Nodo hoja en sklearn (children_left == children_right == -1)
+HOJA = -1
+
+logger = logging.getLogger(__name__)
+
+
+def _sha256(ruta):
+    digesto = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(1 << 20), b''):
+            digesto.update(bloque)
+    return digesto.hexdigest()
+
+
+# ============ MODELO EN ARREGLOS ============
+
+class EscaladorNumpy:
+    """StandardScaler.transform con las mismas operaciones en float64"""
+
+    def __init__(self, media, escala):
+        self.media = media
+        self.escala = escala
+        self.n_features_in_ = len(media)
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)  # Copia, como sklearn con copy=True
+        X -= self.media
+        X /= self.escala
+        return X
+
+
+class BosqueNumpy:
+    """
+    Random Forest binario guardado como arreglos planos con todos los árboles
+    concatenados. Los índices de hijos son globales; en las hojas apuntan al
+    propio nodo (con feature 0).
+    """
+
+    def __init__(self, feature, umbral, izquierdo, derecho, valor, raices, profundidades, clases,
+                 umbral_crudo=None):
+        self.feature = feature
+        self.umbral = umbral
+        self.umbral_crudo = umbral_crudo
+        self.izquierdo = izquierdo
+        self.derecho = derecho
+        self.valor = valor
+        self.raices = raices
+        self.profundidades = profundidades
+        self.classes_ = clases
+        self.n_estimators = len(raices)
+        self.n_features_in_ = None
+        self._es_hoja = np.asarray(izquierdo) == np.arange(len(izquierdo))
+
+    def hojas(self, X, umbral):
+        """
+        Hoja de cada fila en cada árbol, shape (filas, árboles). Todos los árboles
+        avanzan un nivel por paso sobre arreglos planos (fila, árbol) y solo se
+        siguen recorriendo los pares que todavía no llegaron a una hoja.
+        """
+        filas, columnas = X.shape
+        plano = np.ascontiguousarray(X).ravel()
+        nodos = np.tile(self.raices.astype(np.intp), filas)
+        inicio_fila = np.repeat(np.arange(filas, dtype=np.intp) * columnas, self.n_estimators)
+        activos = np.flatnonzero(~self._es_hoja[nodos])
+        while activos.size:
+            actuales = nodos[activos]
+            va_izquierda = plano[inicio_fila[activos] + self.feature[actuales]] <= umbral[actuales]
+            siguientes = np.where(va_izquierda, self.izquierdo[actuales], self.derecho[actuales])
+            nodos[activos] = siguientes
+            activos = activos[~self._es_hoja[siguientes]]
+        return nodos.reshape(filas, self.n_estimators)
+
+    def _promediar(self, nodos):
+        # cumsum suma en orden de árbol como el acumulado de sklearn (np.sum usa
+        # suma por pares y puede diferir en el último bit)
+        suma = np.cumsum(self.valor[nodos], axis=1)[:, -1]
+        suma /= self.n_estimators
+        return suma
+
+    def predict_proba(self, X):
+        """Probabilidades para features ya escaladas, igual que modelo.predict_proba"""
+        X32 = np.asarray(X, dtype=np.float32)
+        return self._promediar(self.hojas(X32, self.umbral))
+
+    def predict_proba_crudo(self, X):
+        """Probabilidades para features sin escalar (scaler + predict_proba en un paso)"""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if not np.isfinite(X).all():
+            raise ValueError('Las features contienen NaN o infinito')
+        return self._promediar(self.hojas(X, self.umbral_crudo))
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class MotorSklearn:
+    """Misma interfaz que BosqueNumpy.predict_proba_crudo para el modelo .pkl"""
+
+    def __init__(self, modelo, scaler):
+        self.modelo = modelo
+        self.scaler = scaler
+
+    def predict_proba_crudo(self, X):
+        return self.modelo.predict_proba(self.scaler.transform(X))
+
+
+def crear_motor(modelo, scaler):
+    """Objeto con predict_proba_crudo(features sin escalar) para el par (modelo, scaler)"""
+    if isinstance(modelo, BosqueNumpy):
+        return modelo
+    return MotorSklearn(modelo, scaler)
+
+
+# ============ UMBRALES EN ESPACIO ORIGINAL ============
+
+_SIGNO = np.int64(-2 ** 63)
+_MAGNITUD = np.int64(2 ** 63 - 1)
+
+
+def _a_clave(x):
+    """float64 -> int64 con el mismo orden (para bisecar sobre floats consecutivos)"""
+    bits = np.asarray(x, dtype=np.float64).view(np.int64)
+    return np.where(bits >= 0, bits, -(bits & _MAGNITUD))
+
+
+def _de_clave(clave):
+    bits = np.where(clave >= 0, clave, (-clave) | _SIGNO)
+    return bits.astype(np.int64).view(np.float64)
+
+
+def umbrales_crudos(umbral, media, escala):
+    """
+    Para cada umbral (en espacio escalado) de la feature con `media` y `escala`,
+    el mayor float64 x tal que float32((x - media) / escala) <= umbral.
+    """
+    umbral = np.asarray(umbral, dtype=np.float64)
+
+    def cumple(x):
+        escalado = (x - media) / escala
+        return escalado.astype(np.float32) <= umbral
+
+    # Intervalo inicial alrededor de umbral * escala + media, ampliado hasta que
+    # el extremo inferior cumpla y el superior no
+    centro = umbral * escala + media
+    ancho = (np.abs(umbral) * 2.0 ** -20 + 1e-30) * escala + np.abs(centro) * 2.0 ** -40
+    for _ in range(64):
+        bajo, alto = centro - ancho, centro + ancho
+        malos = ~cumple(bajo) | cumple(alto)
+        if not malos.any():
+            break
+        ancho = np.where(malos, ancho * 16, ancho)
+    else:
+        raise ValueError('No se pudo acotar un umbral en el espacio original')
+
+    bajo, alto = _a_clave(bajo), _a_clave(alto)
+    while True:
+        abiertos = alto - bajo > 1
+        if not abiertos.any():
+            break
+        medio = bajo + (alto - bajo) // 2
+        ok = cumple(_de_clave(medio))
+        bajo = np.where(abiertos & ok, medio, bajo)
+        alto = np.where(abiertos & ~ok, medio, alto)
+    return _de_clave(bajo)
+
+
+def convertir(modelo, scaler, destino=RUTA_ARREGLOS, origen=(RUTA_PKL_MODELO, RUTA_PKL_SCALER)):
+    """
+    Guarda `modelo` (RandomForestClassifier) y `scaler` (StandardScaler) como .npy
+    en `destino`, con un meta.json que registra el hash de los .pkl de origen.
+    """
+    if getattr(modelo, 'n_outputs_', 1) != 1:
+        raise ValueError('Solo se soportan bosques de una salida')
+
+    feature, umbral, izquierdo, derecho, valor, raices, profundidades = [], [], [], [], [], [], []
+    desplazamiento = 0
+    for estimador in modelo.estimators_:
+        arbol = estimador.tree_
+        nodos = arbol.node_count
+        es_hoja = arbol.children_left == HOJA
+        propios = np.arange(desplazamiento, desplazamiento + nodos)
+
+        feature.append(np.where(es_hoja, 0, arbol.feature).astype(np.int32))
+        umbral.append(np.where(es_hoja, 0.0, arbol.threshold).astype(np.float64))
+        izquierdo.append(np.where(es_hoja, propios, arbol.children_left + desplazamiento).astype(np.int32))
+        derecho.append(np.where(es_hoja, propios, arbol.children_right + desplazamiento).astype(np.int32))
+        valor.append(arbol.value[:, 0, :].astype(np.float64))
+        raices.append(desplazamiento)
+        profundidades.append(arbol.max_depth)
+        desplazamiento += nodos
+
+    arreglos = {
+        'feature': np.concatenate(feature),
+        'umbral': np.concatenate(umbral),
+        'izquierdo': np.concatenate(izquierdo),
+        'derecho': np.concatenate(derecho),
+        'valor': np.ascontiguousarray(np.concatenate(valor)),
+        'raices': np.array(raices, dtype=np.int32),
+        'profundidades': np.array(profundidades, dtype=np.int32),
+        'clases': np.asarray(modelo.classes_),
+        'media': np.asarray(scaler.mean_, dtype=np.float64),
+        'escala': np.asarray(scaler.scale_, dtype=np.float64),
+    }
+    columna = arreglos['feature']
+    arreglos['umbral_crudo'] = umbrales_crudos(arreglos['umbral'], arreglos['media'][columna],
+                                               arreglos['escala'][columna])
+
+    os.makedirs(destino, exist_ok=True)
+    for nombre, arreglo in arreglos.items():
+        np.save(os.path.join(destino, f'{nombre}.npy'), arreglo)
+
+    import sklearn
+    meta = {
+        'version_formato': VERSION_FORMATO,
+        'arboles': len(raices),
+        'nodos': desplazamiento,
+        'features': int(scaler.n_features_in_),
+        'sklearn': sklearn.__version__,
+        'sha256_modelo': _sha256(origen[0]) if origen else None,
+        'sha256_scaler': _sha256(origen[1]) if origen else None,
+    }
+    with open(os.path.join(destino, 'meta.json'), 'w', encoding='utf-8') as archivo:
+        json.dump(meta, archivo, indent=2)
+    return meta
+
+
+def cargar_arreglos(directorio=RUTA_ARREGLOS, mmap=True):
+    """
+    Abre el modelo convertido. Con mmap=True los arreglos se mapean en memoria
+    (solo lectura) en vez de copiarse.
+
+    Returns:
+        tuple: (BosqueNumpy, EscaladorNumpy)
+    """
+    with open(os.path.join(directorio, 'meta.json'), encoding='utf-8') as archivo:
+        meta = json.load(archivo)
+    if meta['version_formato'] != VERSION_FORMATO:
+        raise ValueError(f"Formato de modelo {meta['version_formato']} no soportado")
+
+    modo = 'r' if mmap else None
+
+    def abrir(nombre):
+        return np.load(os.path.join(directorio, f'{nombre}.npy'), mmap_mode=modo)
+
+    bosque = BosqueNumpy(abrir('feature'), abrir('umbral'), abrir('izquierdo'), abrir('derecho'),
+                         abrir('valor'), np.array(abrir('raices')), np.array(abrir('profundidades')),
+                         np.array(abrir('clases')), abrir('umbral_crudo'))
+    bosque.n_features_in_ = meta['features']
+    escalador = EscaladorNumpy(np.array(abrir('media')), np.array(abrir('escala')))
+    return bosque, escalador
+
+
+def cargar_pkl():
+    """Modelo y scaler originales de sklearn"""
+    import joblib
+    return joblib.load(RUTA_PKL_MODELO), joblib.load(RUTA_PKL_SCALER)
+
+
+def arreglos_vigentes(directorio=RUTA_ARREGLOS):
+    """True si `directorio` tiene un modelo convertido de los .pkl actuales"""
+    try:
+        with open(os.path.join(directorio, 'meta.json'), encoding='utf-8') as archivo:
+            meta = json.load(archivo)
+    except (OSError, ValueError):
+        return False
+    return (meta.get('version_formato') == VERSION_FORMATO
+            and meta.get('sha256_modelo') == _sha256(RUTA_PKL_MODELO)
+            and meta.get('sha256_scaler') == _sha256(RUTA_PKL_SCALER))
+
+
+def cargar_modelo(formato=None):
+    """
+    Carga (modelo, scaler) en el formato pedido (default MODELO_FORMATO).
+
+    En 'auto' usa los arreglos si corresponden a los .pkl actuales; si el .pkl
+    cambió sin volver a convertir, avisa y carga el .pkl.
+    """
+    formato = formato or FORMATO
+    if formato not in ('auto', 'npy', 'pkl'):
+        raise ValueError(f'MODELO_FORMATO inválido: {formato}')
+    if formato == 'npy' or (formato == 'auto' and arreglos_vigentes()):
+        return cargar_arreglos()
+    if formato == 'auto' and os.path.exists(RUTA_ARREGLOS):
+        logger.warning('%s no corresponde a los .pkl actuales; se carga el .pkl '
+                       '(ejecutar: python model_module.py convertir)', RUTA_ARREGLOS)
+    return cargar_pkl()
+
+
+def cargar_motor(ruta):
+    """
+    Motor (predict_proba_crudo) de otro modelo, p. ej. un retador: `ruta` es un
+    directorio convertido con `python model_module.py convertir --destino` o
+    'modelo.pkl:scaler.pkl'. Las rutas relativas son respecto del proyecto.
+    """
+    rutas = [os.path.join(RUTA_BASE, parte) for parte in ruta.split(':')]
+    if len(rutas) == 1 and os.path.isdir(rutas[0]):
+        return crear_motor(*cargar_arreglos(rutas[0]))
+    if len(rutas) != 2:
+        raise ValueError(f'Modelo inválido: {ruta} (directorio convertido o modelo.pkl:scaler.pkl)')
+    import joblib
+    return crear_motor(joblib.load(rutas[0]), joblib.load(rutas[1]))
+
+
+class CargaPerezosa:
+    """
+    Objeto sustituto que llama a `fabrica` en el primer acceso a un atributo
+    (p. ej. modelo.predict_proba en la primera solicitud) y delega en el resultado.
+    """
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self._objeto = None
+        self._lock = threading.Lock()
+
+    def cargar(self):
+        if self._objeto is None:
+            with self._lock:
+                if self._objeto is None:
+                    self._objeto = self._fabrica()
+        return self._objeto
+
+    @property
+    def cargado(self):
+        return self._objeto is not None
+
+    def __getattr__(self, nombre):
+        return getattr(self.cargar(), nombre)
+
+
+# ============ VERIFICACIÓN ============
+
+def entradas_verificacion(scaler, bosque, muestras=20000, semilla=0):
+    """
+    Entradas para comparar ambos modelos:
+    - crudas: filas aleatorias alrededor de la distribución del scaler (la mitad
+      redondeadas, como las categóricas) y filas con una feature exactamente en el
+      umbral en espacio original de un nodo, o en el float64 siguiente.
+    - escaladas: filas con una feature escalada exactamente en un umbral de los
+      árboles, o en el float32 siguiente.
+    """
+    generador = np.random.default_rng(semilla)
+    media, escala = np.asarray(scaler.mean_), np.asarray(scaler.scale_)
+    X = media + escala * generador.normal(0, 1.5, size=(muestras, len(media)))
+    X[: muestras // 2] = np.round(X[: muestras // 2])
+
+    internos = np.flatnonzero(bosque.izquierdo != np.arange(len(bosque.izquierdo)))
+    elegidos = generador.choice(internos, size=min(muestras, len(internos)), replace=False)
+    posiciones = np.arange(len(elegidos))
+    columnas = bosque.feature[elegidos]
+
+    def alrededor():
+        return media + escala * generador.normal(0, 1, size=(len(elegidos), len(media)))
+
+    en_umbral, siguiente = alrededor(), alrededor()
+    en_umbral[posiciones, columnas] = bosque.umbral_crudo[elegidos]
+    siguiente[posiciones, columnas] = np.nextafter(bosque.umbral_crudo[elegidos], np.inf)
+    crudas = np.vstack([X, en_umbral, siguiente])
+
+    escalado = (alrededor() - media) / escala
+    escalado[posiciones, columnas] = bosque.umbral[elegidos]
+    vecino = escalado.copy()
+    vecino[posiciones, columnas] = np.nextafter(bosque.umbral[elegidos].astype(np.float32), np.float32(np.inf))
+    return crudas, np.vstack([escalado, vecino])
+
+
+def verificar(modelo, scaler, bosque, escalador, muestras=20000, semilla=0):
+    """
+    Compara bit a bit el modelo de sklearn contra los arreglos:
+    - scaler.transform contra EscaladorNumpy.transform
+    - modelo.predict_proba contra BosqueNumpy.predict_proba (features escaladas)
+    - scaler.transform + modelo.predict_proba contra predict_proba_crudo
+    - la fila a fila (como /predict) contra el lote
+
+    Returns:
+        dict: Filas comparadas y qué comparaciones coinciden exactamente
+    """
+    crudas, escaladas = entradas_verificacion(scaler, bosque, muestras, semilla)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # Nombres de features ausentes en arrays sin columnas
+        esperado_escalado = scaler.transform(crudas)
+        esperado_crudo = modelo.predict_proba(esperado_escalado)
+        esperado_escaladas = modelo.predict_proba(escaladas)
+
+    obtenido_crudo = bosque.predict_proba_crudo(crudas)
+    filas = np.random.default_rng(semilla).choice(len(crudas), size=min(2000, len(crudas)), replace=False)
+    fila_a_fila = np.vstack([bosque.predict_proba_crudo(crudas[i]) for i in filas])
+
+    return {
+        'filas': len(crudas) + len(escaladas),
+        'scaler_identico': bool(np.array_equal(esperado_escalado, escalador.transform(crudas))),
+        'probabilidades_identicas': bool(np.array_equal(esperado_escaladas, bosque.predict_proba(escaladas))),
+        'crudo_identico': bool(np.array_equal(esperado_crudo, obtenido_crudo)),
+        'fila_a_fila_identico': bool(np.array_equal(esperado_crudo[filas], fila_a_fila)),
+        'filas_distintas': int(np.count_nonzero(np.any(esperado_crudo != obtenido_crudo, axis=1))),
+        'diferencia_maxima': float(np.max(np.abs(esperado_crudo - obtenido_crudo))),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Conversión del Random Forest a arreglos NumPy')
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+    conversion = subcomandos.add_parser('convertir', help='Convierte los .pkl y verifica el resultado')
+    conversion.add_argument('--destino', default=RUTA_ARREGLOS)
+    conversion.add_argument('--modelo', default=RUTA_PKL_MODELO, help='.pkl del Random Forest (p. ej. un retador)')
+    conversion.add_argument('--scaler', default=RUTA_PKL_SCALER, help='.pkl del StandardScaler')
+    verificacion = subcomandos.add_parser('verificar', help='Compara el modelo convertido con el .pkl')
+    verificacion.add_argument('--muestras', type=int, default=20000)
+    verificacion.add_argument('--semilla', type=int, default=0)
+    subcomandos.add_parser('tiempos', help='Tiempo de carga de cada formato')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'tiempos':
+        for formato in ('pkl', 'npy'):
+            inicio = time.perf_counter()
+            cargar_modelo(formato)
+            print(f'{formato}: {(time.perf_counter() - inicio) * 1000:.1f} ms')
+        return 0
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # Versión de sklearn distinta a la del entrenamiento
+        if args.comando == 'convertir':
+            import joblib
+            modelo, scaler = joblib.load(args.modelo), joblib.load(args.scaler)
+        else:
+            modelo, scaler = cargar_pkl()
+
+    if args.comando == 'convertir':
+        meta = convertir(modelo, scaler, args.destino, origen=(args.modelo, args.scaler))
+        print(json.dumps(meta, indent=2))
+        bosque, escalador = cargar_arreglos(args.destino)
+    else:
+        bosque, escalador = cargar_arreglos()
+
+    resultado = verificar(modelo, scaler, bosque, escalador,
+                          getattr(args, 'muestras', 20000), getattr(args, 'semilla', 0))
+    print(json.dumps(resultado, indent=2))
+    identicos = all(resultado[clave] for clave in ('scaler_identico', 'probabilidades_identicas',
+                                                   'crudo_identico', 'fila_a_fila_identico'))
+    return 0 if identicos else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""
+Reglas de decisión declarativas: descuentos del score del cliente (PASO 2),
+banderas rojas (PASO 4 y 5), penalizaciones de probabilidad (PASO 8) y umbrales
+de la decisión final (PASO 10).
+
+La tabla vive en reglas_decision.json (o en REGLAS_DECISION=ruta) y se compila una
+vez en funciones para una solicitud (dict de valores ya convertidos) y en máscaras
+NumPy para lotes (dict de columnas). Cada evaluación indica qué regla se aplicó.
+MotorReglas vuelve a cargar el archivo cuando cambia, sin reiniciar la app; si la
+nueva tabla es inválida se registra el error y se sigue usando la anterior.
+"""
+import hashlib
+import json
+import logging
+import operator
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+RUTA_BASE = os.path.dirname(os.path.abspath(__file__))
+RUTA_REGLAS = os.environ.get('REGLAS_DECISION', os.path.join(RUTA_BASE, 'reglas_decision.json'))
+
+# Segundos entre revisiones de la fecha de modificación del archivo
+REVISION_SEGUNDOS = float(os.environ.get('REGLAS_REVISION_S', 5))
+
+OPERADORES = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+logger = logging.getLogger(__name__)
+
+BanderaRoja = namedtuple('BanderaRoja', ['id', 'score_final', 'probabilidad', 'motivo'])
+ReglaDecision = namedtuple('ReglaDecision', ['id', 'decision', 'motivo'])
+
+
+# ============ COMPILACIÓN ============
+
+def _compilar_condicion(condicion):
+    """
+    Devuelve (función escalar, función por columnas) para una condición:
+    {"campo", "op", "valor"}, {"campo", "op", "campo_valor", "divisor"} o {"todas": [...]}.
+    Los operadores de `operator` funcionan igual sobre escalares y arreglos NumPy.
+    """
+    if 'todas' in condicion:
+        partes = [_compilar_condicion(c) for c in condicion['todas']]
+        escalares = [p[0] for p in partes]
+        vectoriales = [p[1] for p in partes]
+        return (lambda v: all(f(v) for f in escalares),
+                lambda c: np.logical_and.reduce([f(c) for f in vectoriales]))
+
+    if condicion.get('op') not in OPERADORES:
+        raise ValueError(f"Operador inválido en {condicion}")
+    op = OPERADORES[condicion['op']]
+    campo = condicion['campo']
+
+    if 'campo_valor' in condicion:
+        otro = condicion['campo_valor']
+        divisor = condicion.get('divisor', 1)
+        return (lambda v: op(v[campo], v[otro] / divisor),
+                lambda c: op(c[campo], c[otro] / divisor))
+
+    valor = condicion['valor']
+    return lambda v: op(v[campo], valor), lambda c: op(c[campo], valor)
+
+
+def _campos_condicion(condicion):
+    """Campos que lee una condición"""
+    if 'todas' in condicion:
+        return frozenset().union(*(_campos_condicion(c) for c in condicion['todas']))
+    campos = {condicion['campo']}
+    if 'campo_valor' in condicion:
+        campos.add(condicion['campo_valor'])
+    return frozenset(campos)
+
+
+class _Ajuste:
+    """
+    Regla que suma puntos según un campo: 'categoria' (puntos por valor),
+    'escalones' (primer umbral que cumple) o 'bandera' (campo booleano igual a `si`).
+    """
+
+    def __init__(self, definicion):
+        self.id = definicion['id']
+        self.tipo = definicion['tipo']
+        self.campo = definicion['campo']
+        if self.tipo == 'categoria':
+            self.puntos = dict(definicion['puntos'])
+            self.defecto = definicion.get('defecto')
+        elif self.tipo == 'escalones':
+            if definicion.get('op', '>') not in OPERADORES:
+                raise ValueError(f"Operador inválido en {self.id}")
+            self.op = OPERADORES[definicion.get('op', '>')]
+            self.escalones = [(umbral, puntos) for umbral, puntos in definicion['escalones']]
+        elif self.tipo == 'bandera':
+            self.si = bool(definicion['si'])
+            self.puntos = definicion['puntos']
+        else:
+            raise ValueError(f"Tipo de regla inválido en {self.id}: {self.tipo}")
+
+    def evaluar(self, valores):
+        """Puntos para una solicitud (0 si la regla no aplica)"""
+        valor = valores.get(self.campo)
+        if self.tipo == 'categoria':
+            return self.puntos.get(self.defecto if valor is None else valor, 0)
+        if self.tipo == 'escalones':
+            for umbral, puntos in self.escalones:
+                if self.op(valor, umbral):
+                    return puntos
+            return 0
+        return self.puntos if bool(valor) == self.si else 0
+
+    def evaluar_lote(self, columnas):
+        """Puntos por fila (float64)"""
+        columna = columnas[self.campo]
+        if self.tipo == 'categoria':
+            return np.array([self.puntos.get(self.defecto if v is None else v, 0) for v in columna],
+                            dtype=np.float64)
+        if self.tipo == 'escalones':
+            return np.select([self.op(columna, umbral) for umbral, _ in self.escalones],
+                             [puntos for _, puntos in self.escalones], 0).astype(np.float64)
+        return np.where(np.asarray(columna, dtype=bool) == self.si, self.puntos, 0).astype(np.float64)
+
+
+class TablaReglas:
+    """Tabla de reglas compilada (inmutable; recargar crea otra)"""
+
+    def __init__(self, definicion, origen=None):
+        self.version = definicion.get('version')
+        self.origen = origen
+        # Hash de la definición completa: cambia con cualquier edición aunque no se
+        # actualice "version" (lo usa la caché idempotente)
+        self.huella = hashlib.sha256(json.dumps(definicion, sort_keys=True, ensure_ascii=False)
+                                     .encode('utf-8')).hexdigest()
+
+        score = definicion['score_cliente']
+        self.score_base = score['base']
+        self.score_minimo = score['minimo']
+        self.score_maximo = score['maximo']
+        self.descuentos = [_Ajuste(d) for d in score['descuentos']]
+        self.penalizaciones = [_Ajuste(d) for d in definicion['penalizaciones']]
+
+        self.banderas = []
+        self._condiciones_banderas = []
+        self._campos_banderas = []
+        for regla in definicion['banderas_rojas']:
+            self.banderas.append(BanderaRoja(regla['id'], float(regla['score_final']),
+                                             float(regla['probabilidad']), regla['motivo']))
+            self._condiciones_banderas.append(_compilar_condicion(regla['condicion']))
+            self._campos_banderas.append(_campos_condicion(regla['condicion']))
+
+        final = definicion['decision_final']
+        self.reglas_decision = []
+        self._condiciones_decision = []
+        for regla in final['reglas']:
+            self.reglas_decision.append(ReglaDecision(regla['id'], regla['decision'], regla['motivo']))
+            self._condiciones_decision.append(_compilar_condicion(regla['condicion']))
+        aprobacion = final['aprobacion']
+        self.aprobacion = ReglaDecision(aprobacion['id'], aprobacion['decision'], aprobacion['motivo'])
+
+    @classmethod
+    def desde_archivo(cls, ruta):
+        with open(ruta, encoding='utf-8') as archivo:
+            return cls(json.load(archivo), origen=ruta)
+
+    # ============ UNA SOLICITUD ============
+
+    def score_cliente(self, valores):
+        """
+        Returns:
+            tuple: (score entre minimo y maximo, [(id, puntos descontados), ...])
+        """
+        score = self.score_base
+        aplicadas = []
+        for descuento in self.descuentos:
+            puntos = descuento.evaluar(valores)
+            if puntos:
+                score -= puntos
+                aplicadas.append((descuento.id, puntos))
+        return max(self.score_minimo, min(self.score_maximo, score)), aplicadas
+
+    def banderas_precalculadas(self, valores):
+        """
+        Resultado de cada bandera que solo lee campos de `valores` (None para las
+        demás). Con los valores de un snapshot macro se evalúan una vez las banderas
+        macroeconómicas y bandera_roja() las reutiliza en cada solicitud.
+        """
+        return tuple(condicion(valores) if campos <= valores.keys() else None
+                     for campos, (condicion, _) in zip(self._campos_banderas, self._condiciones_banderas))
+
+    def bandera_roja(self, valores, precalculadas=None):
+        """Primera bandera roja que dispara (BanderaRoja) o None"""
+        for indice, (bandera, (condicion, _)) in enumerate(zip(self.banderas, self._condiciones_banderas)):
+            disparada = precalculadas[indice] if precalculadas is not None else None
+            if disparada is None:
+                disparada = condicion(valores)
+            if disparada:
+                return bandera
+        return None
+
+    def penalizar(self, prob_base, valores):
+        """
+        Returns:
+            tuple: (prob_base con las penalizaciones sumadas, [(id, penalización), ...])
+        """
+        aplicadas = []
+        for penalizacion in self.penalizaciones:
+            puntos = penalizacion.evaluar(valores)
+            if puntos:
+                prob_base += puntos
+                aplicadas.append((penalizacion.id, puntos))
+        return prob_base, aplicadas
+
+    def decision_final(self, valores):
+        """
+        `valores` debe incluir score_final, probabilidad y score_cliente.
+
+        Returns:
+            tuple: (regla aplicada, decisión, motivo con los valores ya formateados)
+        """
+        regla = self.aprobacion
+        for candidata, (condicion, _) in zip(self.reglas_decision, self._condiciones_decision):
+            if condicion(valores):
+                regla = candidata
+                break
+        return regla, regla.decision, regla.motivo.format(**valores)
+
+    # ============ LOTES (COLUMNAS NUMPY) ============
+
+    def score_cliente_lote(self, columnas):
+        n = len(columnas[self.descuentos[0].campo]) if self.descuentos else 0
+        score = np.full(n, float(self.score_base))
+        for descuento in self.descuentos:
+            score -= descuento.evaluar_lote(columnas)
+        return np.clip(score, self.score_minimo, self.score_maximo)
+
+    def banderas_rojas_lote(self, columnas, n, fijas=None):
+        """
+        Índice en self.banderas de la primera bandera que dispara por fila (-1 si ninguna).
+        `n` es la cantidad de filas o la forma del resultado, si las columnas se
+        combinan por broadcasting (p. ej. escenarios × solicitudes). `fijas` da el
+        resultado ya conocido de algunas banderas ({índice: arreglo bool}), p. ej. las
+        que leen campos que no están en `columnas`.
+        """
+        disparada = np.full(n, -1, dtype=np.intp)
+        for indice, (_, condicion) in enumerate(self._condiciones_banderas):
+            resultado = fijas[indice] if fijas and indice in fijas else condicion(columnas)
+            nuevas = (disparada == -1) & np.broadcast_to(resultado, disparada.shape)
+            disparada[nuevas] = indice
+        return disparada
+
+    def campos_bandera(self, indice):
+        """Campos que lee la condición de self.banderas[indice]"""
+        return self._campos_banderas[indice]
+
+    def penalizar_lote(self, prob_base, columnas):
+        # Una suma por regla en el mismo orden que penalizar(), así que da los mismos bits
+        for penalizacion in self.penalizaciones:
+            prob_base = prob_base + penalizacion.evaluar_lote(columnas)
+        return prob_base
+
+    def decision_final_lote(self, columnas, n):
+        """Índice en self.reglas_decision por fila (-1 = aprobación); `n` como en banderas_rojas_lote"""
+        aplicada = np.full(n, -1, dtype=np.intp)
+        for indice, (_, condicion) in enumerate(self._condiciones_decision):
+            nuevas = (aplicada == -1) & np.broadcast_to(condicion(columnas), aplicada.shape)
+            aplicada[nuevas] = indice
+        return aplicada
+
+    def regla_decision(self, indice):
+        return self.aprobacion if indice < 0 else self.reglas_decision[indice]
+
+
+class MotorReglas:
+    """
+    Tabla de reglas vigente. `actual()` revisa cada REVISION_SEGUNDOS si el archivo
+    cambió y, si es así, compila la nueva versión.
+    """
+
+    def __init__(self, ruta=RUTA_REGLAS, revision_segundos=REVISION_SEGUNDOS):
+        self.ruta = ruta
+        self.revision_segundos = revision_segundos
+        self._lock = threading.Lock()
+        self._mtime = os.stat(ruta).st_mtime_ns
+        self._mtime_fallido = None
+        self._tabla = TablaReglas.desde_archivo(ruta)
+        self._proxima_revision = time.monotonic() + revision_segundos
+
+    def actual(self):
+        if time.monotonic() >= self._proxima_revision:
+            self.recargar()
+        return self._tabla
+
+    def recargar(self, forzar=False):
+        """Vuelve a compilar la tabla si el archivo cambió. Devuelve True si la reemplazó."""
+        with self._lock:
+            self._proxima_revision = time.monotonic() + self.revision_segundos
+            mtime = None
+            try:
+                mtime = os.stat(self.ruta).st_mtime_ns
+                if mtime == self._mtime and not forzar:
+                    return False
+                tabla = TablaReglas.desde_archivo(self.ruta)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Se registra una vez por versión del archivo, no en cada revisión
+                if mtime != self._mtime_fallido or forzar:
+                    logger.error('No se pudo recargar %s, se mantiene la tabla anterior: %s', self.ruta, e)
+                self._mtime = self._mtime_fallido = mtime
+                return False
+            self._tabla = tabla
+            self._mtime = mtime
+            logger.info('Reglas de decisión recargadas desde %s (versión %s)', self.ruta, tabla.version)
+            return True
@@ -0,0 +1,330 @@
+"""
+Modelos retadores en sombra (champion/challenger).
+
+Cada solicitud que llega al PASO 7 deja en una cola acotada su fila de features
+ya codificada, las columnas que usan las reglas y la decisión del modelo campeón.
+Un hilo de fondo la vacía por lotes: cada retador (modelo + scaler) predice sobre
+las mismas features, y con sus probabilidades se repiten los PASOS 8 a 10 (mismas
+penalizaciones, score final y reglas de decisión) para obtener la decisión que
+habría tomado. Campeón y retadores se guardan lado a lado en evaluaciones_sombra.
+
+Nada de esto toca la respuesta: si la cola está llena el trabajo se descarta (y se
+cuenta) en lugar de acumularse, y el hilo procesa como mucho TAMANO_LOTE filas por
+vez para no retener el GIL durante lotes grandes de /predict/batch.
+
+Configuración:
+    MODELOS_RETADORES="rf_2026=models/retador_2026,rf_pkl=models/r.pkl:models/s.pkl"
+        nombre=ruta separados por coma; la ruta es un directorio convertido con
+        `python model_module.py convertir --modelo ... --scaler ... --destino ...`
+        o 'modelo.pkl:scaler.pkl' (ver model_module.cargar_motor)
+    SOMBRA_MUESTREO     Fracción de solicitudes que se evalúan en sombra (default 1)
+    SOMBRA_COLA_MAX     Envíos en cola antes de descartar (default 256)
+    SOMBRA_LOTE         Filas por llamada a cada retador (default 256)
+    SOMBRA_INTERVALO_MS Espera máxima para juntar un lote (default 100)
+    SOMBRA_NICE         Prioridad (nice) del hilo en Linux (default 10; 0 = sin cambio)
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from db_module import consultar, ejecutar_escritura
+from model_module import cargar_motor
+
+logger = logging.getLogger(__name__)
+
+MUESTREO = float(os.environ.get('SOMBRA_MUESTREO', 1))
+CAPACIDAD_COLA = int(os.environ.get('SOMBRA_COLA_MAX', 256))
+TAMANO_LOTE = int(os.environ.get('SOMBRA_LOTE', 256))
+INTERVALO_MS = int(os.environ.get('SOMBRA_INTERVALO_MS', 100))
+NICE = int(os.environ.get('SOMBRA_NICE', 10))
+
+INSERT_SOMBRA = '''INSERT INTO evaluaciones_sombra
+    (fecha, modelo, prob_campeon, decision_campeon, score_final_campeon,
+     prob_retador, decision_retador, score_final_retador)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+
+_FIN = object()
+
+
+def leer_retadores(especificacion):
+    """{nombre: ruta} a partir de 'nombre=ruta,nombre=ruta'"""
+    retadores = {}
+    for parte in especificacion.split(','):
+        if not parte.strip():
+            continue
+        nombre, separador, ruta = parte.partition('=')
+        if not separador or not nombre.strip() or not ruta.strip():
+            raise ValueError(f'Retador inválido: {parte!r} (se espera nombre=ruta)')
+        retadores[nombre.strip()] = ruta.strip()
+    return retadores
+
+
+class _Envio:
+    """Filas de una solicitud (o de un lote) pendientes de evaluar en sombra"""
+    __slots__ = ('fecha', 'features', 'columnas', 'prob', 'decision', 'score_final', 'reglas')
+
+    def __init__(self, features, columnas, prob, decision, score_final, reglas):
+        self.fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.features = features
+        self.columnas = columnas
+        self.prob = prob
+        self.decision = decision
+        self.score_final = score_final
+        self.reglas = reglas
+
+
+class EvaluadorSombra:
+    """
+    Evalúa retadores fuera del camino de la solicitud.
+
+    `motores` es {nombre: objeto con predict_proba_crudo} y `combinar_score_final`
+    la función del PASO 9 (se recibe para no importar decision_module). El hilo se
+    inicia en el primer envío de cada proceso, así que es seguro crear el
+    evaluador antes de un fork.
+    """
+
+    def __init__(self, motores, combinar_score_final, muestreo=MUESTREO, capacidad=CAPACIDAD_COLA,
+                 tamano_lote=TAMANO_LOTE, intervalo_ms=INTERVALO_MS, nice=NICE):
+        self.motores = dict(motores)
+        self.combinar_score_final = combinar_score_final
+        self.muestreo = muestreo
+        self.capacidad = capacidad
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo_ms / 1000
+        self.nice = nice
+        self._lock = threading.Lock()
+        self._pid = None
+        self._hilo = None
+        self._cola = None
+        self.contadores = {'encoladas': 0, 'descartadas': 0, 'omitidas_muestreo': 0,
+                           'evaluadas': 0, 'lotes': 0, 'errores': 0}
+
+    @classmethod
+    def desde_entorno(cls, combinar_score_final, especificacion=None):
+        """Evaluador con los retadores de MODELOS_RETADORES, o None si no hay ninguno"""
+        if especificacion is None:
+            especificacion = os.environ.get('MODELOS_RETADORES', '')
+        retadores = leer_retadores(especificacion)
+        if not retadores:
+            return None
+        motores = {nombre: cargar_motor(ruta) for nombre, ruta in retadores.items()}
+        logger.info('Modelos retadores en sombra: %s', ', '.join(motores))
+        return cls(motores, combinar_score_final)
+
+    # ============ CICLO DE VIDA ============
+
+    def _asegurar_iniciado(self):
+        if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+                return
+            self._pid = os.getpid()
+            self._cola = queue.Queue(maxsize=self.capacidad)
+            self._hilo = threading.Thread(target=self._ciclo, name='sombra-retadores', daemon=True)
+            self._hilo.start()
+
+    def detener(self, timeout=10):
+        """Evalúa lo pendiente y detiene el hilo (se llama también al salir)"""
+        if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+            return
+        self._cola.put(_FIN)
+        self._hilo.join(timeout)
+
+    def vaciar(self, timeout=10):
+        """Bloquea hasta que todo lo encolado hasta ahora esté evaluado y guardado"""
+        if self._hilo is None or self._pid != os.getpid():
+            return True
+        evento = threading.Event()
+        self._cola.put(evento)
+        return evento.wait(timeout)
+
+    # ============ ENVÍO (EN EL HILO DE LA SOLICITUD) ============
+
+    def enviar(self, features, columnas, prob, decision, score_final, reglas):
+        """
+        Encola filas ya decididas por el campeón; nunca bloquea.
+
+        Args:
+            features: Matriz (n, 32) sin escalar; no debe modificarse después
+            columnas: Valores de las reglas (escalares para una solicitud o
+                arreglos de largo n para un lote)
+            prob, decision, score_final: Resultado del campeón (escalares o arreglos)
+            reglas: Reglas con las que decidió el campeón
+
+        Returns:
+            bool: False si se descartó (muestreo o cola llena)
+        """
+        # Los contadores se suman bajo el lock: los comparten los hilos de las solicitudes
+        # (gunicorn con hilos, pool del modo ASGI) y el de evaluación
+        if self.muestreo < 1 and random.random() >= self.muestreo:
+            with self._lock:
+                self.contadores['omitidas_muestreo'] += 1
+            return False
+        self._asegurar_iniciado()
+        try:
+            self._cola.put_nowait(_Envio(features, columnas, prob, decision, score_final, reglas))
+        except queue.Full:
+            with self._lock:
+                self.contadores['descartadas'] += len(features)
+            return False
+        with self._lock:
+            self.contadores['encoladas'] += len(features)
+        return True
+
+    # ============ HILO DE EVALUACIÓN ============
+
+    def _ciclo(self):
+        if self.nice:
+            try:
+                # En Linux la prioridad es por hilo: cede CPU a los que atienden solicitudes
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+            except (AttributeError, OSError):
+                pass
+        while True:
+            item = self._cola.get()
+            if item is _FIN:
+                break
+            envios, eventos = [], []
+            filas = 0
+            limite = time.monotonic() + self.intervalo
+            while True:
+                if isinstance(item, threading.Event):
+                    eventos.append(item)
+                elif item is _FIN:
+                    self._procesar(envios)
+                    self._avisar(eventos)
+                    return
+                else:
+                    envios.append(item)
+                    filas += len(item.features)
+                if filas >= self.tamano_lote or eventos:
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+            self._procesar(envios)
+            self._avisar(eventos)
+
+    @staticmethod
+    def _avisar(eventos):
+        for evento in eventos:
+            evento.set()
+
+    def _procesar(self, envios):
+        if not envios:
+            return
+        try:
+            filas = []
+            # Las reglas pueden haber cambiado entre envíos: se agrupan por versión
+            grupos = {}
+            for envio in envios:
+                grupos.setdefault(id(envio.reglas), []).append(envio)
+            for grupo in grupos.values():
+                filas.extend(self._evaluar_grupo(grupo))
+            ejecutar_escritura(INSERT_SOMBRA, filas, muchos=True)
+            with self._lock:
+                self.contadores['evaluadas'] += len(filas) // max(len(self.motores), 1)
+                self.contadores['lotes'] += 1
+        except Exception:
+            with self._lock:
+                self.contadores['errores'] += 1
+            logger.exception('Error al evaluar modelos retadores')
+
+    def _evaluar_grupo(self, envios):
+        """Filas de INSERT_SOMBRA para envíos decididos con las mismas reglas"""
+        reglas = envios[0].reglas
+        features = np.concatenate([envio.features for envio in envios])
+        n = len(features)
+        columnas = {campo: np.concatenate([np.atleast_1d(envio.columnas[campo]) for envio in envios])
+                    for campo in envios[0].columnas}
+        prob_c = np.concatenate([np.atleast_1d(envio.prob) for envio in envios]).astype(np.float64)
+        score_c = np.concatenate([np.atleast_1d(envio.score_final) for envio in envios]).astype(np.float64)
+        decision_c = np.concatenate([np.atleast_1d(np.asarray(envio.decision, dtype=object))
+                                     for envio in envios])
+        fechas = np.concatenate([np.full(len(envio.features), envio.fecha, dtype=object) for envio in envios])
+        decisiones = np.array([reglas.regla_decision(i).decision
+                               for i in range(-1, len(reglas.reglas_decision))], dtype=object)
+
+        filas = []
+        for nombre, motor in self.motores.items():
+            for inicio in range(0, n, self.tamano_lote):
+                parte = slice(inicio, min(inicio + self.tamano_lote, n))
+                columnas_p = {campo: columna[parte] for campo, columna in columnas.items()}
+                # ============ PASO 7 a 10 CON EL RETADOR ============
+                prob_base = motor.predict_proba_crudo(features[parte])[:, 1]
+                prob = np.minimum(100.0, reglas.penalizar_lote(prob_base, columnas_p) * 100)
+                score = self.combinar_score_final(columnas_p['score_cliente'], columnas_p['riesgo_externo'], prob)
+                columnas_p.update(score_final=score, probabilidad=prob)
+                decision = decisiones[reglas.decision_final_lote(columnas_p, len(prob)) + 1]
+                filas.extend(zip(fechas[parte].tolist(), [nombre] * len(prob), prob_c[parte].tolist(),
+                                 decision_c[parte].tolist(), score_c[parte].tolist(), prob.tolist(),
+                                 decision.tolist(), score.tolist()))
+        return filas
+
+    # ============ ESTADÍSTICAS ============
+
+    def estadisticas(self):
+        """Contadores de este proceso"""
+        with self._lock:
+            estadisticas = dict(self.contadores)
+        estadisticas['en_cola'] = self._cola.qsize() if self._cola is not None else 0
+        estadisticas['retadores'] = len(self.motores)
+        return estadisticas
+
+
+def reporte_concordancia(desde=None, modelo=None):
+    """
+    Concordancia campeón/retador por modelo, leída de evaluaciones_sombra (todos los workers).
+
+    Args:
+        desde: Fecha u hora mínima ('YYYY-MM-DD' o 'YYYY-MM-DD HH:MM:SS')
+        modelo: Limitar a un retador
+
+    Returns:
+        dict: {modelo: {'total', 'concordancia' (fracción con la misma decisión),
+        'matriz' ({decisión campeón: {decisión retador: n}}), 'prob_campeon_promedio',
+        'prob_retador_promedio', 'diferencia_prob_promedio' (media de |retador - campeón|),
+        'diferencia_prob_max', 'desde', 'hasta'}}
+    """
+    condiciones, parametros = [], []
+    if desde:
+        condiciones.append('fecha >= ?')
+        parametros.append(desde)
+    if modelo:
+        condiciones.append('modelo = ?')
+        parametros.append(modelo)
+    donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+
+    reporte = {}
+    for fila in consultar(f'''SELECT modelo, COUNT(*), SUM(decision_campeon = decision_retador),
+            AVG(prob_campeon), AVG(prob_retador), AVG(ABS(prob_retador - prob_campeon)),
+            MAX(ABS(prob_retador - prob_campeon)), MIN(fecha), MAX(fecha)
+            FROM evaluaciones_sombra {donde} GROUP BY modelo ORDER BY modelo''', parametros):
+        total = fila[1]
+        reporte[fila[0]] = {
+            'total': total,
+            'concordancia': round(fila[2] / total, 4) if total else 0.0,
+            'matriz': {},
+            'prob_campeon_promedio': round(fila[3], 2),
+            'prob_retador_promedio': round(fila[4], 2),
+            'diferencia_prob_promedio': round(fila[5], 2),
+            'diferencia_prob_max': round(fila[6], 2),
+            'desde': fila[7],
+            'hasta': fila[8],
+        }
+    for nombre, campeon, retador, total in consultar(f'''SELECT modelo, decision_campeon, decision_retador,
+            COUNT(*) FROM evaluaciones_sombra {donde}
+            GROUP BY modelo, decision_campeon, decision_retador''', parametros):
+        reporte[nombre]['matriz'].setdefault(campeon, {})[retador] = total
+    return reporte
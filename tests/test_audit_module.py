@@ -0,0 +1,119 @@
+"""
+Escritor diferido de auditoría con FirestoreLocal: reintentos cuando Firestore
+falla y recuperación de los archivos de derrame de un proceso caído.
+
+Uso:
+    python -m pytest tests
+"""
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+import db_module  # noqa: E402
+from audit_module import EscritorDiferido, FirestoreLocal  # noqa: E402
+
+INSERT = 'INSERT INTO decisiones (nombre, decision) VALUES (?, ?)'
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """historial.db temporal con una tabla mínima para el INSERT de prueba"""
+    monkeypatch.setattr(db_module, 'RUTA_DB', str(tmp_path / 'historial.db'))
+    db_module.cerrar_conexion()
+    db_module.ejecutar_escritura('CREATE TABLE decisiones (nombre TEXT, decision TEXT)')
+    yield tmp_path
+    db_module.cerrar_conexion()
+
+
+def _filas():
+    return [tuple(fila) for fila in db_module.consultar('SELECT nombre, decision FROM decisiones ORDER BY nombre')]
+
+
+def _esperar(condicion, timeout=5):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        if time.monotonic() > limite:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _pid_terminado():
+    proceso = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proceso.wait()
+    return proceso.pid
+
+
+def _escritor(base, firestore, **opciones):
+    return EscritorDiferido(INSERT, firestore=firestore, intervalo_ms=10, modo='diferido',
+                            ruta_derrame=str(base / 'derrame'), **opciones)
+
+
+def test_documentos_rechazados_por_firestore_se_reintentan(base):
+    firestore = FirestoreLocal(str(base / 'firestore.ndjson'), fallas=1)
+    escritor = _escritor(base, firestore, reintento_remoto_s=0.05)
+    escritor.registrar_lote([((f'Cliente {i}', 'APROBADO'), {'nombre': f'Cliente {i}'}) for i in range(3)])
+    assert escritor.vaciar()
+
+    # SQLite ya tiene el lote; Firestore no, pero los documentos quedaron en el derrame remoto
+    assert len(_filas()) == 3
+    assert firestore.documentos() == []
+    assert escritor.estadisticas()['pendientes_remotos'] == 3
+    (segmento,) = glob.glob(str(base / 'derrame' / f'remoto_{os.getpid()}_*.ndjson'))
+    with open(segmento, encoding='utf-8') as archivo:
+        assert len(archivo.readlines()) == 3
+
+    assert _esperar(lambda: escritor.contadores['remotos_recuperados'] == 3)
+    assert sorted(d['datos']['nombre'] for d in firestore.documentos()) == ['Cliente 0', 'Cliente 1', 'Cliente 2']
+    assert len(_filas()) == 3  # El reintento no vuelve a escribir en SQLite
+    escritor.detener()
+    assert glob.glob(str(base / 'derrame' / '*.ndjson')) == []
+
+
+def test_firestore_caido_al_detener_conserva_los_documentos(base):
+    firestore = FirestoreLocal(str(base / 'firestore.ndjson'), fallas=1000)
+    escritor = _escritor(base, firestore, reintento_remoto_s=60)
+    escritor.registrar(('Cliente 0', 'RECHAZADO'), {'nombre': 'Cliente 0'})
+    escritor.detener()
+
+    assert _filas() == [('Cliente 0', 'RECHAZADO')]
+    assert glob.glob(str(base / 'derrame' / 'pendiente_*.ndjson')) == []
+    (segmento,) = glob.glob(str(base / 'derrame' / 'remoto_*.ndjson'))
+    with open(segmento, encoding='utf-8') as archivo:
+        assert [json.loads(linea) for linea in archivo] == [{'nombre': 'Cliente 0'}]
+
+
+def test_recupera_el_derrame_de_un_proceso_caido(base):
+    directorio = base / 'derrame'
+    directorio.mkdir()
+    pid = _pid_terminado()
+    # Lo que deja un proceso que murió con decisiones en cola (la última línea a medio escribir)
+    # y con documentos que Firestore le había rechazado
+    with open(directorio / f'pendiente_{pid}_0.ndjson', 'w', encoding='utf-8') as archivo:
+        for i in range(2):
+            archivo.write(json.dumps({'fila': [f'Caído {i}', 'APROBADO'], 'documento': {'nombre': f'Caído {i}'}}) + '\n')
+        archivo.write('{"fila": ["Caído 2"')
+    with open(directorio / f'remoto_{pid}_0.ndjson', 'w', encoding='utf-8') as archivo:
+        archivo.write(json.dumps({'nombre': 'Rechazado antes'}) + '\n')
+
+    firestore = FirestoreLocal(str(base / 'firestore.ndjson'))
+    escritor = _escritor(base, firestore)
+    escritor.registrar(('Nuevo', 'REVISIÓN MANUAL'), {'nombre': 'Nuevo'})
+    assert escritor.vaciar()
+
+    assert _filas() == [('Caído 0', 'APROBADO'), ('Caído 1', 'APROBADO'), ('Nuevo', 'REVISIÓN MANUAL')]
+    assert sorted(d['datos']['nombre'] for d in firestore.documentos()) == [
+        'Caído 0', 'Caído 1', 'Nuevo', 'Rechazado antes']
+    estadisticas = escritor.estadisticas()
+    assert estadisticas['recuperados'] == 2
+    assert estadisticas['remotos_recuperados'] == 1
+    escritor.detener()
+    assert os.listdir(directorio) == []
@@ -0,0 +1,81 @@
+"""
+Paridad del riesgo difuso: el motor compartido (pool de simulaciones) contra un
+ControlSystemSimulation recién construido, y el evaluador vectorizado de lotes
+contra el motor, sobre entradas con semilla fija.
+"""
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+from skfuzzy import control as ctrl
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+import fuzzy_module  # noqa: E402
+from fuzzy_module import VARIABLES, calcular_riesgo_difuso, calcular_riesgo_difuso_lote  # noqa: E402
+
+MUESTRAS = 40
+SEMILLA = 3
+
+# skfuzzy llama a np.maximum/np.minimum con argumentos posicionales obsoletos
+pytestmark = pytest.mark.filterwarnings('ignore::DeprecationWarning')
+
+
+@pytest.fixture(scope='module')
+def entradas():
+    """Filas (inflacion, ..., clima): aleatorias en cada universo y algo fuera de él, y valores enteros"""
+    generador = np.random.default_rng(SEMILLA)
+    columnas = []
+    for inicio, fin, _ in VARIABLES.values():
+        margen = (fin - inicio) * 0.1
+        columnas.append(generador.uniform(inicio - margen if inicio < 0 else inicio, fin + margen, MUESTRAS))
+    filas = np.column_stack(columnas)
+    filas[: MUESTRAS // 3] = np.round(filas[: MUESTRAS // 3])
+    return [tuple(float(valor) for valor in fila) for fila in filas]
+
+
+@pytest.fixture(scope='module')
+def sistema_nuevo():
+    """Simulación construida aparte del pool del motor, con las opciones por defecto de skfuzzy"""
+    return ctrl.ControlSystemSimulation(fuzzy_module.construir_sistema())
+
+
+def _riesgo_sistema_nuevo(sistema, inflacion, combustible, protestas, desempleo, covid, clima):
+    for nombre, valor in fuzzy_module._limitar_entradas(inflacion, combustible, protestas,
+                                                         desempleo, covid, clima).items():
+        sistema.input[nombre] = valor
+    sistema.compute()
+    return fuzzy_module.ajustar_riesgo(sistema.output['riesgo'], inflacion, combustible, protestas,
+                                       desempleo, covid, clima)
+
+
+def test_motor_compartido_igual_que_un_sistema_nuevo(entradas, sistema_nuevo):
+    # Tolerancia 0: mismo sistema, misma defuzzificación
+    for fila in entradas:
+        assert calcular_riesgo_difuso(*fila) == _riesgo_sistema_nuevo(sistema_nuevo, *fila), fila
+
+
+def test_hilos_concurrentes_no_se_pisan(entradas):
+    entradas = entradas[:10]
+    esperado = [calcular_riesgo_difuso(*fila) for fila in entradas]
+    resultados = {}
+
+    def hilo(indice):
+        resultados[indice] = [calcular_riesgo_difuso(*fila) for fila in entradas]
+
+    hilos = [threading.Thread(target=hilo, args=(i,)) for i in range(4)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert all(resultado == esperado for resultado in resultados.values())
+
+
+def test_lote_igual_que_fila_a_fila(entradas):
+    # EvaluadorDifusoVectorizado coincide con el motor hasta ~1e-12 antes de redondear
+    esperado = np.array([calcular_riesgo_difuso(*fila) for fila in entradas])
+    lote = calcular_riesgo_difuso_lote(*np.array(entradas).T)
+    np.testing.assert_allclose(lote, esperado, rtol=0, atol=1e-9)
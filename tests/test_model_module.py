@@ -0,0 +1,69 @@
+"""
+Paridad del Random Forest en arreglos NumPy (models/random_forest) con el .pkl de
+sklearn: las mismas comparaciones que `python model_module.py verificar`, sobre
+una muestra chica con semilla fija.
+"""
+import os
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUTA_PROYECTO)
+
+import model_module  # noqa: E402
+
+MUESTRAS = 500
+SEMILLA = 7
+
+
+@pytest.fixture(scope='module')
+def modelos():
+    if not model_module.arreglos_vigentes():
+        pytest.skip('models/random_forest no está al día con los .pkl (python model_module.py convertir)')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # Versión de sklearn distinta a la del entrenamiento
+        modelo, scaler = model_module.cargar_pkl()
+    bosque, escalador = model_module.cargar_arreglos()
+    return modelo, scaler, bosque, escalador
+
+
+def test_verificar_coincide_bit_a_bit(modelos):
+    resultado = model_module.verificar(*modelos, muestras=MUESTRAS, semilla=SEMILLA)
+    assert resultado['scaler_identico']
+    assert resultado['probabilidades_identicas']
+    assert resultado['crudo_identico']
+    assert resultado['fila_a_fila_identico']
+    assert resultado['filas_distintas'] == 0
+    assert resultado['diferencia_maxima'] == 0.0
+
+
+def test_filas_en_los_umbrales_crudos(modelos):
+    modelo, scaler, bosque, _ = modelos
+    crudas, _ = model_module.entradas_verificacion(scaler, bosque, MUESTRAS, SEMILLA)
+    # Después de las filas aleatorias: una feature exactamente en el umbral crudo y en el float64 siguiente
+    en_umbral = crudas[MUESTRAS:]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        esperado = modelo.predict_proba(scaler.transform(en_umbral))
+    assert np.array_equal(bosque.predict_proba_crudo(en_umbral), esperado)
+
+
+def test_una_fila_igual_que_en_el_lote(modelos):
+    _, scaler, bosque, _ = modelos
+    crudas, _ = model_module.entradas_verificacion(scaler, bosque, MUESTRAS, SEMILLA)
+    lote = bosque.predict_proba_crudo(crudas)
+    for i in range(0, len(crudas), 37):
+        assert np.array_equal(bosque.predict_proba_crudo(crudas[i]), lote[i:i + 1])
+
+
+def test_motor_de_la_app_igual_que_sklearn(modelos):
+    modelo, scaler, bosque, escalador = modelos
+    crudas, _ = model_module.entradas_verificacion(scaler, bosque, MUESTRAS, SEMILLA)
+    sklearn = model_module.crear_motor(modelo, scaler)
+    arreglos = model_module.crear_motor(bosque, escalador)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert np.array_equal(arreglos.predict_proba_crudo(crudas), sklearn.predict_proba_crudo(crudas))